@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML账户/交易id字典编码
+在数据读入时把账户id和交易id一次性映射为稠密整数编码，检测、评分、验证和可视化
+都在编码上做连接和比较，原始id只在输出时解码。
+
+编码规则：账户字典按账户id（字符串）排序，编码即账户id在字典中的下标；
+Spark侧 encode_account_ids 使用相同的排序，两边得到的账户编码一致。
+"""
+
+import numpy as np
+import pandas as pd
+
+# 账户id是8位数字字符串，交易id是字符串，读CSV时统一按字符串读取，避免被推断为整数
+ID_DTYPES = {
+    "account_id": str,
+    "src_account": str,
+    "dst_account": str,
+    "transaction_id": str
+}
+
+# 编码值为-1表示账户不在账户字典中
+UNKNOWN_CODE = -1
+
+# 数字账户号的取值范围不超过账户数的这个倍数时，按号码直接查表编码
+DENSE_LOOKUP_FACTOR = 4
+
+def read_csv_with_ids(path, **kwargs):
+    """读取CSV，id列按字符串读取"""
+    return pd.read_csv(path, dtype=ID_DTYPES, **kwargs)
+
+def build_account_dictionary(account_ids):
+    """建立账户字典: 去重后按账户id排序的pandas Index"""
+    unique_ids = pd.unique(np.asarray(account_ids, dtype=object))
+    return pd.Index(np.sort(unique_ids), dtype=object)
+
+def arrow_strings(ids):
+    """是否为pyarrow存储的字符串列（pandas 3 在安装pyarrow时的默认字符串类型）"""
+    return isinstance(ids, pd.Series) and getattr(ids.dtype, "storage", None) == "pyarrow"
+
+def fixed_width_numbers(ids):
+    """把pyarrow存储的等长纯数字id列解析为int64，返回 (id长度, 数值数组)；不是等长纯数字时返回None
+
+    等长数字串的数值顺序与字符串顺序一致，可以代替字符串做排序和查找。转换由Arrow直接完成，不经过Python字符串。
+    """
+    if not arrow_strings(ids):
+        return None
+    lengths = ids.str.len()
+    if len(ids) == 0 or ids.isna().any() or not ((lengths == lengths.iloc[0]).all() and ids.str.isdigit().all()):
+        return None
+    try:
+        # Arrow只接受ASCII数字，全角数字等会转换失败
+        return int(lengths.iloc[0]), ids.astype("int64[pyarrow]").to_numpy(dtype=np.int64)
+    except ValueError:
+        return None
+
+def encode_account_numbers(sorted_numbers, numbers):
+    """在升序排列的字典号码上编码账户号码，不在字典中的编码为-1
+
+    号码连续分配（取值范围不超过账户数的 DENSE_LOOKUP_FACTOR 倍）时直接按号码查表，否则二分查找。
+    """
+    low, span = sorted_numbers[0], sorted_numbers[-1] - sorted_numbers[0] + 1
+    if span <= DENSE_LOOKUP_FACTOR * len(sorted_numbers):
+        lookup = np.full(span, UNKNOWN_CODE, dtype=np.int32)
+        lookup[sorted_numbers - low] = np.arange(len(sorted_numbers), dtype=np.int32)
+        offsets = numbers - low
+        in_range = (offsets >= 0) & (offsets < span)
+        return np.where(in_range, lookup[np.where(in_range, offsets, 0)], UNKNOWN_CODE).astype(np.int32)
+    
+    codes = np.minimum(np.searchsorted(sorted_numbers, numbers), len(sorted_numbers) - 1)
+    return np.where(sorted_numbers[codes] == numbers, codes, UNKNOWN_CODE).astype(np.int32)
+
+def encode_accounts(dictionary, account_ids):
+    """将账户id编码为int32，不在字典中的账户编码为-1
+
+    pyarrow存储的id列与字典都是同样长度的数字串时（如8位账户号），解析为int64后按号码编码，
+    否则按字符串哈希查找。
+    """
+    numbers = fixed_width_numbers(account_ids)
+    if numbers is not None:
+        dictionary_numbers = fixed_width_numbers(
+            pd.Series(np.asarray(dictionary, dtype=object), dtype=account_ids.dtype)
+        )
+        if dictionary_numbers is not None and dictionary_numbers[0] == numbers[0]:
+            return encode_account_numbers(dictionary_numbers[1], numbers[1])
+    return dictionary.get_indexer(np.asarray(account_ids, dtype=object)).astype(np.int32)
+
+def decode_accounts(dictionary, codes):
+    """将账户编码还原为账户id"""
+    return np.asarray(dictionary, dtype=object)[np.asarray(codes)]
+
+def encode_frames(accounts_df, transactions_df):
+    """为账户表和交易表添加编码列
+
+    账户表添加 account_code；交易表添加 src_code, dst_code (int32) 和 transaction_code (int64，按行号)。
+    返回 (accounts_df, transactions_df, dictionary)。
+    """
+    dictionary = build_account_dictionary(accounts_df["account_id"])
+    accounts_df = accounts_df.assign(
+        account_code=encode_accounts(dictionary, accounts_df["account_id"])
+    )
+    transactions_df = transactions_df.assign(
+        src_code=encode_accounts(dictionary, transactions_df["src_account"]),
+        dst_code=encode_accounts(dictionary, transactions_df["dst_account"]),
+        transaction_code=np.arange(len(transactions_df), dtype=np.int64)
+    )
+    return accounts_df, transactions_df, dictionary
+
+def load_encoded_results(account_path="result/detected_account.csv",
+                         transaction_path="result/detected_transaction.csv"):
+    """加载检测结果并添加编码列，返回 (accounts_df, transactions_df, dictionary)"""
+    accounts_df = read_csv_with_ids(account_path)
+    transactions_df = read_csv_with_ids(transaction_path)
+    return encode_frames(accounts_df, transactions_df)
+
+def account_attribute(accounts_df, dictionary, column):
+    """按账户编码排列的账户属性数组 (下标即账户编码)，重复账户取第一次出现的值"""
+    first_rows = accounts_df.drop_duplicates("account_code").set_index("account_code")[column]
+    return first_rows.reindex(np.arange(len(dictionary))).to_numpy()
+
+def encode_account_ids(spark, accounts_df):
+    """Spark版账户字典: 返回 (account_id, id) DataFrame，编码顺序与账户id顺序一致"""
+    from pyspark.sql.types import StructType, StructField, LongType
+    
+    schema = StructType([
+        StructField("account_id", accounts_df.schema["account_id"].dataType, False),
+        StructField("id", LongType(), False)
+    ])
+    encoded = accounts_df.select("account_id").distinct().orderBy("account_id").rdd \
+        .zipWithIndex() \
+        .map(lambda pair: (pair[0][0], pair[1]))
+    return spark.createDataFrame(encoded, schema)
\ No newline at end of file
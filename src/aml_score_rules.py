@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML风险评分规则
+评分规则以数据形式定义，由 evaluate_rules (pandas) 或 spark_rule_columns (Spark)
+编译为对每账户特征表的一次列式计算。特征表由评分引擎预先计算，每行一个账户，列见 FEATURE_COLUMNS。
+新增规则只需在 SCORE_RULES 中加一项（用到新特征时再在特征表中加一列），不需要再扫描一遍交易。
+"""
+
+from string import Formatter
+import numpy as np
+import pandas as pd
+
+# 定义高危国家
+HIGH_RISK_COUNTRIES = ["高危国1", "高危国2", "高危国3"]
+
+# 多国交易特征: 特征列 -> 金额阈值，特征值为与本账户国家不同、交易总额超过阈值的对手方国家数
+COUNTRY_AMOUNT_FEATURES = {
+    "countries_over_50k": 50000,
+    "countries_over_100k": 100000
+}
+
+# 高频交易日特征: 每个账户取高频交易日中金额最大的一天（金额相同取较早的一天），
+# 高频交易日的各档 (笔数, 金额) 由规则条件得到，见 busy_day_thresholds
+BUSY_DAY_FEATURES = ("max_day_count", "max_day_amount")
+
+# 特征表中的特征列（账户表原有的列也可以在规则中直接使用）
+FEATURE_COLUMNS = [
+    "high_risk_trans_count",
+    *COUNTRY_AMOUNT_FEATURES,
+    "max_day_date", "max_day_count", "max_day_amount"
+]
+
+# 评分规则，按评分详情中的顺序排列:
+#   group       规则组，同组规则按顺序只取第一条命中的（分档），组得分列为 <group>_score
+#   conditions  命中条件，全部满足才命中: (特征, 运算, 值)，运算为 > >= < <= == != in / not in
+#   points      命中得分；或 per_unit: (特征, 每单位分数) 按特征值计分，cap 为最高分
+#   detail      评分详情模板 (str.format)，可引用特征列和 points
+SCORE_RULES = [
+    {
+        "group": "high_risk_country",
+        "conditions": [("country", "in", HIGH_RISK_COUNTRIES)],
+        "points": 40,
+        "detail": "高危国家账户: +{points}分"
+    },
+    {
+        "group": "high_risk_trans",
+        "conditions": [("country", "not in", HIGH_RISK_COUNTRIES), ("high_risk_trans_count", ">", 0)],
+        "per_unit": ("high_risk_trans_count", 10),
+        "cap": 40,
+        "detail": "涉及高危国家交易 {high_risk_trans_count} 笔: +{points}分"
+    },
+    {
+        "group": "multi_country",
+        "conditions": [("countries_over_100k", ">", 6)],
+        "points": 40,
+        "detail": "与{countries_over_100k}个国家交易超过10万: +{points}分"
+    },
+    {
+        "group": "multi_country",
+        "conditions": [("countries_over_50k", ">", 4)],
+        "points": 20,
+        "detail": "与{countries_over_50k}个国家交易超过5万: +{points}分"
+    },
+    {
+        "group": "velocity",
+        "conditions": [("max_day_count", ">", 20), ("max_day_amount", ">", 100000)],
+        "points": 30,
+        "detail": "单日交易{max_day_count}笔金额{max_day_amount:,.0f}: +{points}分"
+    },
+    {
+        "group": "velocity",
+        "conditions": [("max_day_count", ">", 10), ("max_day_amount", ">", 50000)],
+        "points": 15,
+        "detail": "单日交易{max_day_count}笔金额{max_day_amount:,.0f}: +{points}分"
+    },
+    {
+        "group": "detection",
+        "conditions": [("detected_suspicious", "==", True), ("detected_suspicious_role", "==", "洗钱者")],
+        "points": 100,
+        "detail": "检测为洗钱者({detected_suspicious_type}): +{points}分"
+    },
+    {
+        "group": "detection",
+        "conditions": [("detected_suspicious", "==", True), ("detected_suspicious_role", "==", "协助者")],
+        "points": 50,
+        "detail": "检测为协助者({detected_suspicious_type}): +{points}分"
+    }
+]
+
+# 没有命中任何规则时的评分详情
+NO_RISK_DETAIL = "无风险因子"
+
+def busy_day_thresholds(rules=SCORE_RULES):
+    """由规则中的 max_day_count > 笔数、max_day_amount > 金额 条件得到高频交易日的各档 (笔数, 金额)
+
+    当天交易笔数和金额同时超过任一档即为高频交易日，阈值只在规则中定义一次。
+    引用 max_day_* 特征的规则必须同时包含这两个 > 条件，否则特征取到的那一天与规则不一致。
+    """
+    thresholds = []
+    for rule in rules:
+        conditions = [(feature, operator, value) for feature, operator, value in rule["conditions"]
+                      if feature in BUSY_DAY_FEATURES]
+        if not conditions:
+            continue
+        limits = {feature: value for feature, operator, value in conditions if operator == ">"}
+        if len(conditions) != len(BUSY_DAY_FEATURES) or set(limits) != set(BUSY_DAY_FEATURES):
+            raise ValueError(f"{rule['group']} 规则的高频交易日条件须为 max_day_count > 笔数 且 max_day_amount > 金额")
+        thresholds.append(tuple(limits[feature] for feature in BUSY_DAY_FEATURES))
+    return thresholds
+
+BUSY_DAY_THRESHOLDS = busy_day_thresholds()
+
+def rule_groups(rules=SCORE_RULES):
+    """按首次出现顺序列出规则组"""
+    return list(dict.fromkeys(rule["group"] for rule in rules))
+
+def score_columns(rules=SCORE_RULES):
+    """各规则组得分列名"""
+    return [f"{group}_score" for group in rule_groups(rules)]
+
+def template_fields(template):
+    """评分详情模板中引用的列: [(字面文本, 列名, 格式)]，列名为None表示只有字面文本"""
+    return [(literal, field, spec) for literal, field, spec, _ in Formatter().parse(template)]
+
+def condition_mask(features, feature, operator, value):
+    """pandas: 单个条件的布尔数组，缺失值与Python中的比较结果一致（in 为False，not in 为True）"""
+    column = features[feature]
+    if operator == "in":
+        return column.isin(value).to_numpy()
+    if operator == "not in":
+        return ~column.isin(value).to_numpy()
+    if operator == "==" and isinstance(value, bool):
+        # 布尔条件按真值判断
+        return column.astype(bool).to_numpy() == value
+    compare = {
+        ">": column.gt, ">=": column.ge, "<": column.lt,
+        "<=": column.le, "==": column.eq, "!=": column.ne
+    }[operator]
+    return compare(value).fillna(operator == "!=").to_numpy(dtype=bool)
+
+def rule_points(features, rule):
+    """pandas: 规则命中时每个账户的得分"""
+    if "per_unit" not in rule:
+        return np.full(len(features), rule["points"], dtype=np.int64)
+    feature, unit = rule["per_unit"]
+    points = features[feature].to_numpy(dtype=np.int64) * unit
+    return np.minimum(points, rule["cap"]) if "cap" in rule else points
+
+def format_details(features, rule, points, rows):
+    """pandas: 只对命中的账户行按模板格式化评分详情"""
+    fields = [field for _, field, _ in template_fields(rule["detail"]) if field and field != "points"]
+    columns = [features[field].to_numpy()[rows] for field in fields]
+    return [
+        rule["detail"].format(points=row_points, **dict(zip(fields, values)))
+        for row_points, *values in zip(points[rows], *columns)
+    ]
+
+def evaluate_rules(features, rules=SCORE_RULES):
+    """pandas: 对特征表一次列式计算所有规则
+
+    返回 (各规则组得分 DataFrame，列为 <group>_score; 总分数组; 评分详情数组)，行与特征表一一对应。
+    """
+    group_scores = {group: np.zeros(len(features), dtype=np.int64) for group in rule_groups(rules)}
+    unmatched = {group: np.ones(len(features), dtype=bool) for group in group_scores}
+    details = [[] for _ in range(len(features))]
+    
+    for rule in rules:
+        group = rule["group"]
+        matched = unmatched[group].copy()
+        for feature, operator, value in rule["conditions"]:
+            matched &= condition_mask(features, feature, operator, value)
+        unmatched[group] &= ~matched
+        
+        points = rule_points(features, rule)
+        group_scores[group] += np.where(matched, points, 0)
+        
+        rows = np.flatnonzero(matched)
+        for row, detail in zip(rows, format_details(features, rule, points, rows)):
+            details[row].append(detail)
+    
+    scores = pd.DataFrame({f"{group}_score": score for group, score in group_scores.items()}, index=features.index)
+    total_score = scores.sum(axis=1).to_numpy(dtype=np.int64)
+    score_details = np.array(["; ".join(parts) if parts else NO_RISK_DETAIL for parts in details], dtype=object)
+    return scores, total_score, score_details
+
+def spark_condition(feature, operator, value):
+    """Spark: 单个条件的布尔列，缺失值的处理与pandas版一致"""
+    from pyspark.sql import functions as F
+    
+    column = F.col(feature)
+    if operator == "in":
+        return F.coalesce(column.isin(value), F.lit(False))
+    if operator == "not in":
+        return ~F.coalesce(column.isin(value), F.lit(False))
+    condition = {
+        ">": column > value, ">=": column >= value, "<": column < value,
+        "<=": column <= value, "==": column == value, "!=": column != value
+    }[operator]
+    return F.coalesce(condition, F.lit(operator == "!="))
+
+def spark_template(template, points):
+    """Spark: 把评分详情模板编译为字符串列，格式 ',.Nf' 对应 format_number，缺失值显示为nan"""
+    from pyspark.sql import functions as F
+    
+    parts = []
+    for literal, field, spec in template_fields(template):
+        if literal:
+            parts.append(F.lit(literal))
+        if field is None:
+            continue
+        column = points if field == "points" else F.col(field)
+        if spec.startswith(",."):
+            column = F.format_number(column, int(spec[2:].rstrip("f")))
+        elif spec:
+            column = F.format_string(f"%{spec}", column)
+        parts.append(F.coalesce(column.cast("string"), F.lit("nan")))
+    return F.concat(*parts)
+
+def spark_rule_columns(rules=SCORE_RULES):
+    """Spark: 把所有规则编译为列表达式
+
+    返回 [(列名, 列表达式)]: 各规则组得分列、total_score 和 score_details，
+    依次 withColumn 后在同一个投影中完成计算。
+    """
+    from pyspark.sql import functions as F
+    
+    group_scores = {}
+    group_matched = {}
+    details = []
+    
+    for rule in rules:
+        group = rule["group"]
+        matched = F.lit(True)
+        for feature, operator, value in rule["conditions"]:
+            matched = matched & spark_condition(feature, operator, value)
+        
+        if "per_unit" in rule:
+            feature, unit = rule["per_unit"]
+            points = F.col(feature) * unit
+            if "cap" in rule:
+                points = F.least(points, F.lit(rule["cap"]))
+        else:
+            points = F.lit(rule["points"])
+        
+        # 同组中前面的规则已命中时不再命中
+        if group in group_matched:
+            matched = ~group_matched[group] & matched
+            group_scores[group] = group_scores[group].when(matched, points)
+            group_matched[group] = group_matched[group] | matched
+        else:
+            group_scores[group] = F.when(matched, points)
+            group_matched[group] = matched
+        
+        details.append(F.when(matched, spark_template(rule["detail"], points)))
+    
+    columns = [
+        (f"{group}_score", score.otherwise(0).cast("int")) for group, score in group_scores.items()
+    ]
+    total_score = sum((F.col(name) for name, _ in columns[1:]), F.col(columns[0][0]))
+    score_details = F.concat_ws("; ", *details)
+    columns.append(("total_score", total_score))
+    columns.append(("score_details", F.when(score_details == "", F.lit(NO_RISK_DETAIL)).otherwise(score_details)))
+    return columns
\ No newline at end of file
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML流水线阶段缓存
+数据生成、模式检测、风险评分、可视化、结果验证五个阶段运行前，根据输入文件内容、
+运行参数和阶段代码计算指纹，指纹记录在输出旁的 .<阶段名>.fingerprint.json 中：
+- 指纹未变且输出仍在：跳过该阶段
+- 指纹有变化但缓存目录中有该指纹的输出（如参数改回旧值）：从缓存恢复输出
+- 否则运行该阶段，成功后把输出复制到缓存目录，缓存总大小超过上限时按最近使用时间淘汰
+
+环境变量：
+AML_NO_CACHE=1          强制重新运行，不读取也不写入缓存
+AML_CACHE_DIR           缓存目录 (默认 .aml_cache)
+AML_CACHE_MAX_BYTES     缓存目录大小上限 (默认1GB)
+"""
+
+from datetime import datetime
+import hashlib
+import json
+import os
+import shutil
+import time
+
+CACHE_DIR = os.environ.get("AML_CACHE_DIR", ".aml_cache")
+CACHE_MAX_BYTES = int(os.environ.get("AML_CACHE_MAX_BYTES", 1 << 30))
+
+def source_file(module_name):
+    """src目录下模块的源文件路径，用作阶段代码指纹"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{module_name}.py")
+
+def iter_files(path):
+    """按固定顺序列出路径下的所有文件（路径本身是文件时只返回它），不存在时不返回"""
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+def compute_fingerprint(stage, inputs=(), params=None, code_files=()):
+    """计算阶段指纹: 阶段名 + 参数 + 输入文件内容 + 阶段代码内容的SHA-256"""
+    hasher = hashlib.sha256()
+    hasher.update(stage.encode("utf-8"))
+    hasher.update(json.dumps(params or {}, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8"))
+    
+    for group, paths in [("input", inputs), ("code", code_files)]:
+        for path in paths:
+            hasher.update(f"{group}:{path}".encode("utf-8"))
+            for file_path in iter_files(path):
+                # 代码文件只按内容计算，输入文件同时记录相对路径
+                if group == "input":
+                    hasher.update(os.path.relpath(file_path, path).encode("utf-8"))
+                with open(file_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b""):
+                        hasher.update(chunk)
+    
+    return hasher.hexdigest()
+
+def fingerprint_path(stage, outputs):
+    """指纹文件放在第一个输出所在的目录"""
+    output_dir = os.path.dirname(os.path.normpath(outputs[0])) or "."
+    return os.path.join(output_dir, f".{stage}.fingerprint.json")
+
+def read_fingerprint(stage, outputs):
+    """读取上次成功运行记录的指纹，没有记录时返回None"""
+    path = fingerprint_path(stage, outputs)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f).get("fingerprint")
+
+def write_fingerprint(stage, outputs, fingerprint, params):
+    """记录本次运行的指纹"""
+    path = fingerprint_path(stage, outputs)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        "stage": stage,
+        "fingerprint": fingerprint,
+        "params": params or {},
+        "outputs": list(outputs),
+        "updated_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(record, f, ensure_ascii=False, indent=2, default=str)
+
+def remove_fingerprint(stage, outputs):
+    """运行前删除旧指纹，运行失败时不会留下与输出不符的记录"""
+    path = fingerprint_path(stage, outputs)
+    if os.path.exists(path):
+        os.remove(path)
+
+def outputs_exist(outputs):
+    """所有输出都存在"""
+    return all(os.path.exists(path) for path in outputs)
+
+def outputs_written_since(outputs, start_time):
+    """所有输出都在start_time之后写出（阶段脚本内部捕获异常，用输出时间判断是否运行成功）"""
+    for path in outputs:
+        files = list(iter_files(path))
+        if not files or any(os.path.getmtime(file_path) < start_time for file_path in files):
+            return False
+    return True
+
+def cache_entry_dir(fingerprint):
+    return os.path.join(CACHE_DIR, fingerprint)
+
+def copy_path(source, target):
+    """复制文件或目录，目标已存在时先删除"""
+    if os.path.isdir(target):
+        shutil.rmtree(target)
+    elif os.path.exists(target):
+        os.remove(target)
+    
+    parent = os.path.dirname(target)
+    if parent:
+        os.makedirs(parent, exist_ok=True)
+    if os.path.isdir(source):
+        shutil.copytree(source, target)
+    else:
+        shutil.copy2(source, target)
+
+def touch_cache_entry(fingerprint):
+    """更新缓存条目的最近使用时间"""
+    manifest_path = os.path.join(cache_entry_dir(fingerprint), "manifest.json")
+    if os.path.exists(manifest_path):
+        os.utime(manifest_path)
+
+def store_in_cache(fingerprint, outputs):
+    """把阶段输出复制到缓存目录，按输出顺序编号保存"""
+    entry_dir = cache_entry_dir(fingerprint)
+    if os.path.isdir(entry_dir):
+        shutil.rmtree(entry_dir)
+    os.makedirs(entry_dir)
+    
+    for index, path in enumerate(outputs):
+        copy_path(path, os.path.join(entry_dir, str(index)))
+    with open(os.path.join(entry_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"outputs": list(outputs)}, f, ensure_ascii=False, indent=2)
+
+def restore_from_cache(fingerprint, outputs):
+    """从缓存恢复阶段输出，缓存中没有该指纹时返回False"""
+    entry_dir = cache_entry_dir(fingerprint)
+    manifest_path = os.path.join(entry_dir, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return False
+    
+    with open(manifest_path, "r", encoding="utf-8") as f:
+        cached_outputs = json.load(f)["outputs"]
+    if cached_outputs != list(outputs):
+        return False
+    
+    for index, path in enumerate(outputs):
+        copy_path(os.path.join(entry_dir, str(index)), path)
+    touch_cache_entry(fingerprint)
+    return True
+
+def directory_size(path):
+    return sum(os.path.getsize(file_path) for file_path in iter_files(path))
+
+def evict_cache(max_bytes=CACHE_MAX_BYTES):
+    """缓存目录超过大小上限时，按最近使用时间从旧到新删除缓存条目"""
+    if not os.path.isdir(CACHE_DIR):
+        return
+    
+    entries = []
+    for name in os.listdir(CACHE_DIR):
+        manifest_path = os.path.join(CACHE_DIR, name, "manifest.json")
+        last_used = os.path.getmtime(manifest_path) if os.path.exists(manifest_path) else 0
+        entries.append((last_used, name, directory_size(os.path.join(CACHE_DIR, name))))
+    
+    total_bytes = 0
+    for _, _, size in entries:
+        total_bytes += size
+    
+    for _, name, size in sorted(entries):
+        if total_bytes <= max_bytes:
+            break
+        shutil.rmtree(os.path.join(CACHE_DIR, name))
+        total_bytes -= size
+        print(f"[缓存] 淘汰最久未使用的缓存条目 {name[:12]} ({size / 1024 / 1024:.1f} MB)")
+
+def run_stage(stage, run, inputs=(), outputs=(), params=None, code_files=()):
+    """按指纹运行阶段，返回是否真正执行了run
+
+    inputs/outputs/code_files 为文件或目录路径，params 为影响输出的参数（需可JSON序列化）。
+    """
+    if os.environ.get("AML_NO_CACHE"):
+        run()
+        return True
+    
+    fingerprint = compute_fingerprint(stage, inputs, params, code_files)
+    
+    if read_fingerprint(stage, outputs) == fingerprint and outputs_exist(outputs):
+        print(f"[缓存] {stage}: 输入、参数和代码均未变化，跳过 (指纹 {fingerprint[:12]})")
+        touch_cache_entry(fingerprint)
+        return False
+    
+    if restore_from_cache(fingerprint, outputs):
+        write_fingerprint(stage, outputs, fingerprint, params)
+        print(f"[缓存] {stage}: 从缓存恢复输出，跳过 (指纹 {fingerprint[:12]})")
+        return False
+    
+    remove_fingerprint(stage, outputs)
+    start_time = time.time()
+    run()
+    
+    if not outputs_written_since(outputs, start_time):
+        print(f"[缓存] {stage}: 输出未全部更新，不记录指纹")
+        return True
+    
+    write_fingerprint(stage, outputs, fingerprint, params)
+    store_in_cache(fingerprint, outputs)
+    evict_cache()
+    return True
\ No newline at end of file
@@ -9,8 +9,17 @@ AML模式分析脚本 - 使用Spark GraphFrame进行模式匹配
 from pyspark.sql import SparkSession
 from pyspark.sql.functions import *
 from pyspark.sql.types import *
-import pandas as pd
+from pyspark import SparkContext, StorageLevel
+from aml_id_codec import encode_account_ids
+from aml_stage_cache import run_stage, source_file, compute_fingerprint
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import argparse
+import json
+import math
 import os
+import shutil
+import time
 
 def create_spark_session():
     """创建Spark会话 - Java 8兼容版本"""
@@ -22,369 +31,957 @@ def create_spark_session():
         .config("spark.sql.adaptive.enabled", "true") \
         .config("spark.sql.adaptive.coalescePartitions.enabled", "true") \
         .config("spark.serializer", "org.apache.spark.serializer.KryoSerializer") \
+        .config("spark.scheduler.mode", "FAIR") \
         .getOrCreate()
     
     spark.sparkContext.setLogLevel("WARN")
     return spark
 
-def load_data(spark):
-    """加载数据"""
-    print("加载账户和交易数据...")
+# 账户数据的显式schema，避免inferSchema额外扫描一遍文件
+ACCOUNT_SCHEMA = StructType([
+    StructField("account_id", StringType(), False),
+    StructField("owner_name", StringType(), True),
+    StructField("registration_date", DateType(), True),
+    StructField("country", StringType(), True),
+    StructField("is_suspicious", BooleanType(), True),
+    StructField("suspicious_type", StringType(), True),
+    StructField("suspicious_role", StringType(), True)
+])
+
+# 交易数据的显式schema
+TRANSACTION_SCHEMA = StructType([
+    StructField("transaction_id", StringType(), False),
+    StructField("src_account", StringType(), False),
+    StructField("src_account_country", StringType(), True),
+    StructField("dst_account", StringType(), False),
+    StructField("dst_account_country", StringType(), True),
+    StructField("amount", DoubleType(), True),
+    StructField("currency", StringType(), True),
+    StructField("value_date", TimestampType(), True),
+    StructField("is_suspicious", BooleanType(), True),
+    StructField("suspicious_type", StringType(), True)
+])
+
+def read_csv_with_schema(spark, path, schema):
+    """按显式schema读取CSV文件"""
+    return spark.read \
+        .option("header", "true") \
+        .option("timestampFormat", "yyyy-MM-dd HH:mm:ss") \
+        .option("dateFormat", "yyyy-MM-dd") \
+        .schema(schema) \
+        .csv(path)
+
+def convert_csv_to_parquet(spark, csv_dir="mock_data", parquet_dir="mock_data/parquet"):
+    """将现有CSV数据一次性转换为Parquet，交易数据按交易日期分区"""
+    print(f"转换CSV数据为Parquet: {csv_dir} -> {parquet_dir}")
     
-    # 加载账户数据
-    accounts_df = spark.read.option("header", "true").option("inferSchema", "true").csv("mock_data/account.csv")
+    accounts_df = read_csv_with_schema(spark, os.path.join(csv_dir, "account.csv"), ACCOUNT_SCHEMA)
+    transactions_df = read_csv_with_schema(spark, os.path.join(csv_dir, "transaction.csv"), TRANSACTION_SCHEMA)
     
-    # 加载交易数据
-    transactions_df = spark.read.option("header", "true").option("inferSchema", "true").csv("mock_data/transaction.csv")
+    accounts_df.write.mode("overwrite").parquet(os.path.join(parquet_dir, "account"))
+    
+    transactions_df \
+        .withColumn("transaction_date", to_date(col("value_date"))) \
+        .repartition(col("transaction_date")) \
+        .write.mode("overwrite") \
+        .partitionBy("transaction_date") \
+        .parquet(os.path.join(parquet_dir, "transaction"))
+    
+    print("Parquet转换完成")
+
+def load_data(spark, source="csv", data_dir="mock_data", start_date=None, end_date=None):
+    """加载数据
+
+    source="csv" 按显式schema读取 data_dir 下的CSV；source="parquet" 读取
+    convert_csv_to_parquet 生成的按交易日期分区的Parquet，start_date/end_date
+    （yyyy-MM-dd）会下推为分区裁剪，检测只读取用到的列。
+    """
+    print("加载账户和交易数据...")
     
-    print(f"账户数据: {accounts_df.count()} 条")
-    print(f"交易数据: {transactions_df.count()} 条")
+    if source == "parquet":
+        # 加载账户数据
+        accounts_df = spark.read.parquet(os.path.join(data_dir, "account"))
+        
+        # 加载交易数据，按日期范围裁剪分区
+        transactions_df = spark.read.parquet(os.path.join(data_dir, "transaction"))
+        if start_date:
+            transactions_df = transactions_df.filter(col("transaction_date") >= lit(start_date).cast("date"))
+        if end_date:
+            transactions_df = transactions_df.filter(col("transaction_date") <= lit(end_date).cast("date"))
+        transactions_df = transactions_df.select(*TRANSACTION_SCHEMA.fieldNames())
+    else:
+        # 加载账户数据
+        accounts_df = read_csv_with_schema(spark, os.path.join(data_dir, "account.csv"), ACCOUNT_SCHEMA)
+        
+        # 加载交易数据
+        transactions_df = read_csv_with_schema(spark, os.path.join(data_dir, "transaction.csv"), TRANSACTION_SCHEMA)
+        if start_date:
+            transactions_df = transactions_df.filter(to_date(col("value_date")) >= lit(start_date).cast("date"))
+        if end_date:
+            transactions_df = transactions_df.filter(to_date(col("value_date")) <= lit(end_date).cast("date"))
     
     return accounts_df, transactions_df
 
-def create_graph(spark, accounts_df, transactions_df):
-    """创建图结构"""
-    print("创建图结构...")
+def create_graph(spark, accounts_df, transactions_df, checkpoint_dir=None):
+    """创建所有检测共享的精简检测图
+
+    顶点只保留 id(账户编码), country；边只保留 src, dst(账户编码), edge_id(交易编码),
+    amount, value_ts(交易时间戳), transaction_date(自1970-01-01起的天数)。
+    图只构建一次并以MEMORY_AND_DISK持久化（可选checkpoint截断血缘），
+    账户名称等展示属性只在最终命中结果上通过编码字典关联回来。
+    返回 (graph, id_dictionary)，id_dictionary 包含 accounts 和 transactions 两个编码字典。
+    """
+    print("创建检测图结构...")
     
     # 确保库已正确安装后再导入
     from graphframes import GraphFrame
     
+    # 账户和交易的整数编码字典
+    account_codes = encode_account_ids(spark, accounts_df).persist(StorageLevel.MEMORY_AND_DISK)
+    transaction_codes = transactions_df.select(
+        col("transaction_id"),
+        col("src_account"),
+        col("dst_account"),
+        col("amount"),
+        col("value_date")
+    ).withColumn("edge_id", monotonically_increasing_id()) \
+        .persist(StorageLevel.MEMORY_AND_DISK)
+    
     # 准备顶点数据（账户）
-    vertices = accounts_df.select(
-        col("account_id").alias("id"),
-        col("owner_name"),
-        col("country"),
-        col("registration_date")
+    vertices = accounts_df.join(account_codes, "account_id").select(
+        col("id"),
+        col("country")
     )
     
     # 准备边数据（交易）- 添加日期信息用于模式匹配
-    edges = transactions_df.select(
-        col("src_account").alias("src"),
-        col("dst_account").alias("dst"),
-        col("transaction_id"),
-        col("amount"),
-        col("value_date"),
-        to_date(col("value_date"), "yyyy-MM-dd HH:mm:ss").alias("transaction_date"),
-        col("currency")
-    )
+    # 按 (交易日期, 转出账户) 分区，单日的边也分散到多个任务；所有检测都按 (账户, 日期) 连接，不会产生跨日的中间结果
+    src_codes = account_codes.select(col("account_id").alias("src_account"), col("id").alias("src"))
+    dst_codes = account_codes.select(col("account_id").alias("dst_account"), col("id").alias("dst"))
+    edges = transaction_codes \
+        .join(src_codes, "src_account") \
+        .join(dst_codes, "dst_account") \
+        .select(
+            col("src"),
+            col("dst"),
+            col("edge_id"),
+            col("amount"),
+            unix_timestamp(col("value_date")).alias("value_ts"),
+            datediff(to_date(col("value_date")), lit("1970-01-01")).alias("transaction_date")
+        ).repartition(col("transaction_date"), col("src")) \
+        .sortWithinPartitions("transaction_date", "src")
+    
+    vertices = vertices.persist(StorageLevel.MEMORY_AND_DISK)
+    edges = edges.persist(StorageLevel.MEMORY_AND_DISK)
+    if checkpoint_dir:
+        spark.sparkContext.setCheckpointDir(checkpoint_dir)
+        vertices = vertices.checkpoint()
+        edges = edges.checkpoint()
     
     # 创建图
     graph = GraphFrame(vertices, edges)
+    id_dictionary = {
+        "accounts": account_codes,
+        "transactions": transaction_codes.select("edge_id", "transaction_id")
+    }
+    
+    return graph, id_dictionary
+
+# 检测结果的账户级和交易级schema（账户和交易均为编码后的值）
+# 所有规则都限定在同一天内，账户命中带上命中日期，增量检测按日期保存和替换命中结果
+DETECTED_ACCOUNT_SCHEMA = StructType([
+    StructField("id", LongType(), False),
+    StructField("detected_suspicious_type", StringType(), False),
+    StructField("suspicious_role", StringType(), False),
+    StructField("transaction_date", IntegerType(), False)
+])
+
+DETECTED_TRANSACTION_SCHEMA = StructType([
+    StructField("edge_id", LongType(), False),
+    StructField("detected_suspicious_type", StringType(), False)
+])
+
+def empty_detections(spark):
+    """没有命中时返回的空检测结果"""
+    return (
+        spark.createDataFrame([], DETECTED_ACCOUNT_SCHEMA),
+        spark.createDataFrame([], DETECTED_TRANSACTION_SCHEMA)
+    )
+
+def build_amount_edge_index(edges, amount_tolerance_pct=0.0, amount_tolerance_abs=0.0):
+    """建立按 (交易日期, 金额桶) 分区的边索引
+
+    不设容差时金额桶即精确到分的金额；设置相对容差（如0.005表示±0.5%）时使用对数分桶，
+    设置绝对容差（如5元手续费）时使用等宽分桶。容差内的两笔金额最多相差一个桶，
+    因此只需探测相邻桶即可，不需要非等值连接。
+    """
+    if amount_tolerance_pct > 0 and amount_tolerance_abs > 0:
+        raise ValueError("amount_tolerance_pct 和 amount_tolerance_abs 只能设置其中一个")
+    
+    if amount_tolerance_pct > 0:
+        bucket_width = -math.log1p(-amount_tolerance_pct)
+        amount_bucket = floor(log(col("amount")) / lit(bucket_width))
+    elif amount_tolerance_abs > 0:
+        amount_bucket = floor(col("amount") / lit(amount_tolerance_abs))
+    else:
+        amount_bucket = round(col("amount") * 100)
     
-    print(f"图顶点数: {graph.vertices.count()}")
-    print(f"图边数: {graph.edges.count()}")
+    return edges.filter(col("amount") > 0) \
+        .withColumn("amount_bucket", amount_bucket.cast("long")) \
+        .repartition(col("transaction_date"), col("amount_bucket"))
+
+def amount_probe_buckets(bucket, tolerant):
+    """需要探测的金额桶: 精确匹配只探测本桶，有容差时同时探测相邻桶"""
+    if tolerant:
+        return array(bucket - 1, bucket, bucket + 1)
+    return array(bucket)
+
+def amount_within_tolerance(prev_amount, next_amount, amount_tolerance_pct=0.0, amount_tolerance_abs=0.0):
+    """相邻两跳的金额是否在容差范围内"""
+    if amount_tolerance_pct > 0:
+        return abs(next_amount - prev_amount) <= prev_amount * amount_tolerance_pct
+    if amount_tolerance_abs > 0:
+        return abs(next_amount - prev_amount) <= amount_tolerance_abs
+    return next_amount == prev_amount
+
+def prune_cycle_edges(edge_index, tolerant=False):
+    """剪除不可能位于同日等额闭环上的边
+
+    边的源账户必须在同日、同金额桶（或相邻桶）下有入边，目标账户必须有对应的出边。
+    """
+    candidate_edges = edge_index.filter(col("src") != col("dst"))
     
-    return graph
+    has_in = candidate_edges.select(
+        col("dst").alias("src"),
+        col("transaction_date"),
+        explode(amount_probe_buckets(col("amount_bucket"), tolerant)).alias("amount_bucket")
+    ).distinct()
+    has_out = candidate_edges.select(
+        col("src").alias("dst"),
+        col("transaction_date"),
+        explode(amount_probe_buckets(col("amount_bucket"), tolerant)).alias("amount_bucket")
+    ).distinct()
+    
+    return candidate_edges \
+        .join(has_in, ["src", "transaction_date", "amount_bucket"], "left_semi") \
+        .join(has_out, ["dst", "transaction_date", "amount_bucket"], "left_semi")
+
+# (账户, 日期) 复合顶点编码: 账户编码 * DAY_VERTEX_SPAN + 交易日期（自1970-01-01起的天数）
+DAY_VERTEX_SPAN = 1 << 16
+
+def prune_by_daily_degree(edges, max_iterations=10):
+    """迭代剪除当天入度或出度为0的账户上的边，直到边数不再变化
 
-def detect_circular_patterns_with_graphframe(spark, graph):
-    """使用GraphFrame检测循环闭环交易模式"""
-    print("使用GraphFrame检测循环闭环交易模式...")
+    账户只有在同一天既有入边又有出边时才可能位于当天的闭环上；
+    每轮剪除后会产生新的零度账户，因此反复执行。每轮结果做localCheckpoint截断血缘。
+    返回 (剩余边, 剩余边数)。
+    """
+    remaining = edges.filter(col("src") != col("dst"))
+    remaining_count = remaining.count()
     
-    detected_accounts = []
-    detected_transactions = []
+    for _ in range(max_iterations):
+        has_in = remaining.select(col("dst").alias("src"), col("transaction_date")).distinct()
+        has_out = remaining.select(col("src").alias("dst"), col("transaction_date")).distinct()
+        pruned = remaining \
+            .join(has_in, ["src", "transaction_date"], "left_semi") \
+            .join(has_out, ["dst", "transaction_date"], "left_semi") \
+            .localCheckpoint()
+        pruned_count = pruned.count()
+        converged = pruned_count == remaining_count
+        remaining, remaining_count = pruned, pruned_count
+        if converged:
+            break
     
-    # 使用GraphFrame的find方法查找三角形循环模式: (a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(a)
-    print("查找三角形循环模式...")
-    triangles = graph.find("(a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(a)") \
-        .filter("e1.transaction_date = e2.transaction_date AND e2.transaction_date = e3.transaction_date") \
-        .filter("e1.amount = e2.amount AND e2.amount = e3.amount") \
-        .filter("a.id != b.id AND b.id != c.id AND c.id != a.id")
+    return remaining, remaining_count
+
+def restrict_to_daily_sccs(edges, min_size=3, max_iterations=10):
+    """只保留位于当天非平凡强连通分量内的边
+
+    以 (账户, 日期) 为复合顶点构图，用GraphFrames stronglyConnectedComponents求强连通分量，
+    边的两端必须在同一分量内，且分量至少包含min_size个顶点（闭环至少经过min_size个账户）。
+    """
+    # 确保库已正确安装后再导入
+    from graphframes import GraphFrame
     
-    triangle_results = triangles.collect()
-    print(f"找到 {len(triangle_results)} 个三角形循环")
+    day_edges = edges.select(
+        (col("src") * DAY_VERTEX_SPAN + col("transaction_date")).alias("src"),
+        (col("dst") * DAY_VERTEX_SPAN + col("transaction_date")).alias("dst"),
+        col("edge_id")
+    )
+    day_vertices = day_edges.select(col("src").alias("id")) \
+        .union(day_edges.select(col("dst").alias("id"))) \
+        .distinct()
     
-    for result in triangle_results:
-        # 获取账户和交易信息
-        accounts = [result['a']['id'], result['b']['id'], result['c']['id']]
-        transactions = [result['e1']['transaction_id'], result['e2']['transaction_id'], result['e3']['transaction_id']]
-        
-        # 确定洗钱者（第一个发起交易的账户，基于时间戳）
-        trans_times = [
-            (result['e1']['value_date'], result['a']['id']),
-            (result['e2']['value_date'], result['b']['id']),
-            (result['e3']['value_date'], result['c']['id'])
-        ]
-        trans_times.sort(key=lambda x: x[0])
-        money_launderer = trans_times[0][1]
-        
-        # 标记账户
-        for account in accounts:
-            role = "洗钱者" if account == money_launderer else "协助者"
-            detected_accounts.append({
-                "account_id": account,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "循环闭环交易",
-                "suspicious_role": role
-            })
+    components = GraphFrame(day_vertices, day_edges).stronglyConnectedComponents(maxIter=max_iterations)
+    large_components = components.groupBy("component").agg(count("*").alias("size")) \
+        .filter(col("size") >= min_size)
+    components = components.join(large_components, "component").select("id", "component")
+    
+    src_components = components.select(col("id").alias("src_vertex"), col("component"))
+    dst_components = components.select(col("id").alias("dst_vertex"), col("component"))
+    return edges \
+        .withColumn("src_vertex", col("src") * DAY_VERTEX_SPAN + col("transaction_date")) \
+        .withColumn("dst_vertex", col("dst") * DAY_VERTEX_SPAN + col("transaction_date")) \
+        .join(src_components, "src_vertex") \
+        .join(dst_components, ["dst_vertex", "component"]) \
+        .drop("src_vertex", "dst_vertex", "component")
+
+def restrict_to_cycle_candidates(edges, min_length=3, max_iterations=10):
+    """闭环搜索前的预处理: 按天迭代剪除零入度/零出度账户，再限制在非平凡强连通分量内"""
+    edge_count = edges.count()
+    pruned_edges, pruned_count = prune_by_daily_degree(edges, max_iterations)
+    print(f"按天度数剪枝: {edge_count} -> {pruned_count} 条边")
+    if pruned_count == 0:
+        return pruned_edges
+    
+    candidate_edges = restrict_to_daily_sccs(pruned_edges, min_length, max_iterations).localCheckpoint()
+    candidate_count = candidate_edges.count()
+    removed_ratio = (1 - candidate_count / edge_count) * 100 if edge_count else 0.0
+    print(f"强连通分量限制: {pruned_count} -> {candidate_count} 条边 (共剪除 {removed_ratio:.1f}%)")
+    return candidate_edges
+
+def find_same_day_cycles(edges, min_length=3, max_length=4, amount_tolerance_pct=0.0, amount_tolerance_abs=0.0):
+    """迭代扩展同日等额路径，查找长度为 min_length..max_length 的闭环
+
+    每轮只把仍然存活的路径与等额边索引按 (当前账户, 日期, 金额桶) 做一次连接，
+    成本随存活路径数增长；已重复经过账户的路径和最后一轮无法回到起点的路径被丢弃。
+    起点必须是环上id最小的账户，因此每个环只按一种旋转被枚举一次。
+    设置金额容差时，每一跳与上一跳的金额差不超过容差即可（允许逐跳扣取手续费）。
+    返回列: length, transaction_date, accounts, transactions, value_times（按路径顺序排列，均为编码后的值）。
+    """
+    tolerant = amount_tolerance_pct > 0 or amount_tolerance_abs > 0
+    edge_index = build_amount_edge_index(edges, amount_tolerance_pct, amount_tolerance_abs)
+    cycle_edges = prune_cycle_edges(edge_index, tolerant).select(
+        "src", "dst", "edge_id", "amount", "amount_bucket", "value_ts", "transaction_date"
+    ).persist()
+    
+    # 初始路径: 单条边，起点id小于下一个账户
+    paths = cycle_edges.filter(col("src") < col("dst")).select(
+        col("src").alias("start"),
+        col("dst").alias("current"),
+        col("transaction_date"),
+        col("amount"),
+        col("amount_bucket"),
+        array(col("src"), col("dst")).alias("accounts"),
+        array(col("edge_id")).alias("transactions"),
+        array(col("value_ts")).alias("value_times")
+    )
+    
+    cycles = None
+    for length in range(2, max_length + 1):
+        probes = paths.withColumn("probe_bucket", explode(amount_probe_buckets(col("amount_bucket"), tolerant)))
+        step = probes.alias("p").join(
+            cycle_edges.alias("e"),
+            (col("p.current") == col("e.src")) &
+            (col("p.transaction_date") == col("e.transaction_date")) &
+            (col("p.probe_bucket") == col("e.amount_bucket")) &
+            (col("e.dst") >= col("p.start"))
+        ).filter(amount_within_tolerance(
+            col("p.amount"), col("e.amount"), amount_tolerance_pct, amount_tolerance_abs
+        ))
+        # 最后一轮只保留能回到起点的扩展
+        if length == max_length:
+            step = step.filter(col("e.dst") == col("p.start"))
         
-        # 标记交易
-        for trans_id in transactions:
-            detected_transactions.append({
-                "transaction_id": trans_id,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "循环闭环交易"
-            })
-    
-    # 查找四边形循环模式: (a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(d); (d)-[e4]->(a)
-    print("查找四边形循环模式...")
-    squares = graph.find("(a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(d); (d)-[e4]->(a)") \
-        .filter("e1.transaction_date = e2.transaction_date AND e2.transaction_date = e3.transaction_date AND e3.transaction_date = e4.transaction_date") \
-        .filter("e1.amount = e2.amount AND e2.amount = e3.amount AND e3.amount = e4.amount") \
-        .filter("a.id != b.id AND b.id != c.id AND c.id != d.id AND d.id != a.id AND a.id != c.id AND b.id != d.id")
-    
-    square_results = squares.collect()
-    print(f"找到 {len(square_results)} 个四边形循环")
-    
-    for result in square_results:
-        # 获取账户和交易信息
-        accounts = [result['a']['id'], result['b']['id'], result['c']['id'], result['d']['id']]
-        transactions = [result['e1']['transaction_id'], result['e2']['transaction_id'], 
-                       result['e3']['transaction_id'], result['e4']['transaction_id']]
+        step = step.select(
+            col("p.start"),
+            col("e.dst").alias("current"),
+            col("p.transaction_date"),
+            col("e.amount"),
+            col("e.amount_bucket"),
+            col("p.accounts"),
+            concat(col("p.transactions"), array(col("e.edge_id"))).alias("transactions"),
+            concat(col("p.value_times"), array(col("e.value_ts"))).alias("value_times")
+        ).persist()
         
-        # 确定洗钱者
-        trans_times = [
-            (result['e1']['value_date'], result['a']['id']),
-            (result['e2']['value_date'], result['b']['id']),
-            (result['e3']['value_date'], result['c']['id']),
-            (result['e4']['value_date'], result['d']['id'])
-        ]
-        trans_times.sort(key=lambda x: x[0])
-        money_launderer = trans_times[0][1]
+        if length >= min_length:
+            closed = step.filter(col("current") == col("start")).select(
+                lit(length).alias("length"), "transaction_date", "accounts", "transactions", "value_times"
+            )
+            cycles = closed if cycles is None else cycles.unionByName(closed)
         
-        # 标记账户
-        for account in accounts:
-            role = "洗钱者" if account == money_launderer else "协助者"
-            detected_accounts.append({
-                "account_id": account,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "循环闭环交易",
-                "suspicious_role": role
-            })
+        if length == max_length:
+            break
         
-        # 标记交易
-        for trans_id in transactions:
-            detected_transactions.append({
-                "transaction_id": trans_id,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "循环闭环交易"
-            })
+        paths = step.filter(~array_contains(col("accounts"), col("current"))) \
+            .withColumn("accounts", concat(col("accounts"), array(col("current"))))
+        if len(paths.head(1)) == 0:
+            break
+    
+    return cycles
+
+def detect_circular_patterns_with_graphframe(spark, graph, max_length=4, amount_tolerance_pct=0.0, amount_tolerance_abs=0.0,
+                                             restrict_to_sccs=True):
+    """检测长度为3..max_length的同日等额循环闭环交易模式
+
+    restrict_to_sccs 为True时，先按天做度数剪枝和强连通分量限制，只在候选分量内枚举闭环。
+    返回 (账户检测结果, 交易检测结果) 两个Spark DataFrame。
+    """
+    print(f"检测循环闭环交易模式 (长度3-{max_length})...")
+    
+    edges = graph.edges
+    if restrict_to_sccs:
+        edges = restrict_to_cycle_candidates(edges, min_length=3)
+    
+    cycles = find_same_day_cycles(
+        edges,
+        min_length=3,
+        max_length=max_length,
+        amount_tolerance_pct=amount_tolerance_pct,
+        amount_tolerance_abs=amount_tolerance_abs
+    )
+    if cycles is None:
+        return empty_detections(spark)
+    
+    # 确定洗钱者（第一个发起交易的账户，基于时间戳；时间相同时取环上靠前的账户）
+    cycles = cycles.withColumn(
+        "money_launderer",
+        array_min(transform(
+            col("value_times"),
+            lambda value_ts, position: struct(
+                value_ts.alias("value_ts"),
+                position.alias("position"),
+                col("accounts")[position].alias("account")
+            )
+        ))["account"]
+    )
+    
+    # 标记账户
+    detected_accounts = cycles.select(
+        explode(col("accounts")).alias("id"),
+        col("money_launderer"),
+        col("transaction_date")
+    ).select(
+        col("id"),
+        lit("循环闭环交易").alias("detected_suspicious_type"),
+        when(col("id") == col("money_launderer"), lit("洗钱者")).otherwise(lit("协助者")).alias("suspicious_role"),
+        col("transaction_date")
+    )
+    
+    # 标记交易
+    detected_transactions = cycles.select(
+        explode(col("transactions")).alias("edge_id"),
+        lit("循环闭环交易").alias("detected_suspicious_type")
+    )
     
     return detected_accounts, detected_transactions
 
-def detect_star_patterns_with_graphframe(spark, graph):
-    """使用GraphFrame检测星型拆分入账模式"""
-    print("使用GraphFrame检测星型拆分入账模式...")
-    
-    detected_accounts = []
-    detected_transactions = []
-    
-    # 使用GraphFrame查找星型模式: 多个账户在同一天向同一个账户转账小额资金
-    # 查找5个源账户向1个目标账户的模式
-    star_pattern = graph.find("(a1)-[e1]->(center); (a2)-[e2]->(center); (a3)-[e3]->(center); (a4)-[e4]->(center); (a5)-[e5]->(center)") \
-        .filter("e1.transaction_date = e2.transaction_date AND e2.transaction_date = e3.transaction_date AND e3.transaction_date = e4.transaction_date AND e4.transaction_date = e5.transaction_date") \
-        .filter("e1.amount < 10000 AND e2.amount < 10000 AND e3.amount < 10000 AND e4.amount < 10000 AND e5.amount < 10000") \
-        .filter("a1.id != a2.id AND a1.id != a3.id AND a1.id != a4.id AND a1.id != a5.id") \
-        .filter("a2.id != a3.id AND a2.id != a4.id AND a2.id != a5.id") \
-        .filter("a3.id != a4.id AND a3.id != a5.id") \
-        .filter("a4.id != a5.id") \
-        .filter("a1.id != center.id AND a2.id != center.id AND a3.id != center.id AND a4.id != center.id AND a5.id != center.id")
-    
-    star_results = star_pattern.collect()
-    print(f"找到 {len(star_results)} 个星型拆分模式")
-    
-    for result in star_results:
-        # 中心账户（洗钱者）
-        center_account = result['center']['id']
-        
-        # 源账户（协助者）
-        source_accounts = [
-            result['a1']['id'], result['a2']['id'], result['a3']['id'], 
-            result['a4']['id'], result['a5']['id']
-        ]
-        
-        # 相关交易
-        transactions = [
-            result['e1']['transaction_id'], result['e2']['transaction_id'], 
-            result['e3']['transaction_id'], result['e4']['transaction_id'], 
-            result['e5']['transaction_id']
-        ]
+# 当天入度或出度达到该值的 (账户, 日期) 视为枢纽账户（支付机构、代发工资账户等）
+HUB_DEGREE = 1000
+# 枢纽 (账户, 日期) 上的路径按每桶不超过枢纽阈值条加盐分桶，每个枢纽最多分这么多桶
+MAX_SALT_BUCKETS = 32
+# 小额阈值（大额交易申报阈值），低于该金额的交易计入小额统计
+SMALL_AMOUNT = 10000
+# 略低于申报阈值: 金额落在 [SMALL_AMOUNT * (1 - STRUCTURING_MARGIN), SMALL_AMOUNT) 的交易
+STRUCTURING_MARGIN = 0.1
+
+def compute_daily_account_stats(edges, small_amount=SMALL_AMOUNT, structuring_margin=STRUCTURING_MARGIN):
+    """一次扫描边数据，计算每个 (账户, 日期) 的转入/转出统计表，所有聚合类规则共用
+
+    每条边拆成转出方和转入方两条记录，边数据只读一遍，自转账不计入。
+    列: account, transaction_date, in_count, out_count, in_amount, out_amount,
+    structuring_in_count, structuring_out_count（略低于申报阈值的交易笔数），
+    small_in_counterparties, small_out_counterparties（小额交易的不同对手方数）。
+    不同对手方数先按 (账户, 日期, 方向, 对手方) 去重再计数，对手方在shuffle键中，
+    枢纽账户的边会分散到多个任务，不需要在单个任务里收集枢纽账户的全部对手方。
+    """
+    structuring_floor = small_amount * (1 - structuring_margin)
+    sides = edges.filter(col("src") != col("dst")).select(
+        col("transaction_date"),
+        col("amount"),
+        explode(array(
+            struct(col("src").alias("account"), col("dst").alias("counterparty"), lit("out").alias("direction")),
+            struct(col("dst").alias("account"), col("src").alias("counterparty"), lit("in").alias("direction"))
+        )).alias("side")
+    ).select("side.*", "transaction_date", "amount").persist()
+    
+    is_in = col("direction") == "in"
+    is_out = col("direction") == "out"
+    is_structuring = (col("amount") >= structuring_floor) & (col("amount") < small_amount)
+    amount_stats = sides.groupBy("account", "transaction_date").agg(
+        sum(when(is_in, 1).otherwise(0)).alias("in_count"),
+        sum(when(is_out, 1).otherwise(0)).alias("out_count"),
+        sum(when(is_in, col("amount")).otherwise(0.0)).alias("in_amount"),
+        sum(when(is_out, col("amount")).otherwise(0.0)).alias("out_amount"),
+        sum(when(is_in & is_structuring, 1).otherwise(0)).alias("structuring_in_count"),
+        sum(when(is_out & is_structuring, 1).otherwise(0)).alias("structuring_out_count")
+    )
+    counterparty_stats = sides.filter(col("amount") < small_amount) \
+        .select("account", "transaction_date", "direction", "counterparty") \
+        .distinct() \
+        .groupBy("account", "transaction_date").agg(
+            sum(when(is_in, 1).otherwise(0)).alias("small_in_counterparties"),
+            sum(when(is_out, 1).otherwise(0)).alias("small_out_counterparties")
+        )
+    
+    return amount_stats \
+        .join(counterparty_stats, ["account", "transaction_date"], "left") \
+        .fillna(0, ["small_in_counterparties", "small_out_counterparties"])
+
+def print_degree_histogram(daily_stats, hub_degree=HUB_DEGREE):
+    """打印按天入度/出度的对数分桶直方图和枢纽 (账户, 日期) 数量"""
+    print(f"\n按天度数直方图 (枢纽阈值 {hub_degree}):")
+    for name, degree_column in [("入度", "in_count"), ("出度", "out_count")]:
+        histogram = daily_stats.filter(col(degree_column) > 0) \
+            .groupBy(floor(log2(col(degree_column))).cast("int").alias("bucket")) \
+            .agg(
+                count("*").alias("keys"),
+                sum(when(col(degree_column) >= hub_degree, 1).otherwise(0)).alias("hubs")
+            ) \
+            .orderBy("bucket") \
+            .collect()
         
-        # 标记中心账户为洗钱者
-        detected_accounts.append({
-            "account_id": center_account,
-            "detected_suspicious": True,
-            "detected_suspicious_type": "星型拆分入账",
-            "suspicious_role": "洗钱者"
-        })
+        hub_keys = 0
+        for row in histogram:
+            lower, upper = 2 ** row["bucket"], 2 ** (row["bucket"] + 1) - 1
+            print(f"  {name} {lower}-{upper}: {row['keys']} 个 (账户, 日期)")
+            hub_keys += row["hubs"]
+        print(f"  {name}枢纽: {hub_keys} 个 (账户, 日期)")
+
+def collect_rule_evidence(edges, hits, pattern_type, evidence_columns, edge_filter=None,
+                          hit_role="洗钱者", counterparty_role=None):
+    """将统计表上命中的 (账户, 日期) 还原为账户和交易检测结果
+
+    hits 为命中的 (account, transaction_date)。evidence_columns 中的 dst 表示取命中账户当天的转入边，
+    src 表示取转出边；edge_filter 进一步筛选证据边。命中的 (账户, 日期) 数量很少，以广播半连接取回证据边。
+    命中账户标记为hit_role，证据边上的对手方标记为counterparty_role（None表示不标记对手方）。
+    """
+    candidate_edges = edges.filter(col("src") != col("dst"))
+    if edge_filter is not None:
+        candidate_edges = candidate_edges.filter(edge_filter)
+    
+    detected_accounts = hits.select(
+        col("account").alias("id"),
+        lit(pattern_type).alias("detected_suspicious_type"),
+        lit(hit_role).alias("suspicious_role"),
+        col("transaction_date")
+    )
+    detected_transactions = None
+    for hit_column in evidence_columns:
+        keys = hits.select(col("account").alias(hit_column), col("transaction_date"))
+        evidence = candidate_edges.join(broadcast(keys), [hit_column, "transaction_date"], "left_semi")
         
-        # 标记源账户为协助者
-        for src_account in source_accounts:
-            detected_accounts.append({
-                "account_id": src_account,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "星型拆分入账",
-                "suspicious_role": "协助者"
-            })
+        if counterparty_role is not None:
+            counterparty_column = "src" if hit_column == "dst" else "dst"
+            detected_accounts = detected_accounts.unionByName(evidence.select(
+                col(counterparty_column).alias("id"),
+                lit(pattern_type).alias("detected_suspicious_type"),
+                lit(counterparty_role).alias("suspicious_role"),
+                col("transaction_date")
+            ))
         
-        # 标记相关交易
-        for trans_id in transactions:
-            detected_transactions.append({
-                "transaction_id": trans_id,
-                "detected_suspicious": True,
-                "detected_suspicious_type": "星型拆分入账"
-            })
+        evidence_transactions = evidence.select(
+            col("edge_id"),
+            lit(pattern_type).alias("detected_suspicious_type")
+        )
+        detected_transactions = evidence_transactions if detected_transactions is None \
+            else detected_transactions.unionByName(evidence_transactions)
     
-    return detected_accounts, detected_transactions
+    return detected_accounts.distinct(), detected_transactions.distinct()
+
+def detect_star_patterns_with_graphframe(spark, graph, min_spokes=5, hub_degree=HUB_DEGREE, daily_stats=None):
+    """星型拆分入账: 同一天至少min_spokes个不同账户向同一个账户转入小额资金
 
-def detect_cross_border_patterns_with_graphframe(spark, graph):
-    """使用GraphFrame检测跨境多层转账模式"""
-    print("使用GraphFrame检测跨境多层转账模式...")
+    在 (账户, 日期) 统计表上按小额转入的不同对手方数筛选中心账户，不再单独扫描边数据；
+    中心账户为洗钱者，小额转入的源账户为协助者。
+    """
+    print(f"使用聚合检测星型拆分入账模式 (最少 {min_spokes} 个源账户)...")
     
-    detected_accounts = []
-    detected_transactions = []
+    if daily_stats is None:
+        daily_stats = compute_daily_account_stats(graph.edges)
+    
+    # 倾斜报告: 统计表的对手方去重按 (账户, 日期, 方向, 对手方) 分区，计数在map端预聚合，
+    # 枢纽中心的入账边不会集中到单个任务；这里报告按中心账户直接分组时单键承载的边数
+    skew = daily_stats.agg(
+        sum(when(col("in_count") >= hub_degree, 1).otherwise(0)).alias("hubs"),
+        max("in_count").alias("max_rows"),
+        max("small_in_counterparties").alias("max_spokes")
+    ).first()
+    print(f"星型倾斜处理: 枢纽中心 {skew['hubs'] or 0} 个, 单个 (中心, 日期) 最多 {skew['max_rows'] or 0} 条入账边、"
+          f"{skew['max_spokes'] or 0} 个小额对手方，由统计表按对手方分区去重后预聚合")
+    
+    centers = daily_stats.filter(col("small_in_counterparties") >= min_spokes) \
+        .select("account", "transaction_date")
+    return collect_rule_evidence(
+        graph.edges, centers, "星型拆分入账",
+        evidence_columns=["dst"],
+        edge_filter=col("amount") < SMALL_AMOUNT,
+        counterparty_role="协助者"
+    )
+
+def detect_fan_out_patterns(spark, graph, min_recipients=5, daily_stats=None):
+    """分散转出: 同一天一个账户向至少min_recipients个不同账户转出小额资金
+
+    转出账户为洗钱者，小额转入方为协助者。
+    """
+    print(f"使用聚合检测分散转出模式 (最少 {min_recipients} 个目标账户)...")
+    
+    if daily_stats is None:
+        daily_stats = compute_daily_account_stats(graph.edges)
+    
+    sources = daily_stats.filter(col("small_out_counterparties") >= min_recipients) \
+        .select("account", "transaction_date")
+    return collect_rule_evidence(
+        graph.edges, sources, "分散转出",
+        evidence_columns=["src"],
+        edge_filter=col("amount") < SMALL_AMOUNT,
+        counterparty_role="协助者"
+    )
+
+def detect_pass_through_patterns(spark, graph, min_amount=50000, max_retained_pct=0.1, daily_stats=None):
+    """快进快出: 同一天转入至少min_amount，且转出金额与转入金额相差不超过max_retained_pct
+
+    当天的过桥账户标记为协助者，当天的转入和转出交易均为证据。
+    """
+    print(f"使用聚合检测快进快出模式 (转入至少 {min_amount:,.0f}, 留存不超过 {max_retained_pct:.0%})...")
+    
+    if daily_stats is None:
+        daily_stats = compute_daily_account_stats(graph.edges)
+    
+    mules = daily_stats.filter(
+        (col("in_amount") >= min_amount) &
+        (abs(col("out_amount") - col("in_amount")) <= col("in_amount") * max_retained_pct)
+    ).select("account", "transaction_date")
+    return collect_rule_evidence(
+        graph.edges, mules, "快进快出",
+        evidence_columns=["dst", "src"],
+        hit_role="协助者"
+    )
+
+def detect_structuring_patterns(spark, graph, min_count=3, daily_stats=None):
+    """拆分规避申报: 同一天至少min_count笔略低于申报阈值的转出
+
+    转出账户为洗钱者，略低于申报阈值的转出交易为证据。
+    """
+    print(f"使用聚合检测拆分规避申报模式 (单日至少 {min_count} 笔略低于 {SMALL_AMOUNT:,} 的转出)...")
+    
+    if daily_stats is None:
+        daily_stats = compute_daily_account_stats(graph.edges)
+    
+    structuring_floor = SMALL_AMOUNT * (1 - STRUCTURING_MARGIN)
+    structurers = daily_stats.filter(col("structuring_out_count") >= min_count) \
+        .select("account", "transaction_date")
+    return collect_rule_evidence(
+        graph.edges, structurers, "拆分规避申报",
+        evidence_columns=["src"],
+        edge_filter=(col("amount") >= structuring_floor) & (col("amount") < SMALL_AMOUNT)
+    )
+
+def extend_paths_backward(paths, edges, hub_edges=None, hub_heads=None, hub_degree=HUB_DEGREE,
+                          max_salt_buckets=MAX_SALT_BUCKETS):
+    """将路径沿同日入边向后扩展一层，连接键为 (路径起点账户, 交易日期)，并保证路径不重复经过账户
+
+    提供hub_edges/hub_heads (head, transaction_date, degree) 时拆分连接: 起点为枢纽 (账户, 日期) 的路径
+    按路径内容的哈希分桶，每桶不超过hub_degree条路径、每个枢纽最多max_salt_buckets桶，桶数由本层的路径数决定；
+    枢纽入边复制到该枢纽的每个桶，按 (账户, 日期, 桶) 连接。只有路径一侧被拆开，
+    每个桶仍包含枢纽当天的全部入边，单个任务的连接行数约为 每桶路径数 x 枢纽入度。
+    其余路径与普通入边照常shuffle连接，只广播枢纽 (账户, 日期) 键和桶数表。
+    """
+    if hub_edges is None:
+        return join_paths_with_edges(paths, edges)
+    
+    hub_paths = paths.join(broadcast(hub_heads), ["head", "transaction_date"], "left_semi")
+    regular_paths = paths.join(broadcast(hub_heads), ["head", "transaction_date"], "left_anti")
+    
+    hub_buckets = hub_paths.groupBy("head", "transaction_date") \
+        .agg(count("*").alias("paths")) \
+        .withColumn("buckets", least(lit(max_salt_buckets), ceil(col("paths") / hub_degree)).cast("int")) \
+        .select("head", "transaction_date", "buckets") \
+        .persist()
+    salted_paths = hub_paths.join(broadcast(hub_buckets), ["head", "transaction_date"]) \
+        .withColumn("salt", expr("pmod(xxhash64(transactions), buckets)"))
+    salted_edges = hub_edges \
+        .join(broadcast(hub_buckets.withColumnRenamed("head", "dst")), ["dst", "transaction_date"]) \
+        .withColumn("salt", explode(sequence(lit(0), col("buckets") - 1)))
+    print_salted_join_report(salted_paths, hub_heads)
+    
+    return join_paths_with_edges(regular_paths, edges) \
+        .unionByName(join_paths_with_edges(salted_paths, salted_edges, salted=True))
+
+def print_salted_join_report(salted_paths, hub_heads):
+    """打印本层加盐连接中每个 (枢纽, 日期, 桶) 实际承载的路径行数、入边行数和连接行数"""
+    report = salted_paths.groupBy("head", "transaction_date", "salt") \
+        .agg(count("*").alias("paths")) \
+        .join(broadcast(hub_heads), ["head", "transaction_date"]) \
+        .agg(
+            countDistinct("head", "transaction_date").alias("hubs"),
+            count("*").alias("buckets"),
+            max("paths").alias("max_paths"),
+            max("degree").alias("max_edges"),
+            max(col("paths") * col("degree")).alias("max_rows")
+        ).first()
+    print(f"  枢纽加盐连接: {report['hubs']} 个 (账户, 日期) 共 {report['buckets']} 个桶, "
+          f"单桶最多 {report['max_paths'] or 0} 条路径 x {report['max_edges'] or 0} 条入边, "
+          f"单桶最大连接行数 {report['max_rows'] or 0}")
+
+def join_paths_with_edges(paths, edges, salted=False):
+    """路径与入边按 (路径起点账户, 交易日期) 连接，生成向后扩展一层的路径；salted时另按加盐桶连接"""
+    condition = (col("p.head") == col("e.dst")) & (col("p.transaction_date") == col("e.transaction_date"))
+    if salted:
+        condition = condition & (col("p.salt") == col("e.salt"))
+    return paths.alias("p").join(edges.alias("e"), condition) \
+        .filter(~array_contains(col("p.accounts"), col("e.src"))).select(
+            col("e.src").alias("head"),
+            col("p.target"),
+            col("p.transaction_date"),
+            concat(array(col("e.src")), col("p.accounts")).alias("accounts"),
+            concat(array(col("e.edge_id")), col("p.transactions")).alias("transactions")
+        )
+
+def detect_cross_border_patterns_with_graphframe(spark, graph, min_layers=3, max_layers=4, min_paths=2,
+                                                 hub_degree=HUB_DEGREE, max_salt_buckets=MAX_SALT_BUCKETS,
+                                                 daily_stats=None):
+    """检测跨境多层转账模式: 同日经min_layers..max_layers层转账到达高危国家账户
+
+    从少量高危国家账户出发，沿同日入边做有界的反向广度优先搜索，
+    工作量只与高危账户的邻域有关；再按 (源账户, 目标账户, 日期) 分组，要求同一天至少min_paths条路径。
+    当天入度达到hub_degree的枢纽账户的入边单独走加盐连接。
+    """
+    print(f"检测跨境多层转账模式 (反向搜索{min_layers}-{max_layers}层)...")
     
     # 定义高危国家
     high_risk_countries = ["高危国1", "高危国2", "高危国3"]
+    high_risk_accounts = graph.vertices.filter(col("country").isin(high_risk_countries)) \
+        .select(col("id").alias("dst"))
     
-    # 查找3层转账到高危国家的模式: (a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(target)
-    # 其中target在高危国家
-    three_layer_pattern = graph.find("(a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(target)") \
-        .filter("e1.transaction_date = e2.transaction_date AND e2.transaction_date = e3.transaction_date") \
-        .filter(col("target.country").isin(high_risk_countries)) \
-        .filter("a.id != b.id AND b.id != c.id AND c.id != target.id AND a.id != c.id AND a.id != target.id AND b.id != target.id")
-    
-    three_layer_results = three_layer_pattern.collect()
-    print(f"找到 {len(three_layer_results)} 个3层跨境转账模式")
-    
-    # 按源账户分组，查找有多条路径的情况
-    source_paths = {}
-    for result in three_layer_results:
-        source_account = result['a']['id']
-        target_account = result['target']['id']
-        path_key = f"{source_account}->{target_account}"
-        
-        if path_key not in source_paths:
-            source_paths[path_key] = []
-        
-        source_paths[path_key].append({
-            'accounts': [result['a']['id'], result['b']['id'], result['c']['id'], result['target']['id']],
-            'transactions': [result['e1']['transaction_id'], result['e2']['transaction_id'], result['e3']['transaction_id']]
-        })
-    
-    # 查找4层转账到高危国家的模式: (a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(d); (d)-[e4]->(target)
-    four_layer_pattern = graph.find("(a)-[e1]->(b); (b)-[e2]->(c); (c)-[e3]->(d); (d)-[e4]->(target)") \
-        .filter("e1.transaction_date = e2.transaction_date AND e2.transaction_date = e3.transaction_date AND e3.transaction_date = e4.transaction_date") \
-        .filter(col("target.country").isin(high_risk_countries)) \
-        .filter("a.id != b.id AND b.id != c.id AND c.id != d.id AND d.id != target.id") \
-        .filter("a.id != c.id AND a.id != d.id AND a.id != target.id") \
-        .filter("b.id != d.id AND b.id != target.id") \
-        .filter("c.id != target.id")
-    
-    four_layer_results = four_layer_pattern.collect()
-    print(f"找到 {len(four_layer_results)} 个4层跨境转账模式")
-    
-    for result in four_layer_results:
-        source_account = result['a']['id']
-        target_account = result['target']['id']
-        path_key = f"{source_account}->{target_account}"
-        
-        if path_key not in source_paths:
-            source_paths[path_key] = []
-        
-        source_paths[path_key].append({
-            'accounts': [result['a']['id'], result['b']['id'], result['c']['id'], result['d']['id'], result['target']['id']],
-            'transactions': [result['e1']['transaction_id'], result['e2']['transaction_id'], 
-                           result['e3']['transaction_id'], result['e4']['transaction_id']]
-        })
-    
-    # 处理检测到的模式
-    for path_key, paths in source_paths.items():
-        if len(paths) >= 1:  # 只要有多层转账路径就标记为可疑
-            all_accounts = set()
-            all_transactions = set()
-            
-            for path_info in paths:
-                all_accounts.update(path_info['accounts'])
-                all_transactions.update(path_info['transactions'])
-            
-            # 确定角色
-            source_account = path_key.split('->')[0]
-            target_account = path_key.split('->')[1]
-            
-            # 标记账户
-            for account in all_accounts:
-                if account == target_account:
-                    role = "洗钱者"
-                else:
-                    role = "协助者"
-                
-                detected_accounts.append({
-                    "account_id": account,
-                    "detected_suspicious": True,
-                    "detected_suspicious_type": "跨境多层转账",
-                    "suspicious_role": role
-                })
-            
-            # 标记交易
-            for trans_id in all_transactions:
-                detected_transactions.append({
-                    "transaction_id": trans_id,
-                    "detected_suspicious": True,
-                    "detected_suspicious_type": "跨境多层转账"
-                })
+    edges = graph.edges.filter(col("src") != col("dst")) \
+        .select("src", "dst", "edge_id", "transaction_date")
+    
+    # 拆分枢纽账户的入边和普通入边，当天入度取自共用的 (账户, 日期) 统计表
+    if daily_stats is None:
+        daily_stats = compute_daily_account_stats(graph.edges)
+    in_degrees = daily_stats.select("account", "transaction_date", col("in_count").alias("degree")) \
+        .filter(col("degree") > 0)
+    hub_heads = in_degrees.filter(col("degree") >= hub_degree) \
+        .select(col("account").alias("head"), col("transaction_date"), col("degree")) \
+        .persist()
+    hub_keys = hub_heads.select(col("head").alias("dst"), col("transaction_date"))
+    hub_edges = edges.join(broadcast(hub_keys), ["dst", "transaction_date"], "left_semi").persist()
+    regular_edges = edges.join(broadcast(hub_keys), ["dst", "transaction_date"], "left_anti").persist()
+    
+    # 倾斜报告: 普通shuffle连接中单个连接键承载的最大入边数；枢纽入边在每层按路径数加盐，见 print_salted_join_report
+    skew = in_degrees.agg(
+        sum(when(col("degree") >= hub_degree, 1).otherwise(0)).alias("hubs"),
+        max("degree").alias("max_rows"),
+        max(when(col("degree") < hub_degree, col("degree"))).alias("regular_max_rows")
+    ).first()
+    hubs = skew["hubs"] or 0
+    print(f"跨境倾斜处理: 枢纽 (账户, 日期) {hubs} 个, 普通连接单键最大入边数 {skew['max_rows'] or 0} -> "
+          f"{skew['regular_max_rows'] or 0}, 枢纽入边按路径数加盐分桶 (每桶仍包含枢纽的全部入边)")
+    if hubs == 0:
+        hub_edges, hub_heads = None, None
+    
+    # 第1层: 转入高危国家账户的边
+    paths = edges.join(broadcast(high_risk_accounts), "dst", "left_semi").select(
+        col("src").alias("head"),
+        col("dst").alias("target"),
+        col("transaction_date"),
+        array(col("src"), col("dst")).alias("accounts"),
+        array(col("edge_id")).alias("transactions")
+    )
+    
+    layered_paths = None
+    for layers in range(2, max_layers + 1):
+        # 每层在拆分连接中被引用多次，localCheckpoint截断血缘，避免执行计划随层数成倍增长
+        paths = extend_paths_backward(paths, regular_edges, hub_edges, hub_heads, hub_degree, max_salt_buckets) \
+            .localCheckpoint()
+        if layers >= min_layers:
+            layered_paths = paths if layered_paths is None else layered_paths.unionByName(paths)
+        if len(paths.head(1)) == 0:
+            break
+    
+    if layered_paths is None:
+        return empty_detections(spark)
+    
+    # 按 (源账户, 目标账户, 日期) 分组，查找同一天有多条路径的情况
+    grouped_paths = layered_paths.groupBy(col("head").alias("source"), col("target"), col("transaction_date")).agg(
+        count("*").alias("path_count"),
+        array_distinct(flatten(collect_list("accounts"))).alias("accounts"),
+        array_distinct(flatten(collect_list("transactions"))).alias("transactions")
+    ).filter(col("path_count") >= min_paths)
+    
+    # 标记账户: 高危国家目标账户为洗钱者，路径上其余账户为协助者
+    detected_accounts = grouped_paths.select(
+        explode(col("accounts")).alias("id"),
+        col("target"),
+        col("transaction_date")
+    ).select(
+        col("id"),
+        lit("跨境多层转账").alias("detected_suspicious_type"),
+        when(col("id") == col("target"), lit("洗钱者")).otherwise(lit("协助者")).alias("suspicious_role"),
+        col("transaction_date")
+    )
+    
+    # 标记交易
+    detected_transactions = grouped_paths.select(
+        explode(col("transactions")).alias("edge_id"),
+        lit("跨境多层转账").alias("detected_suspicious_type")
+    )
     
     return detected_accounts, detected_transactions
 
-def save_results(spark, accounts_df, transactions_df, detected_accounts_list, detected_transactions_list):
-    """保存分析结果"""
+def union_detections(detections):
+    """按优先级给各检测器的结果加上priority列并合并，账户命中另加role_rank列（洗钱者为0）
+
+    返回 (全部账户命中, 全部交易命中)。
+    """
+    account_frames = []
+    transaction_frames = []
+    for priority, (detected_accounts, detected_transactions) in enumerate(detections):
+        account_frames.append(detected_accounts.withColumn("priority", lit(priority)))
+        transaction_frames.append(detected_transactions.withColumn("priority", lit(priority)))
+    
+    all_accounts = account_frames[0]
+    for frame in account_frames[1:]:
+        all_accounts = all_accounts.unionByName(frame)
+    all_transactions = transaction_frames[0]
+    for frame in transaction_frames[1:]:
+        all_transactions = all_transactions.unionByName(frame)
+    
+    role_rank = when(col("suspicious_role") == "洗钱者", lit(0)).otherwise(lit(1))
+    return all_accounts.withColumn("role_rank", role_rank), all_transactions
+
+def dedupe_account_hits(account_hits, keys):
+    """按keys对账户命中去重，保留 (priority, role_rank) 最小的命中
+
+    返回列: keys, priority, role_rank, detected_suspicious_type, suspicious_role。
+    """
+    return account_hits.groupBy(*keys) \
+        .agg(min(struct("priority", "role_rank", "detected_suspicious_type", "suspicious_role")).alias("detection")) \
+        .select(*keys, "detection.*")
+
+def combine_detections(detections):
+    """合并各检测器的结果并在Spark中去重
+
+    detections 按优先级排列；同一账户被多个检测器命中时保留优先级最高的检测器，
+    同一检测器内洗钱者优先于协助者。同一交易保留优先级最高的类型。
+    """
+    all_accounts, all_transactions = union_detections(detections)
+    
+    combined_accounts = dedupe_account_hits(all_accounts, ["id"]).select(
+        col("id"),
+        col("detected_suspicious_type"),
+        col("suspicious_role").alias("detected_suspicious_role")
+    )
+    
+    combined_transactions = all_transactions \
+        .groupBy("edge_id") \
+        .agg(min(struct("priority", "detected_suspicious_type")).alias("detection")) \
+        .select(
+            col("edge_id"),
+            col("detection.detected_suspicious_type").alias("detected_suspicious_type")
+        )
+    
+    return combined_accounts, combined_transactions
+
+def format_boolean_columns(df):
+    """布尔列按 True/False 输出，与pandas写出的CSV保持一致"""
+    for field in df.schema.fields:
+        if isinstance(field.dataType, BooleanType):
+            df = df.withColumn(
+                field.name,
+                when(col(field.name), lit("True")).when(~col(field.name), lit("False"))
+            )
+    return df
+
+def write_csv_parts(df, output_dir, partition_by=None):
+    """使用Spark分布式写出CSV分片
+
+    output_dir 是driver本地的目录，按 file:// URI 写出，不随会话的默认文件系统（HDFS/S3）改变，
+    merge_csv_parts 才能在本地找到分片。file:// 路径由各executor写到自己机器的本地文件系统，
+    只有local模式下分片才会落在driver上，因此非local的master直接报错。
+    引号和转义符都用双引号，与pandas/csv模块的双写引号规则一致（Spark默认转义符是反斜杠）。
+    """
+    master = SparkContext.getOrCreate().master
+    if not master.startswith("local"):
+        raise ValueError(f"CSV结果需要在driver本地拼接，只支持local模式运行，当前master为 {master}")
+    
+    writer = df.write.mode("overwrite") \
+        .option("header", "true") \
+        .option("escape", '"') \
+        .option("emptyValue", "") \
+        .option("timestampFormat", "yyyy-MM-dd HH:mm:ss") \
+        .option("dateFormat", "yyyy-MM-dd")
+    if partition_by:
+        writer = writer.partitionBy(partition_by)
+    writer.csv("file://" + os.path.abspath(output_dir))
+
+def merge_csv_parts(output_dir, target_path, columns, df=None):
+    """将本地CSV分片流式拼接为单个带BOM的CSV文件，不在driver上加载数据
+
+    分片按分区目录和文件名排序，跳过每个分片自带的表头。
+    没有找到分片时报错，不输出只有表头的结果；只有按列分区写出的空表不会产生分片，
+    这种情况需传入写出的 df，确认为空后才输出只有表头的文件。
+    """
+    part_files = []
+    for root, dirs, files in os.walk(output_dir):
+        dirs.sort()
+        part_files.extend(
+            os.path.join(root, name) for name in sorted(files)
+            if name.startswith("part-") and name.endswith(".csv")
+        )
+    if not part_files and (df is None or df.take(1)):
+        raise FileNotFoundError(f"{output_dir} 下没有CSV分片，请确认Spark executor与driver共享该本地目录")
+    
+    with open(target_path, "w", encoding="utf-8-sig", newline="") as target:
+        target.write(",".join(columns) + "\n")
+        for part_file in part_files:
+            with open(part_file, "r", encoding="utf-8", newline="") as part:
+                part.readline()
+                shutil.copyfileobj(part, target)
+
+def save_results(spark, accounts_df, transactions_df, detected_accounts_df, detected_transactions_df, id_dictionary):
+    """保存分析结果
+
+    检测结果先在Spark中还原为原始id，再由 write_results 写出。
+    """
+    # 将账户编码和交易编码还原为原始id
+    detected_accounts = detected_accounts_df.join(id_dictionary["accounts"], "id").drop("id")
+    detected_transactions = detected_transactions_df.join(id_dictionary["transactions"], "edge_id").drop("edge_id")
+    write_results(accounts_df, transactions_df, detected_accounts, detected_transactions)
+
+def write_results(accounts_df, transactions_df, detected_accounts, detected_transactions):
+    """写出检测结果
+
+    detected_accounts (account_id, detected_suspicious_type, detected_suspicious_role) 和
+    detected_transactions (transaction_id, detected_suspicious_type) 左连接到账户和交易表，
+    由Spark分布式写出到 result/detected_account/ 和按交易日期分区的
+    result/detected_transaction/，最后流式拼接为 detected_account.csv 和 detected_transaction.csv。
+    """
     print("保存分析结果...")
     
     # 确保result目录存在
     os.makedirs('result', exist_ok=True)
     
-    # 处理检测到的账户 - 去重
-    detected_accounts_dict = {}
-    for item in detected_accounts_list:
-        account_id = item["account_id"]
-        if account_id not in detected_accounts_dict:
-            detected_accounts_dict[account_id] = item
-    
-    # 处理检测到的交易 - 去重
-    detected_transactions_dict = {}
-    for item in detected_transactions_list:
-        trans_id = item["transaction_id"]
-        if trans_id not in detected_transactions_dict:
-            detected_transactions_dict[trans_id] = item
-    
-    # 转换为Pandas DataFrame并保存账户结果
-    accounts_pandas = accounts_df.toPandas()
-    accounts_pandas["detected_suspicious"] = False
-    accounts_pandas["detected_suspicious_type"] = ""
-    accounts_pandas["detected_suspicious_role"] = ""
-    
-    for account_id, detection in detected_accounts_dict.items():
-        mask = accounts_pandas["account_id"] == account_id
-        accounts_pandas.loc[mask, "detected_suspicious"] = detection["detected_suspicious"]
-        accounts_pandas.loc[mask, "detected_suspicious_type"] = detection["detected_suspicious_type"]
-        accounts_pandas.loc[mask, "detected_suspicious_role"] = detection["suspicious_role"]
-    
-    accounts_pandas.to_csv("result/detected_account.csv", index=False, encoding='utf-8-sig')
-    
-    # 转换为Pandas DataFrame并保存交易结果
-    transactions_pandas = transactions_df.toPandas()
-    transactions_pandas["detected_suspicious"] = False
-    transactions_pandas["detected_suspicious_type"] = ""
-    
-    for trans_id, detection in detected_transactions_dict.items():
-        mask = transactions_pandas["transaction_id"] == trans_id
-        transactions_pandas.loc[mask, "detected_suspicious"] = detection["detected_suspicious"]
-        transactions_pandas.loc[mask, "detected_suspicious_type"] = detection["detected_suspicious_type"]
-    
-    transactions_pandas.to_csv("result/detected_transaction.csv", index=False, encoding='utf-8-sig')
+    detected_accounts = detected_accounts.persist()
+    detected_transactions = detected_transactions.persist()
+    
+    # 账户结果
+    account_results = accounts_df.join(detected_accounts, "account_id", "left") \
+        .withColumn("detected_suspicious", col("detected_suspicious_type").isNotNull()) \
+        .fillna("", ["detected_suspicious_type", "detected_suspicious_role"]) \
+        .select(*accounts_df.columns, "detected_suspicious", "detected_suspicious_type", "detected_suspicious_role") \
+        .orderBy("account_id")
+    account_results = format_boolean_columns(account_results)
+    write_csv_parts(account_results, "result/detected_account")
+    merge_csv_parts("result/detected_account", "result/detected_account.csv", account_results.columns)
+    
+    # 交易结果，按交易日期分区写出；分区内先按分区列排序，写出时不会再按交易日期重新排序打乱顺序
+    transaction_results = transactions_df.join(detected_transactions, "transaction_id", "left") \
+        .withColumn("detected_suspicious", col("detected_suspicious_type").isNotNull()) \
+        .fillna("", ["detected_suspicious_type"]) \
+        .select(*transactions_df.columns, "detected_suspicious", "detected_suspicious_type")
+    transaction_results = format_boolean_columns(transaction_results)
+    output_columns = transaction_results.columns
+    transaction_results = transaction_results \
+        .withColumn("transaction_date", to_date(col("value_date"))) \
+        .repartition(col("transaction_date")) \
+        .sortWithinPartitions("transaction_date", "value_date", "transaction_id")
+    write_csv_parts(transaction_results, "result/detected_transaction", partition_by="transaction_date")
+    merge_csv_parts("result/detected_transaction", "result/detected_transaction.csv", output_columns, transaction_results)
     
     # 输出统计信息
-    detected_account_count = len(detected_accounts_dict)
-    detected_transaction_count = len(detected_transactions_dict)
+    detected_account_count = detected_accounts.count()
+    detected_transaction_count = detected_transactions.count()
     
     print(f"检测完成！")
     print(f"检测到可疑账户: {detected_account_count} 个")
@@ -392,69 +989,390 @@ def save_results(spark, accounts_df, transactions_df, detected_accounts_list, de
     print(f"结果已保存到 result/ 目录")
     
     # 按模式统计
-    pattern_stats = {}
-    for detection in detected_accounts_dict.values():
-        pattern = detection["detected_suspicious_type"]
-        if pattern not in pattern_stats:
-            pattern_stats[pattern] = 0
-        pattern_stats[pattern] += 1
+    pattern_stats = detected_accounts.groupBy("detected_suspicious_type").count() \
+        .orderBy("detected_suspicious_type").collect()
     
     print(f"\n按模式统计:")
-    for pattern, count in pattern_stats.items():
-        print(f"  {pattern}: {count} 个账户")
+    for row in pattern_stats:
+        print(f"  {row['detected_suspicious_type']}: {row['count']} 个账户")
+
+# 检测器按合并优先级排列: (模式名称, FAIR调度池, 检测函数)
+DETECTORS = [
+    ("循环闭环交易", "circular", detect_circular_patterns_with_graphframe),
+    ("星型拆分入账", "star", detect_star_patterns_with_graphframe),
+    ("跨境多层转账", "cross_border", detect_cross_border_patterns_with_graphframe)
+]
+
+# 可选的聚合类规则，按命令行 --aggregation-rules 启用，优先级排在默认检测器之后
+AGGREGATION_RULES = {
+    "fan_out": ("分散转出", "fan_out", detect_fan_out_patterns),
+    "pass_through": ("快进快出", "pass_through", detect_pass_through_patterns),
+    "structuring": ("拆分规避申报", "structuring", detect_structuring_patterns)
+}
+
+def build_detectors(daily_stats, aggregation_rules=()):
+    """组装本次运行的检测器列表，星型、跨境和启用的聚合类规则共用同一张 (账户, 日期) 统计表"""
+    detectors = []
+    for name, pool, detector in DETECTORS:
+        if detector is not detect_circular_patterns_with_graphframe:
+            detector = partial(detector, daily_stats=daily_stats)
+        detectors.append((name, pool, detector))
+    for rule in aggregation_rules:
+        name, pool, detector = AGGREGATION_RULES[rule]
+        detectors.append((name, pool, partial(detector, daily_stats=daily_stats)))
+    return detectors
+
+def run_detector(spark, graph, name, pool, detector):
+    """在指定的FAIR调度池中运行单个检测器，物化结果并返回 (检测结果, 耗时秒数)"""
+    # 调度池是线程本地属性，只影响当前线程提交的作业
+    spark.sparkContext.setLocalProperty("spark.scheduler.pool", pool)
+    try:
+        start_time = time.time()
+        detected_accounts, detected_transactions = detector(spark, graph)
+        # 物化并截断血缘，合并和保存结果时的执行计划不再包含各检测器的计算过程
+        detected_accounts = detected_accounts.localCheckpoint()
+        detected_transactions = detected_transactions.localCheckpoint()
+        account_count = detected_accounts.count()
+        transaction_count = detected_transactions.count()
+        elapsed = time.time() - start_time
+    finally:
+        spark.sparkContext.setLocalProperty("spark.scheduler.pool", None)
+    
+    print(f"{name}检测完成: {account_count} 个账户, {transaction_count} 笔交易, 耗时 {elapsed:.1f} 秒")
+    return (detected_accounts, detected_transactions), elapsed
+
+def run_detectors_concurrently(spark, graph, detectors=DETECTORS):
+    """从线程池并发提交各检测器，返回按优先级排列的检测结果并打印各检测器耗时"""
+    print(f"\n--- 并发运行 {len(detectors)} 个检测器 (FAIR调度) ---")
+    start_time = time.time()
+    
+    with ThreadPoolExecutor(max_workers=len(detectors)) as executor:
+        futures = [
+            executor.submit(run_detector, spark, graph, name, pool, detector)
+            for name, pool, detector in detectors
+        ]
+        results = [future.result() for future in futures]
+    
+    wall_time = time.time() - start_time
+    total_time = 0.0
+    print(f"\n检测器耗时:")
+    for (name, pool, _), (_, elapsed) in zip(detectors, results):
+        print(f"  {name} (pool={pool}): {elapsed:.1f} 秒")
+        total_time += elapsed
+    print(f"  各检测器合计 {total_time:.1f} 秒, 实际墙钟 {wall_time:.1f} 秒")
+    
+    return [detection for detection, _ in results]
+
+# 按交易日期分区的检测结果库: accounts/ 和 transactions/ 下每个交易日期一个分区，
+# manifest.json 记录每个日期的交易摘要和生成结果时的规则参数
+DETECTION_STORE_DIR = "result/detection_store"
 
-def main():
+# 检测结果库中账户命中和交易命中的schema，transaction_date为分区列
+STORE_ACCOUNT_SCHEMA = StructType([
+    StructField("account_id", StringType(), False),
+    StructField("priority", IntegerType(), False),
+    StructField("role_rank", IntegerType(), False),
+    StructField("detected_suspicious_type", StringType(), False),
+    StructField("suspicious_role", StringType(), False),
+    StructField("transaction_date", DateType(), False)
+])
+
+STORE_TRANSACTION_SCHEMA = StructType([
+    StructField("transaction_id", StringType(), False),
+    StructField("detected_suspicious_type", StringType(), False),
+    StructField("transaction_date", DateType(), False)
+])
+
+def compute_day_digests(transactions_df):
+    """按交易日期计算交易内容摘要，返回 {yyyy-MM-dd: "笔数:摘要"}
+
+    摘要为每行所有列的xxhash64之和（按decimal累加不会溢出），与行顺序和分片方式无关，
+    当天新增、修改或删除交易都会改变摘要。
+    """
+    row_hash = xxhash64(*[col(name) for name in transactions_df.columns]).cast("decimal(38,0)")
+    rows = transactions_df \
+        .groupBy(date_format(to_date(col("value_date")), "yyyy-MM-dd").alias("transaction_date")) \
+        .agg(count("*").alias("transactions"), sum(row_hash).alias("digest")) \
+        .collect()
+    return {row["transaction_date"]: f"{row['transactions']}:{row['digest']}" for row in rows}
+
+def compute_account_digest(accounts_df):
+    """检测用到的账户列 (account_id, country) 的摘要 "账户数:摘要"，与行顺序和分片方式无关
+
+    检测图只保留两端都在账户表中的交易，跨境规则又取决于账户国家，账户表变化时所有日期的命中都可能改变。
+    """
+    row_hash = xxhash64(col("account_id"), col("country")).cast("decimal(38,0)")
+    row = accounts_df.agg(count("*").alias("accounts"), sum(row_hash).alias("digest")).first()
+    return f"{row['accounts']}:{row['digest']}"
+
+def detector_version():
+    """检测代码和阈值的版本: 检测模块和编码模块源文件的指纹"""
+    return compute_fingerprint("detection", code_files=[source_file("analyse_aml_patterns"), source_file("aml_id_codec")])
+
+def read_store_manifest(store_dir=DETECTION_STORE_DIR):
+    """读取检测结果库的manifest，不存在时返回None"""
+    path = os.path.join(store_dir, "manifest.json")
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def write_store_manifest(day_digests, params, store_dir=DETECTION_STORE_DIR):
+    """检测结果库更新成功后记录每个日期的交易摘要和规则参数"""
+    with open(os.path.join(store_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({"params": params, "days": day_digests}, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def find_touched_dates(day_digests, manifest, params):
+    """对比当前交易摘要和manifest，返回 (需要重新检测的日期, 已没有交易的日期)
+
+    检测结果库不存在或规则参数有变化时，所有日期都需要重新检测。
+    """
+    if manifest is None or manifest.get("params") != params:
+        return sorted(day_digests), []
+    
+    stored_digests = manifest["days"]
+    touched = sorted(day for day, digest in day_digests.items() if stored_digests.get(day) != digest)
+    removed = sorted(day for day in stored_digests if day not in day_digests)
+    return touched, removed
+
+def combine_daily_detections(detections, graph, id_dictionary):
+    """按 (账户, 日期) 合并去重各检测器结果并还原为原始id，作为检测结果库的分区数据
+
+    账户命中保留priority和role_rank，跨日期合并时再按账户去重；交易只属于一个日期，直接按交易去重。
+    """
+    all_accounts, _ = union_detections(detections)
+    _, combined_transactions = combine_detections(detections)
+    # Spark 3.2的Python date_add只接受整数天数，按列加天数用SQL表达式
+    to_calendar_date = expr("date_add(date'1970-01-01', transaction_date)")
+    
+    account_hits = dedupe_account_hits(all_accounts, ["id", "transaction_date"]) \
+        .join(id_dictionary["accounts"], "id") \
+        .select(
+            "account_id", "priority", "role_rank", "detected_suspicious_type", "suspicious_role",
+            to_calendar_date.alias("transaction_date")
+        )
+    transaction_hits = combined_transactions \
+        .join(graph.edges.select("edge_id", "transaction_date"), "edge_id") \
+        .join(id_dictionary["transactions"], "edge_id") \
+        .select("transaction_id", "detected_suspicious_type", to_calendar_date.alias("transaction_date"))
+    return account_hits, transaction_hits
+
+def replace_store_partitions(account_hits, transaction_hits, dates, store_dir=DETECTION_STORE_DIR):
+    """删除检测结果库中dates对应的日期分区，再追加写入本次的命中结果
+
+    命中为空的日期不会生成分区，所以先按目录删除旧分区，不依赖动态分区覆盖。
+    """
+    for table in ["accounts", "transactions"]:
+        for day in dates:
+            shutil.rmtree(os.path.join(store_dir, table, f"transaction_date={day}"), ignore_errors=True)
+    
+    if account_hits is not None:
+        account_hits.write.mode("append").partitionBy("transaction_date").parquet(os.path.join(store_dir, "accounts"))
+        transaction_hits.write.mode("append").partitionBy("transaction_date").parquet(os.path.join(store_dir, "transactions"))
+
+def read_store(spark, store_dir=DETECTION_STORE_DIR):
+    """读取检测结果库全部日期的命中，账户按 (priority, role_rank) 跨日期去重
+
+    返回 write_results 需要的 (detected_accounts, detected_transactions)。
+    """
+    account_dir = os.path.join(store_dir, "accounts")
+    transaction_dir = os.path.join(store_dir, "transactions")
+    os.makedirs(account_dir, exist_ok=True)
+    os.makedirs(transaction_dir, exist_ok=True)
+    
+    account_hits = spark.read.schema(STORE_ACCOUNT_SCHEMA).parquet(account_dir)
+    transaction_hits = spark.read.schema(STORE_TRANSACTION_SCHEMA).parquet(transaction_dir)
+    
+    detected_accounts = dedupe_account_hits(account_hits, ["account_id"]).select(
+        col("account_id"),
+        col("detected_suspicious_type"),
+        col("suspicious_role").alias("detected_suspicious_role")
+    )
+    detected_transactions = transaction_hits.select("transaction_id", "detected_suspicious_type")
+    return detected_accounts, detected_transactions
+
+def run_full_detection(spark, accounts_df, transactions_df, aggregation_rules=()):
+    """全量检测: 对加载的全部交易运行所有检测器，合并去重后写出结果"""
+    # 创建图
+    graph, id_dictionary = create_graph(spark, accounts_df, transactions_df)
+    
+    # 一次扫描边数据得到 (账户, 日期) 转入/转出统计表，聚合类规则共用
+    # localCheckpoint物化并截断血缘，各检测器的执行计划不再重复包含统计表的计算过程
+    daily_stats = compute_daily_account_stats(graph.edges).localCheckpoint()
+    print_degree_histogram(daily_stats)
+    
+    # 各检测器并发提交，各自使用独立的FAIR调度池，结果保留为Spark DataFrame
+    detectors = build_detectors(daily_stats, aggregation_rules)
+    detections = run_detectors_concurrently(spark, graph, detectors)
+    
+    # 在Spark中合并去重
+    all_detected_accounts, all_detected_transactions = combine_detections(detections)
+    
+    # 保存结果
+    save_results(spark, accounts_df, transactions_df, all_detected_accounts, all_detected_transactions, id_dictionary)
+
+def run_incremental_detection(spark, accounts_df, transactions_df, aggregation_rules=(), store_dir=DETECTION_STORE_DIR):
+    """增量检测: 只对新增或变化了交易的日期重新检测，更新检测结果库后合并写出结果
+
+    所有规则都限定在同一天内，某一天的命中只取决于当天的交易，其余日期的命中直接取自检测结果库。
+    """
+    # 账户表、检测代码和规则参数任一变化都会影响所有日期的命中，manifest中的params不一致时重建检测结果库
+    params = {
+        "aggregation_rules": sorted(aggregation_rules),
+        "accounts": compute_account_digest(accounts_df),
+        "detector_version": detector_version()
+    }
+    day_digests = compute_day_digests(transactions_df)
+    manifest = read_store_manifest(store_dir)
+    if manifest is not None and manifest.get("params") != params:
+        print("账户表、检测代码或规则参数有变化，重建检测结果库")
+    if manifest is None or manifest.get("params") != params:
+        shutil.rmtree(store_dir, ignore_errors=True)
+    os.makedirs(store_dir, exist_ok=True)
+    
+    touched, removed = find_touched_dates(day_digests, manifest, params)
+    print(f"增量检测: 共 {len(day_digests)} 个交易日期, 需要重新检测 {len(touched)} 个, 已删除 {len(removed)} 个")
+    
+    account_hits, transaction_hits = None, None
+    if touched:
+        print(f"重新检测日期: {', '.join(touched[:5])}{' ...' if len(touched) > 5 else ''}")
+        touched_transactions = transactions_df.filter(
+            date_format(to_date(col("value_date")), "yyyy-MM-dd").isin(touched)
+        )
+        graph, id_dictionary = create_graph(spark, accounts_df, touched_transactions)
+        daily_stats = compute_daily_account_stats(graph.edges).localCheckpoint()
+        print_degree_histogram(daily_stats)
+        detections = run_detectors_concurrently(spark, graph, build_detectors(daily_stats, aggregation_rules))
+        account_hits, transaction_hits = combine_daily_detections(detections, graph, id_dictionary)
+    
+    replace_store_partitions(account_hits, transaction_hits, touched + removed, store_dir)
+    write_store_manifest(day_digests, params, store_dir)
+    
+    detected_accounts, detected_transactions = read_store(spark, store_dir)
+    write_results(accounts_df, transactions_df, detected_accounts, detected_transactions)
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="AML模式分析")
+    parser.add_argument("--source", choices=["csv", "parquet"], default="csv",
+                        help="输入数据格式 (默认csv)")
+    parser.add_argument("--data-dir", default=None,
+                        help="输入数据目录 (csv默认mock_data，parquet默认mock_data/parquet)")
+    parser.add_argument("--start-date", default=None, help="只检测该日期(含)之后的交易, yyyy-MM-dd")
+    parser.add_argument("--end-date", default=None, help="只检测该日期(含)之前的交易, yyyy-MM-dd")
+    parser.add_argument("--convert-to-parquet", action="store_true",
+                        help="将mock_data下的CSV一次性转换为按日期分区的Parquet后退出")
+    parser.add_argument("--engine", choices=["spark", "local"], default="spark",
+                        help="检测引擎: spark(GraphFrame) 或 local(单机NumPy，仅支持csv输入)")
+    parser.add_argument("--aggregation-rules", nargs="*", default=[], choices=sorted(AGGREGATION_RULES),
+                        help="额外启用的聚合类规则 (基于 (账户, 日期) 统计表)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"增量检测: 只重新检测交易有新增或变化的日期，按日期保存在 {DETECTION_STORE_DIR} 后合并输出")
+    parser.add_argument("--score", action="store_true",
+                        help="检测完成后接着运行风险评分 (spark引擎复用检测的SparkSession)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
+    
+    # 单机引擎不启动JVM
+    if args.engine == "local":
+        if args.source != "csv" or args.convert_to_parquet:
+            print("单机引擎只支持csv输入")
+            return
+        if args.incremental:
+            print("单机引擎不支持增量检测")
+            return
+        import local_aml_engine
+        local_aml_engine.main(
+            data_dir=args.data_dir or "mock_data",
+            start_date=args.start_date,
+            end_date=args.end_date
+        )
+        if args.score:
+            import generate_aml_scorecard
+            generate_aml_scorecard.main([])
+        return
+    
     print("=== AML模式分析开始 (使用GraphFrame模式匹配) ===")
     
     # 创建Spark会话
     spark = create_spark_session()
     
+    if args.convert_to_parquet:
+        try:
+            convert_csv_to_parquet(spark, parquet_dir=args.data_dir or "mock_data/parquet")
+        finally:
+            spark.stop()
+        return
+    
     try:
         # 加载数据
-        accounts_df, transactions_df = load_data(spark)
+        data_dir = args.data_dir or ("mock_data/parquet" if args.source == "parquet" else "mock_data")
+        accounts_df, transactions_df = load_data(
+            spark,
+            source=args.source,
+            data_dir=data_dir,
+            start_date=args.start_date,
+            end_date=args.end_date
+        )
         
-        # 创建图
-        graph = create_graph(spark, accounts_df, transactions_df)
-        
-        # 检测各种洗钱模式
-        all_detected_accounts = []
-        all_detected_transactions = []
-        
-        # 1. 使用GraphFrame检测循环闭环交易
-        print("\n--- 使用GraphFrame检测循环闭环交易 ---")
-        circular_accounts, circular_transactions = detect_circular_patterns_with_graphframe(spark, graph)
-        all_detected_accounts.extend(circular_accounts)
-        all_detected_transactions.extend(circular_transactions)
-        print(f"循环闭环交易检测完成: {len(circular_accounts)} 个账户, {len(circular_transactions)} 笔交易")
-        
-        # 2. 使用GraphFrame检测星型拆分入账
-        print("\n--- 使用GraphFrame检测星型拆分入账 ---")
-        star_accounts, star_transactions = detect_star_patterns_with_graphframe(spark, graph)
-        all_detected_accounts.extend(star_accounts)
-        all_detected_transactions.extend(star_transactions)
-        print(f"星型拆分入账检测完成: {len(star_accounts)} 个账户, {len(star_transactions)} 笔交易")
-        
-        # 3. 使用GraphFrame检测跨境多层转账
-        print("\n--- 使用GraphFrame检测跨境多层转账 ---")
-        cross_border_accounts, cross_border_transactions = detect_cross_border_patterns_with_graphframe(spark, graph)
-        all_detected_accounts.extend(cross_border_accounts)
-        all_detected_transactions.extend(cross_border_transactions)
-        print(f"跨境多层转账检测完成: {len(cross_border_accounts)} 个账户, {len(cross_border_transactions)} 笔交易")
-        
-        # 保存结果
-        save_results(spark, accounts_df, transactions_df, all_detected_accounts, all_detected_transactions)
+        if args.incremental:
+            run_incremental_detection(spark, accounts_df, transactions_df, args.aggregation_rules)
+        else:
+            run_full_detection(spark, accounts_df, transactions_df, args.aggregation_rules)
         
+        # 评分读取刚写出的检测结果，与检测共用同一个SparkSession
+        if args.score:
+            import spark_aml_scorecard
+            spark_aml_scorecard.main(spark)
+    
     except Exception as e:
         print(f"分析过程中出现错误: {str(e)}")
         import traceback
         traceback.print_exc()
-        
+    
     finally:
         # 关闭Spark会话
         spark.stop()
     
     print("=== AML模式分析完成 ===")
 
+def run_cached(argv=None):
+    """按输入数据、参数和代码的指纹运行检测，未变化时跳过 (见 aml_stage_cache)"""
+    args = parse_args(argv)
+    if args.convert_to_parquet:
+        main(argv)
+        return
+    
+    if args.source == "parquet":
+        inputs = [args.data_dir or "mock_data/parquet"]
+    else:
+        data_dir = args.data_dir or "mock_data"
+        inputs = [os.path.join(data_dir, "account.csv"), os.path.join(data_dir, "transaction.csv")]
+    
+    outputs = ["result/detected_account.csv", "result/detected_transaction.csv"]
+    code_files = [
+        source_file("analyse_aml_patterns"),
+        source_file("aml_id_codec"),
+        source_file("local_aml_engine")
+    ]
+    if args.score:
+        outputs += ["result/high_risk_accounts.csv", "result/risk_alert_report.md"]
+        code_files += [source_file("generate_aml_scorecard"), source_file("aml_score_rules")]
+        if args.engine == "spark":
+            outputs.append("result/risk_score_breakdown.csv")
+            code_files.append(source_file("spark_aml_scorecard"))
+    
+    run_stage(
+        "analyse_aml_patterns",
+        lambda: main(argv),
+        inputs=inputs,
+        outputs=outputs,
+        params=vars(args),
+        code_files=code_files
+    )
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    run_cached() 
\ No newline at end of file
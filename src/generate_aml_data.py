@@ -15,7 +15,14 @@ import numpy as np
 import random
 from datetime import datetime, timedelta
 from faker import Faker
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import io
 import os
+import shutil
+import time
+from aml_stage_cache import run_stage, source_file
 
 # 设置随机种子确保结果可重现
 random.seed(42)
@@ -390,28 +397,570 @@ class AMLDataGenerator:
         print(f"洗钱交易数: {len(self.laundering_transactions)}")
         print(f"文件已保存到 mock_data/ 目录")
 
-def main():
+# 向量化生成模式的取值表，账户国家、洗钱组别和角色在数组中只保存下标
+COUNTRIES = ['中国', '美国', '英国', '德国', '法国', '日本', '韩国', '新加坡', '高危国1', '高危国2', '高危国3']
+NORMAL_COUNTRY_CODES = np.arange(8)       # 正常账户: 中国..新加坡
+LAUNDERING_COUNTRY_CODES = np.arange(5)   # 循环/星型洗钱账户: 中国..法国
+CROSS_BORDER_COUNTRY_CODES = np.arange(4) # 跨境源头和中间层账户: 中国..德国
+HIGH_RISK_COUNTRY_CODES = np.arange(8, 11)
+ROLES = ['', '洗钱者', '协助者']
+REGISTRATION_START, REGISTRATION_DAYS = np.datetime64('2020-01-01'), 1096
+TRANSACTION_START, TRANSACTION_DAYS = np.datetime64('2023-01-01'), 364
+ACCOUNT_ID_START = 10000000  # 8位数字账户ID起始值，账户ID = 起始值 + 全局账户下标
+
+def build_name_pools(seed=42, pool_size=5000):
+    """预先生成个人名称池和公司名称池，向量化生成时按下标抽取"""
+    Faker.seed(seed)
+    pool_fake = Faker(['zh_CN'])
+    names = [pool_fake.name() for _ in range(pool_size)]
+    companies = [pool_fake.company() for _ in range(pool_size)]
+    return np.array(names + companies, dtype=object)
+
+def normal_account_countries(seed, accounts):
+    """正常账户的国家编码由 (全局种子, 全局账户下标) 哈希得到（splitmix64），
+    分片生成时任何分片都能独立算出任意正常账户的国家，不需要共享账户表"""
+    x = np.asarray(accounts, dtype=np.uint64) + np.uint64(seed * 0x9E3779B97F4A7C15 % (1 << 64))
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    x = x ^ (x >> np.uint64(31))
+    return NORMAL_COUNTRY_CODES[(x % np.uint64(len(NORMAL_COUNTRY_CODES))).astype(np.int64)]
+
+def shard_ranges(total, shards):
+    """把 [0, total) 均分为shards段，返回各段的 (起点, 数量)"""
+    bounds = [total * shard // shards for shard in range(shards + 1)]
+    return [(bounds[shard], bounds[shard + 1] - bounds[shard]) for shard in range(shards)]
+
+def day_strings(start, days, suffix=''):
+    """start起days天的日期字符串表，按天数偏移取值"""
+    dates = np.datetime_as_string(start + np.arange(days))
+    return np.array([date + suffix for date in dates], dtype=object)
+
+def csv_escape(values):
+    """用 DataFrame.to_csv 所用的csv.writer设置（QUOTE_MINIMAL，行尾os.linesep）转义字符串取值表"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator=os.linesep)
+    escaped = []
+    for value in values:
+        buffer.seek(0)
+        buffer.truncate()
+        # 补一个空字段，避免单个空字符串被写成 ""
+        writer.writerow([value, ''])
+        escaped.append(buffer.getvalue()[:-len(os.linesep) - 1])
+    return np.array(escaped, dtype=object)
+
+# 分数部分 0-99 对应的小数字符串，与repr一致: 0 -> '.0', 50 -> '.5', 5 -> '.05'
+CENT_FRACTIONS = np.array(['.' + (f'{cent:02d}'.rstrip('0') or '0') for cent in range(100)], dtype=object)
+
+def amount_fields(values):
+    """浮点列的CSV字段: 两位小数的金额按整数分拼接，结果与repr相同；其他值逐个repr"""
+    cents = np.round(values * 100)
+    if not np.all((cents / 100 == values) & (values >= 0) & (values < 1e9)):
+        return list(map(repr, values.tolist()))
+    cents = cents.astype(np.int64)
+    return list(map(str.__add__, map(str, (cents // 100).tolist()), CENT_FRACTIONS[cents % 100].tolist()))
+
+def csv_fields(values):
+    """一列值的CSV字段列表: 布尔写为True/False，整数和浮点按数值格式化，字符串列须已用csv_escape转义"""
+    values = np.asarray(values)
+    if values.dtype == bool:
+        return np.array(['False', 'True'], dtype=object)[values.view(np.int8)].tolist()
+    if values.dtype.kind in 'iu':
+        return list(map(str, values.tolist()))
+    if values.dtype.kind == 'f':
+        return amount_fields(values)
+    return values.tolist()
+
+def csv_text(columns, header):
+    """把 {列名: 数组} 按列格式化后逐行拼接为CSV文本，输出与 DataFrame.to_csv(index=False) 逐字节相同"""
+    lines = list(map(','.join, zip(*[csv_fields(values) for values in columns.values()])))
+    if header:
+        lines.insert(0, ','.join(columns))
+    lines.append('')
+    return os.linesep.join(lines)
+
+def group_layout(sizes, start):
+    """连续排列的各组账户下标: 返回 (各组起始下标, 每个成员所属组, 每个成员在组内的位置)"""
+    starts = start + np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+    members = np.arange(start, start + sizes.sum())
+    group_of = np.repeat(np.arange(len(sizes)), sizes)
+    return starts, group_of, members - starts[group_of]
+
+class VectorizedAMLDataGenerator:
+    """向量化AML数据生成器，用于生成千万级交易压测检测
+
+    账户和交易按列保存为NumPy数组（账户下标、国家编码、金额、日期偏移、组别编码），
+    整批随机抽取；名称从预先生成的名称池按下标抽取；三类洗钱模式按组大小算出成员下标后
+    整体赋值。字符串列只在保存时按块还原，输出文件格式与 AMLDataGenerator 相同。
+
+    分片生成时每个分片一个生成器: seed 为该分片的 SeedSequence，account_offset/transaction_offset
+    为分片第一个账户/交易的全局下标，normal_accounts 为全局正常账户数，names 为共用的名称池。
+    """
+    
+    def __init__(self, seed=42, normal_accounts=0, account_offset=0, transaction_offset=0,
+                 global_seed=None, names=None):
+        self.rng = np.random.default_rng(seed)
+        self.global_seed = seed if global_seed is None else global_seed
+        self.names = build_name_pools(self.global_seed) if names is None else names
+        self.name_pool_size = len(self.names) // 2
+        self.normal_accounts = normal_accounts
+        self.account_offset = account_offset
+        self.transaction_offset = transaction_offset
+        self.group_names = []
+        self.account_blocks = []
+        self.transaction_blocks = []
+        self.account_count = account_offset  # 下一个账户的全局下标
+    
+    def draw_names(self, count, company_pct):
+        """从名称池抽取名称下标，company_pct 的比例取公司名称"""
+        index = self.rng.integers(0, self.name_pool_size, count)
+        return np.where(self.rng.random(count) < company_pct, index + self.name_pool_size, index)
+    
+    def add_accounts(self, count, country, company_pct, group=-1, role=0):
+        """追加一批账户，country 为国家编码数组，group/role 可以是标量或与count等长的数组"""
+        self.account_blocks.append({
+            'name': self.draw_names(count, company_pct),
+            'registration_day': self.rng.integers(0, REGISTRATION_DAYS, count),
+            'country': country,
+            'group': np.broadcast_to(np.asarray(group, dtype=np.int32), count),
+            'role': np.broadcast_to(np.asarray(role, dtype=np.int8), count)
+        })
+        start = self.account_count
+        self.account_count += count
+        return start
+    
+    def add_transactions(self, src, dst, amount, day, group=-1):
+        """追加一批交易"""
+        self.transaction_blocks.append({
+            'src': np.asarray(src, dtype=np.int64),
+            'dst': np.asarray(dst, dtype=np.int64),
+            'amount': np.round(amount, 2),
+            'day': np.asarray(day),
+            'group': np.broadcast_to(np.asarray(group, dtype=np.int32), len(src))
+        })
+    
+    def add_groups(self, pattern, groups):
+        """登记一类洗钱模式的组名，返回各组的组别编码"""
+        first = len(self.group_names)
+        self.group_names.extend(f"{pattern}_{group_id}" for group_id in range(1, groups + 1))
+        return np.arange(first, first + groups, dtype=np.int32)
+    
+    def generate_normal_accounts(self, count):
+        """生成从当前全局下标开始的count个正常账户"""
+        accounts = np.arange(self.account_count, self.account_count + count)
+        self.add_accounts(count, normal_account_countries(self.global_seed, accounts), 0.3)
+    
+    def generate_normal_transactions(self, count):
+        """生成正常交易: 在全部正常账户中整批抽取源账户和目标账户，目标账户按偏移避开源账户"""
+        src = self.rng.integers(0, self.normal_accounts, count)
+        dst = (src + self.rng.integers(1, self.normal_accounts, count)) % self.normal_accounts
+        amount = self.rng.uniform(50, 50000, count)
+        day = self.rng.integers(0, TRANSACTION_DAYS, count)
+        self.add_transactions(src, dst, amount, day)
+    
+    def generate_circular_patterns(self, groups):
+        """循环闭环交易: 每组3-4个账户在同一天按固定金额 A->B->C->A 转账，组内第一个账户为洗钱者"""
+        codes = self.add_groups('循环闭环交易', groups)
+        sizes = self.rng.integers(3, 5, groups)
+        _, group_of, position = group_layout(sizes, self.account_count)
+        start = self.add_accounts(
+            sizes.sum(), self.rng.choice(LAUNDERING_COUNTRY_CODES, len(position)), 0.2,
+            group=codes[group_of], role=np.where(position == 0, 1, 2)
+        )
+        starts, group_of, position = group_layout(sizes, start)
+        
+        members = starts[group_of] + position
+        next_members = starts[group_of] + (position + 1) % sizes[group_of]
+        amount = self.rng.uniform(10000, 100000, groups)[group_of]
+        day = self.rng.integers(0, TRANSACTION_DAYS, groups)[group_of]
+        self.add_transactions(members, next_members, amount, day, codes[group_of])
+    
+    def generate_star_patterns(self, groups):
+        """星型拆分入账: 1个中心账户（洗钱者）+ 5-7个外围账户同一天各向中心转入小于10000元"""
+        codes = self.add_groups('星型拆分入账', groups)
+        sizes = 1 + self.rng.integers(5, 8, groups)
+        _, group_of, position = group_layout(sizes, self.account_count)
+        company_pct = np.where(position == 0, 0.3, 0.2)
+        start = self.add_accounts(
+            sizes.sum(), self.rng.choice(LAUNDERING_COUNTRY_CODES, len(position)), company_pct,
+            group=codes[group_of], role=np.where(position == 0, 1, 2)
+        )
+        starts, group_of, position = group_layout(sizes, start)
+        
+        spokes = position > 0
+        peripheral = (starts[group_of] + position)[spokes]
+        centers = starts[group_of][spokes]
+        amount = self.rng.uniform(1000, 9999, spokes.sum())
+        day = self.rng.integers(0, TRANSACTION_DAYS, groups)[group_of][spokes]
+        self.add_transactions(peripheral, centers, amount, day, codes[group_of][spokes])
+    
+    def generate_cross_border_patterns(self, groups):
+        """跨境多层转账: 每组 [高危国家目标账户(洗钱者), 源头账户, 2-4个中间层账户]，
+        同一天沿两条 源头->中间层->中间层->目标 路径转账，每条路径金额固定"""
+        codes = self.add_groups('跨境多层转账', groups)
+        sizes = 2 + self.rng.integers(2, 5, groups)
+        _, group_of, position = group_layout(sizes, self.account_count)
+        targets = position == 0
+        country = np.where(
+            targets,
+            self.rng.choice(HIGH_RISK_COUNTRY_CODES, len(position)),
+            self.rng.choice(CROSS_BORDER_COUNTRY_CODES, len(position))
+        )
+        company_pct = np.select([targets, position == 1], [0.4, 0.3], 0.2)
+        start = self.add_accounts(
+            sizes.sum(), country, company_pct,
+            group=codes[group_of], role=np.where(targets, 1, 2)
+        )
+        starts = group_layout(sizes, start)[0]
+        
+        # 每组两条路径，每条路径从中间层账户中不放回抽取2个
+        intermediates = np.repeat(sizes - 2, 2)
+        first = self.rng.integers(0, intermediates)
+        second = (first + self.rng.integers(1, intermediates)) % intermediates
+        path_starts = np.repeat(starts, 2)
+        hops = np.stack([
+            path_starts + 1,
+            path_starts + 2 + first,
+            path_starts + 2 + second,
+            path_starts
+        ], axis=1)
+        amount = np.repeat(self.rng.uniform(20000, 200000, 2 * groups), 3)
+        day = np.repeat(self.rng.integers(0, TRANSACTION_DAYS, groups), 6)
+        self.add_transactions(hops[:, :-1].ravel(), hops[:, 1:].ravel(), amount, day, np.repeat(codes, 6))
+    
+    def concatenate_blocks(self):
+        """合并各批账户和交易的列数组"""
+        self.accounts = {
+            column: np.concatenate([block[column] for block in self.account_blocks])
+            for column in self.account_blocks[0]
+        }
+        self.transactions = {
+            column: np.concatenate([block[column] for block in self.transaction_blocks])
+            for column in self.transaction_blocks[0]
+        }
+    
+    def account_country(self, accounts):
+        """全局账户下标对应的国家编码: 正常账户按哈希计算，洗钱账户查本生成器的账户数组"""
+        country = normal_account_countries(self.global_seed, accounts)
+        laundering = accounts >= self.normal_accounts
+        country[laundering] = self.accounts['country'][accounts[laundering] - self.account_offset]
+        return country
+    
+    def account_ids(self, accounts):
+        """全局账户下标对应的账户ID，CSV直接写整数，Parquet按字符串保存"""
+        account_ids = accounts + ACCOUNT_ID_START
+        return account_ids.astype(str).astype(object) if self.file_format == 'parquet' else account_ids
+    
+    def account_columns(self, rows):
+        """将本生成器的账户行号rows还原为与 account.csv 相同列的 {列名: 数组}"""
+        group = self.accounts['group'][rows]
+        return {
+            'account_id': self.account_ids(rows + self.account_offset),
+            'owner_name': self.owner_names[self.accounts['name'][rows]],
+            'registration_date': self.registration_dates[self.accounts['registration_day'][rows]],
+            'country': self.countries[self.accounts['country'][rows]],
+            'is_suspicious': group >= 0,
+            'suspicious_type': self.group_labels[group + 1],
+            'suspicious_role': self.roles[self.accounts['role'][rows]]
+        }
+    
+    def transaction_columns(self, rows):
+        """将本生成器的交易行号rows还原为与 transaction.csv 相同列的 {列名: 数组}"""
+        src = self.transactions['src'][rows]
+        dst = self.transactions['dst'][rows]
+        group = self.transactions['group'][rows]
+        transaction_numbers = (rows + self.transaction_offset + 1).tolist()
+        return {
+            'transaction_id': np.array(list(map('TXN{:06d}'.format, transaction_numbers)), dtype=object),
+            'src_account': self.account_ids(src),
+            'src_account_country': self.countries[self.account_country(src)],
+            'dst_account': self.account_ids(dst),
+            'dst_account_country': self.countries[self.account_country(dst)],
+            'amount': self.transactions['amount'][rows],
+            'currency': np.full(len(rows), 'CNY', dtype=object),
+            'value_date': self.value_dates[self.transactions['day'][rows]],
+            'is_suspicious': group >= 0,
+            'suspicious_type': self.group_labels[group + 1]
+        }
+    
+    def prepare_output(self, file_format='csv'):
+        """准备按下标还原列值的取值表
+
+        CSV写出字符串，空值写为空字符串；Parquet写出与Spark读取schema一致的类型
+        （registration_date为日期，value_date为时间戳，空值为null）。
+        """
+        self.file_format = file_format
+        empty = None if file_format == 'parquet' else ''
+        if file_format == 'parquet':
+            self.registration_dates = (REGISTRATION_START + np.arange(REGISTRATION_DAYS)).astype(object)
+            self.value_dates = (TRANSACTION_START + np.arange(TRANSACTION_DAYS)).astype('datetime64[us]')
+        else:
+            self.registration_dates = day_strings(REGISTRATION_START, REGISTRATION_DAYS)
+            self.value_dates = day_strings(TRANSACTION_START, TRANSACTION_DAYS, ' 00:00:00')
+        self.owner_names = self.names
+        self.countries = np.array(COUNTRIES, dtype=object)
+        self.roles = np.array([empty] + ROLES[1:], dtype=object)
+        self.group_labels = np.array([empty] + self.group_names, dtype=object)
+        if file_format != 'parquet':
+            # CSV按列拼接写出，文本取值表预先转义
+            self.owner_names, self.countries, self.roles, self.group_labels = map(
+                csv_escape, [self.names, self.countries, self.roles, self.group_labels]
+            )
+    
+    def write_rows(self, path, column_builder, rows, chunk_size, encoding='utf-8-sig'):
+        """按块还原列值并写入同一个CSV或Parquet文件，内存只与块大小有关
+
+        CSV不经过DataFrame，由 csv_text 按列格式化后直接拼接成文本写出。
+        """
+        if self.file_format == 'parquet':
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+            
+            writer = None
+            for offset in range(0, max(len(rows), 1), chunk_size):
+                table = pa.Table.from_pandas(pd.DataFrame(column_builder(rows[offset:offset + chunk_size])),
+                                             preserve_index=False)
+                if writer is None:
+                    # 全部为空值的文本列（如正常账户分片的suspicious_type）按字符串类型写出
+                    schema = pa.schema([
+                        pa.field(field.name, pa.string()) if pa.types.is_null(field.type) else field
+                        for field in table.schema
+                    ])
+                    writer = pq.ParquetWriter(path, schema)
+                table = table.cast(writer.schema)
+                writer.write_table(table)
+            writer.close()
+            return
+        
+        with open(path, 'w', encoding=encoding, newline='') as f:
+            for offset in range(0, max(len(rows), 1), chunk_size):
+                f.write(csv_text(column_builder(rows[offset:offset + chunk_size]), header=offset == 0))
+    
+    def laundering_rows(self, group):
+        """洗钱账户/交易的下标，按suspicious_type排序（稳定排序，组内保持生成顺序）"""
+        rows = np.nonzero(group >= 0)[0]
+        names = np.array(self.group_names, dtype=object)[group[rows]]
+        return rows[np.argsort(names, kind='stable')]
+    
+    def save_ground_truth(self, output_dir, chunk_size=1000000):
+        """写出洗钱账户和洗钱交易真值文件 (CSV)，返回 (洗钱账户数, 洗钱交易数)"""
+        self.prepare_output('csv')
+        laundering_account_rows = self.laundering_rows(self.accounts['group'])
+        laundering_transaction_rows = self.laundering_rows(self.transactions['group'])
+        self.write_rows(os.path.join(output_dir, 'laundering_account.csv'),
+                        self.account_columns, laundering_account_rows, chunk_size)
+        self.write_rows(os.path.join(output_dir, 'laundering_transaction.csv'),
+                        self.transaction_columns, laundering_transaction_rows, chunk_size)
+        return len(laundering_account_rows), len(laundering_transaction_rows)
+    
+    def save_data(self, chunk_size=1000000):
+        """保存数据到CSV文件"""
+        os.makedirs('mock_data', exist_ok=True)
+        self.prepare_output('csv')
+        
+        account_rows = np.arange(len(self.accounts['group']))
+        transaction_rows = np.arange(len(self.transactions['src']))
+        self.write_rows('mock_data/account.csv', self.account_columns, account_rows, chunk_size)
+        self.write_rows('mock_data/transaction.csv', self.transaction_columns, transaction_rows, chunk_size)
+        laundering_accounts, laundering_transactions = self.save_ground_truth('mock_data', chunk_size)
+        
+        print(f"数据生成完成！")
+        print(f"总账户数: {len(account_rows)}")
+        print(f"总交易数: {len(transaction_rows)}")
+        print(f"洗钱账户数: {laundering_accounts}")
+        print(f"洗钱交易数: {laundering_transactions}")
+        print(f"文件已保存到 mock_data/ 目录")
+    
+    def save_partitioned(self, output_dir, part, file_format='csv', chunk_size=1000000):
+        """写出一个分片: account/part-<分片号> 和按交易日期分区的 transaction/transaction_date=<日期>/part-<分片号>
+
+        与Spark写出的分区目录结构相同，Parquet格式可直接用 analyse_aml_patterns.py --source parquet 读取。
+        分片内交易按日期稳定排序后逐日写出，每个日期文件再按块写出。
+        """
+        self.prepare_output(file_format)
+        extension = 'parquet' if file_format == 'parquet' else 'csv'
+        file_name = f'part-{part:05d}.{extension}'
+        
+        account_dir = os.path.join(output_dir, 'account')
+        os.makedirs(account_dir, exist_ok=True)
+        account_rows = np.arange(len(self.accounts['group']))
+        if len(account_rows):
+            self.write_rows(os.path.join(account_dir, file_name), self.account_columns, account_rows, chunk_size,
+                            encoding='utf-8')
+        
+        day = self.transactions['day']
+        order = np.argsort(day, kind='stable')
+        day_bounds = np.searchsorted(day[order], np.arange(TRANSACTION_DAYS + 1))
+        day_names = np.datetime_as_string(TRANSACTION_START + np.arange(TRANSACTION_DAYS))
+        for offset in np.nonzero(np.diff(day_bounds))[0]:
+            day_dir = os.path.join(output_dir, 'transaction', f'transaction_date={day_names[offset]}')
+            os.makedirs(day_dir, exist_ok=True)
+            rows = order[day_bounds[offset]:day_bounds[offset + 1]]
+            self.write_rows(os.path.join(day_dir, file_name), self.transaction_columns, rows, chunk_size,
+                            encoding='utf-8')
+        return len(account_rows), len(order)
+
+def generate_vectorized(args):
+    """向量化模式: 批量生成数组后分块写出"""
+    print(f"开始向量化生成AML模拟数据 (正常账户 {args.accounts:,}, 正常交易 {args.transactions:,}, 每类洗钱模式 {args.groups} 组)...")
+    start_time = time.time()
+    
+    generator = VectorizedAMLDataGenerator(seed=args.seed, normal_accounts=args.accounts)
+    generator.generate_normal_accounts(args.accounts)
+    generator.generate_normal_transactions(args.transactions)
+    generator.generate_circular_patterns(args.groups)
+    generator.generate_star_patterns(args.groups)
+    generator.generate_cross_border_patterns(args.groups)
+    generator.concatenate_blocks()
+    print(f"数组生成耗时 {time.time() - start_time:.1f} 秒")
+    
+    save_start = time.time()
+    generator.save_data()
+    print(f"写出耗时 {time.time() - save_start:.1f} 秒")
+
+def generate_shard(task):
+    """进程池任务: 生成并写出一个正常账户/正常交易分片，返回 (账户数, 交易数)"""
+    generator = VectorizedAMLDataGenerator(
+        seed=task['seed'],
+        normal_accounts=task['normal_accounts'],
+        account_offset=task['account_offset'],
+        transaction_offset=task['transaction_offset'],
+        global_seed=task['global_seed'],
+        names=task['names']
+    )
+    generator.generate_normal_accounts(task['accounts'])
+    generator.generate_normal_transactions(task['transactions'])
+    generator.concatenate_blocks()
+    return generator.save_partitioned(task['output_dir'], task['part'], task['file_format'])
+
+def generate_sharded(args):
+    """分片模式: 正常账户和正常交易按分片在进程池中生成并流式写出，洗钱模式作为最后一个分片
+
+    每个分片的随机数种子由全局种子经 SeedSequence.spawn 派生，账户和交易的全局下标由分片号决定，
+    输出只取决于 --seed 和 --shards，与 --workers 无关。每个进程只持有一个分片的数据。
+    """
+    print(f"开始分片生成AML模拟数据 (正常账户 {args.accounts:,}, 正常交易 {args.transactions:,}, "
+          f"每类洗钱模式 {args.groups} 组, {args.shards} 个分片, {args.workers} 个进程, 格式 {args.format})...")
+    start_time = time.time()
+    
+    # 清理上一次的分片，分片数变化时不会残留旧文件
+    for table in ['account', 'transaction']:
+        shutil.rmtree(os.path.join(args.output_dir, table), ignore_errors=True)
+    os.makedirs(args.output_dir, exist_ok=True)
+    
+    seeds = np.random.SeedSequence(args.seed).spawn(args.shards + 1)
+    names = build_name_pools(args.seed)
+    account_ranges = shard_ranges(args.accounts, args.shards)
+    transaction_ranges = shard_ranges(args.transactions, args.shards)
+    tasks = [
+        {
+            'seed': seeds[part],
+            'normal_accounts': args.accounts,
+            'account_offset': account_ranges[part][0],
+            'accounts': account_ranges[part][1],
+            'transaction_offset': transaction_ranges[part][0],
+            'transactions': transaction_ranges[part][1],
+            'global_seed': args.seed,
+            'names': names,
+            'output_dir': args.output_dir,
+            'part': part,
+            'file_format': args.format
+        }
+        for part in range(args.shards)
+    ]
+    
+    account_count, transaction_count = 0, 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        for accounts, transactions in executor.map(generate_shard, tasks):
+            account_count += accounts
+            transaction_count += transactions
+    
+    # 洗钱模式数据量很小，在主进程生成，作为最后一个分片写出并同时写出真值文件
+    laundering = VectorizedAMLDataGenerator(
+        seed=seeds[-1],
+        normal_accounts=args.accounts,
+        account_offset=args.accounts,
+        transaction_offset=args.transactions,
+        global_seed=args.seed,
+        names=names
+    )
+    laundering.generate_circular_patterns(args.groups)
+    laundering.generate_star_patterns(args.groups)
+    laundering.generate_cross_border_patterns(args.groups)
+    laundering.concatenate_blocks()
+    accounts, transactions = laundering.save_partitioned(args.output_dir, args.shards, args.format)
+    account_count += accounts
+    transaction_count += transactions
+    laundering_accounts, laundering_transactions = laundering.save_ground_truth(args.output_dir)
+    
+    print(f"数据生成完成！")
+    print(f"总账户数: {account_count}")
+    print(f"总交易数: {transaction_count}")
+    print(f"洗钱账户数: {laundering_accounts}")
+    print(f"洗钱交易数: {laundering_transactions}")
+    print(f"文件已保存到 {args.output_dir}/ 目录，耗时 {time.time() - start_time:.1f} 秒")
+
+def stage_outputs(args):
+    """本次运行的输出文件，用于阶段缓存"""
+    if args.shards:
+        return [
+            os.path.join(args.output_dir, 'account'),
+            os.path.join(args.output_dir, 'transaction'),
+            os.path.join(args.output_dir, 'laundering_account.csv'),
+            os.path.join(args.output_dir, 'laundering_transaction.csv')
+        ]
+    return [
+        "mock_data/account.csv",
+        "mock_data/transaction.csv",
+        "mock_data/laundering_account.csv",
+        "mock_data/laundering_transaction.csv"
+    ]
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="AML模拟数据生成")
+    parser.add_argument("--mode", choices=["classic", "vectorized"], default="classic",
+                        help="classic: 逐条生成的小数据集; vectorized: NumPy批量生成，用于千万级压测数据")
+    parser.add_argument("--accounts", type=int, default=70, help="正常账户数 (默认70)")
+    parser.add_argument("--transactions", type=int, default=700, help="正常交易数 (默认700)")
+    parser.add_argument("--groups", type=int, default=3, help="每类洗钱模式的组数 (默认3)")
+    parser.add_argument("--seed", type=int, default=42, help="向量化模式的随机种子 (默认42)")
+    parser.add_argument("--shards", type=int, default=0,
+                        help="向量化模式的分片数，大于0时分片并行生成并写出分区文件 (默认0: 不分片)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="分片生成的进程数 (默认CPU核数)")
+    parser.add_argument("--format", choices=["csv", "parquet"], default="csv", help="分片文件格式 (默认csv)")
+    parser.add_argument("--output-dir", default="mock_data/sharded", help="分片输出目录 (默认mock_data/sharded)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
+    if args.mode == "vectorized":
+        if args.shards:
+            generate_sharded(args)
+        else:
+            generate_vectorized(args)
+        return
+    
     generator = AMLDataGenerator()
     
     print("开始生成AML模拟数据...")
     
     # 生成账户
     print("生成正常账户...")
-    generator.generate_normal_accounts(70)
+    generator.generate_normal_accounts(args.accounts)
     
     print("生成循环闭环交易洗钱账户...")
-    generator.generate_circular_laundering_accounts(3)
+    generator.generate_circular_laundering_accounts(args.groups)
     
     print("生成星型拆分入账洗钱账户...")
-    generator.generate_star_laundering_accounts(3)
+    generator.generate_star_laundering_accounts(args.groups)
     
     print("生成跨境多层转账洗钱账户...")
-    generator.generate_cross_border_laundering_accounts(3)
+    generator.generate_cross_border_laundering_accounts(args.groups)
     
     # 生成交易
     print("生成正常交易...")
-    generator.generate_normal_transactions(700)
+    generator.generate_normal_transactions(args.transactions)
     
     print("生成循环闭环交易...")
     generator.generate_circular_transactions()
@@ -427,4 +976,13 @@ def main():
     generator.save_data()
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    args = parse_args()
+    # 进程数不影响输出，不计入指纹
+    params = {name: value for name, value in vars(args).items() if name != "workers"}
+    run_stage(
+        "generate_aml_data",
+        main,
+        params=params,
+        outputs=stage_outputs(args),
+        code_files=[source_file("generate_aml_data")]
+    ) 
\ No newline at end of file
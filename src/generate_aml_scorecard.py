@@ -8,194 +8,213 @@ AML风险评分系统
 
 import pandas as pd
 import numpy as np
-from collections import defaultdict
+import argparse
+import hashlib
+import json
 import os
+import shutil
 from datetime import datetime
+from aml_id_codec import (
+    load_encoded_results, read_csv_with_ids, build_account_dictionary, encode_accounts, decode_accounts,
+    account_attribute, UNKNOWN_CODE
+)
+from aml_score_rules import (
+    HIGH_RISK_COUNTRIES, COUNTRY_AMOUNT_FEATURES, BUSY_DAY_THRESHOLDS, FEATURE_COLUMNS, evaluate_rules
+)
+from aml_stage_cache import run_stage, source_file
 
 def load_data():
-    """加载检测结果数据"""
+    """加载检测结果数据，账户和交易id在读入时编码为整数"""
     print("加载检测结果数据...")
     
-    # 加载账户检测结果
-    accounts_df = pd.read_csv('result/detected_account.csv')
-    
-    # 加载交易检测结果
-    transactions_df = pd.read_csv('result/detected_transaction.csv')
+    # 加载账户和交易检测结果
+    accounts_df, transactions_df, dictionary = load_encoded_results()
     
     print(f"账户数据: {len(accounts_df)} 条")
     print(f"交易数据: {len(transactions_df)} 条")
     
-    return accounts_df, transactions_df
+    return accounts_df, transactions_df, dictionary
+
+def transaction_sides(transactions_df, account_countries):
+    """把每笔交易拆成转出方和转入方两行，作为账户级评分的输入
 
-def calculate_risk_score(accounts_df, transactions_df):
-    """计算账户风险评分"""
+    列: account_code, counterparty_known, counterparty_country, amount, date, has_transaction_id。
+    自转账只保留转出方一行（与逐账户筛选交易时一笔交易只出现一次一致）；
+    对手方不在账户表中时 counterparty_known 为False，counterparty_country 为None。
+    """
+    src_codes = transactions_df['src_code'].to_numpy()
+    dst_codes = transactions_df['dst_code'].to_numpy()
+    inbound = src_codes != dst_codes
+    
+    account_codes = np.concatenate([src_codes, dst_codes[inbound]])
+    counterparty_codes = np.concatenate([dst_codes, src_codes[inbound]])
+    counterparty_known = counterparty_codes != UNKNOWN_CODE
+    counterparty_countries = np.full(len(counterparty_codes), None, dtype=object)
+    counterparty_countries[counterparty_known] = account_countries[counterparty_codes[counterparty_known]]
+    
+    amounts = transactions_df['amount'].to_numpy()
+    dates = pd.to_datetime(transactions_df['value_date']).dt.normalize().to_numpy()
+    has_transaction_id = transactions_df['transaction_id'].notna().to_numpy()
+    sides = pd.DataFrame({
+        'account_code': account_codes,
+        'counterparty_known': counterparty_known,
+        'counterparty_country': counterparty_countries,
+        'amount': np.concatenate([amounts, amounts[inbound]]),
+        'date': np.concatenate([dates, dates[inbound]]),
+        'has_transaction_id': np.concatenate([has_transaction_id, has_transaction_id[inbound]])
+    })
+    return sides[sides['account_code'] != UNKNOWN_CODE]
+
+def aggregate_sides(sides):
+    """把方向化的交易行聚合为评分用的三张表，新交易的聚合结果可以按键直接累加
+
+    high_risk_counts (account_code, high_risk_trans_count): 涉及高危国家对手方的交易笔数
+    country_amounts (account_code, counterparty_country, amount): 与各对手方国家的交易金额（对手方在账户表中且国家非空）
+    daily_stats (account_code, date, trans_count, total_amount): 每天的交易笔数和金额
+    """
+    high_risk_counts = sides['counterparty_country'].isin(HIGH_RISK_COUNTRIES) \
+        .groupby(sides['account_code']).sum() \
+        .rename('high_risk_trans_count') \
+        .reset_index()
+    
+    country_sides = sides[sides['counterparty_known'] & (sides['counterparty_country'] != '')]
+    country_amounts = country_sides.groupby(['account_code', 'counterparty_country'], dropna=False)['amount'] \
+        .sum().reset_index()
+    
+    daily_stats = sides.groupby(['account_code', 'date']).agg(
+        trans_count=('has_transaction_id', 'sum'),
+        total_amount=('amount', 'sum')
+    ).reset_index()
+    
+    return {
+        'high_risk_counts': high_risk_counts,
+        'country_amounts': country_amounts,
+        'daily_stats': daily_stats
+    }
+
+def features_from_aggregates(accounts_df, aggregates):
+    """由 aggregate_sides 的聚合表计算评分特征表: 账户表每行一行，附加 aml_score_rules.FEATURE_COLUMNS 中的特征列"""
+    features = accounts_df.reset_index(drop=True)
+    account_codes = features['account_code']
+    
+    # 涉及高危国家对手方的交易笔数
+    high_risk_counts = aggregates['high_risk_counts'].set_index('account_code')['high_risk_trans_count']
+    features['high_risk_trans_count'] = account_codes.map(high_risk_counts).fillna(0).astype(np.int64)
+    
+    # 去掉与本账户国家相同的对手方国家后，按金额阈值统计国家数
+    account_amounts = pd.DataFrame({
+        'row': np.arange(len(features)),
+        'account_code': account_codes,
+        'country': features['country']
+    }).merge(aggregates['country_amounts'], on='account_code')
+    account_amounts = account_amounts[account_amounts['counterparty_country'] != account_amounts['country']]
+    for feature, threshold in COUNTRY_AMOUNT_FEATURES.items():
+        features[feature] = np.bincount(
+            account_amounts.loc[account_amounts['amount'] > threshold, 'row'], minlength=len(features)
+        )
+    
+    # 每个账户取高频交易日中金额最大的一天（金额相同取较早的一天）
+    daily_stats = aggregates['daily_stats']
+    busy_day = np.zeros(len(daily_stats), dtype=bool)
+    for min_count, min_amount in BUSY_DAY_THRESHOLDS:
+        busy_day |= (daily_stats['trans_count'] > min_count) & (daily_stats['total_amount'] > min_amount)
+    max_days = daily_stats[busy_day] \
+        .sort_values(['account_code', 'total_amount', 'date'], ascending=[True, False, True], kind='stable') \
+        .drop_duplicates('account_code') \
+        .set_index('account_code')
+    max_days = max_days.reindex(account_codes)
+    features['max_day_date'] = max_days['date'].to_numpy()
+    features['max_day_count'] = max_days['trans_count'].fillna(0).to_numpy(dtype=np.int64)
+    features['max_day_amount'] = max_days['total_amount'].fillna(0.0).to_numpy(dtype=np.float64)
+    
+    return features
+
+def compute_account_features(accounts_df, transactions_df, dictionary):
+    """计算评分特征表
+
+    交易按方向拆成 (账户, 对手方) 两行并一次性关联对手方国家，所有特征都由这张表分组聚合得到。
+    """
+    # 按账户编码排列的国家，对手方国家直接按编码取值
+    account_countries = account_attribute(accounts_df, dictionary, 'country')
+    sides = transaction_sides(transactions_df, account_countries)
+    return features_from_aggregates(accounts_df, aggregate_sides(sides))
+
+def risk_score_frame(features, total_score, score_details):
+    """评分结果表，列与 high_risk_accounts.csv 一致（另有内部使用的 account_code）"""
+    return pd.DataFrame({
+        'account_id': features['account_id'],
+        'account_code': features['account_code'],
+        'owner_name': features['owner_name'],
+        'country': features['country'],
+        'total_score': total_score,
+        'score_details': score_details,
+        'detected_suspicious': features['detected_suspicious'],
+        'detected_suspicious_type': features['detected_suspicious_type'],
+        'detected_suspicious_role': features['detected_suspicious_role'],
+        'registration_date': features['registration_date']
+    })
+
+def calculate_risk_score(accounts_df, transactions_df, dictionary):
+    """计算账户风险评分
+
+    先计算每个账户的评分特征，再由 aml_score_rules 中定义的规则一次列式计算得分和评分详情。
+    """
     print("计算账户风险评分...")
     
-    # 定义高危国家
-    high_risk_countries = ["高危国1", "高危国2", "高危国3"]
+    features = compute_account_features(accounts_df, transactions_df, dictionary)
+    _, total_score, score_details = evaluate_rules(features)
     
-    # 初始化评分结果
-    risk_scores = []
+    # 保存评分结果
+    return risk_score_frame(features, total_score, score_details)
+
+# 预警报告中每个账户显示的交易对手方数量
+REPORT_TOP_COUNTERPARTIES = 10
+
+def build_counterparty_index(account_codes, transactions_df, accounts_df, top_k=REPORT_TOP_COUNTERPARTIES):
+    """一次遍历交易表，为所有预警账户构建按金额排列的前top_k个交易对手方表
+
+    每笔交易对当前账户记一行（自环交易只记转出），只保留账户表中存在的对手方，重复账户取第一次出现的记录。
+    金额相同按交易在检测结果中的顺序排列。
+    返回 (对手方表，列为 account_code, direction, account_id, owner_name, country, amount, currency, date,
+    is_suspicious; 按账户编码索引的对手方总数)。
+    """
+    accounts_by_code = accounts_df.drop_duplicates('account_code').set_index('account_code')
     
-    for _, account in accounts_df.iterrows():
-        account_id = account['account_id']
-        account_country = account['country']
-        
-        # 初始化评分和评分详情
-        total_score = 0
-        score_details = []
-        
-        # 规则1: 如果账户属于高危国家，加40分
-        if account_country in high_risk_countries:
-            total_score += 40
-            score_details.append(f"高危国家账户: +40分")
-        
-        # 获取该账户相关的所有交易
-        account_transactions = transactions_df[
-            (transactions_df['src_account'] == account_id) | 
-            (transactions_df['dst_account'] == account_id)
-        ].copy()
-        
-        # 规则2: 如果账户不属于高危国家但是有交易涉及另一个账户是高危国家的，每有一条加10分，最高40分
-        if account_country not in high_risk_countries:
-            high_risk_trans_count = 0
-            for _, trans in account_transactions.iterrows():
-                other_country = None
-                if trans['src_account'] == account_id:
-                    # 当前账户是发送方，检查接收方国家
-                    other_account = accounts_df[accounts_df['account_id'] == trans['dst_account']]
-                    if not other_account.empty:
-                        other_country = other_account.iloc[0]['country']
-                else:
-                    # 当前账户是接收方，检查发送方国家
-                    other_account = accounts_df[accounts_df['account_id'] == trans['src_account']]
-                    if not other_account.empty:
-                        other_country = other_account.iloc[0]['country']
-                
-                if other_country in high_risk_countries:
-                    high_risk_trans_count += 1
-            
-            high_risk_score = min(high_risk_trans_count * 10, 40)
-            if high_risk_score > 0:
-                total_score += high_risk_score
-                score_details.append(f"涉及高危国家交易 {high_risk_trans_count} 笔: +{high_risk_score}分")
-        
-        # 规则3: 多国交易评分
-        # 统计与不同国家的交易金额
-        country_amounts = defaultdict(float)
-        for _, trans in account_transactions.iterrows():
-            other_country = None
-            if trans['src_account'] == account_id:
-                other_account = accounts_df[accounts_df['account_id'] == trans['dst_account']]
-                if not other_account.empty:
-                    other_country = other_account.iloc[0]['country']
-            else:
-                other_account = accounts_df[accounts_df['account_id'] == trans['src_account']]
-                if not other_account.empty:
-                    other_country = other_account.iloc[0]['country']
-            
-            if other_country and other_country != account_country:
-                country_amounts[other_country] += trans['amount']
-        
-        # 计算符合条件的国家数量
-        countries_over_50k = sum(1 for amount in country_amounts.values() if amount > 50000)
-        countries_over_100k = sum(1 for amount in country_amounts.values() if amount > 100000)
-        
-        if countries_over_100k > 6:
-            total_score += 40
-            score_details.append(f"与{countries_over_100k}个国家交易超过10万: +40分")
-        elif countries_over_50k > 4:
-            total_score += 20
-            score_details.append(f"与{countries_over_50k}个国家交易超过5万: +20分")
-        
-        # 规则4: 单日高频交易评分
-        # 按日期分组统计交易
-        account_transactions['value_date'] = pd.to_datetime(account_transactions['value_date'])
-        daily_stats = account_transactions.groupby(account_transactions['value_date'].dt.date).agg({
-            'transaction_id': 'count',
-            'amount': 'sum'
-        }).reset_index()
-        daily_stats.columns = ['date', 'trans_count', 'total_amount']
-        
-        # 检查单日交易条件
-        high_freq_days = daily_stats[
-            ((daily_stats['trans_count'] > 20) & (daily_stats['total_amount'] > 100000)) |
-            ((daily_stats['trans_count'] > 10) & (daily_stats['total_amount'] > 50000))
-        ]
-        
-        if not high_freq_days.empty:
-            max_day = high_freq_days.loc[high_freq_days['total_amount'].idxmax()]
-            if max_day['trans_count'] > 20 and max_day['total_amount'] > 100000:
-                total_score += 30
-                score_details.append(f"单日交易{max_day['trans_count']}笔金额{max_day['total_amount']:,.0f}: +30分")
-            elif max_day['trans_count'] > 10 and max_day['total_amount'] > 50000:
-                total_score += 15
-                score_details.append(f"单日交易{max_day['trans_count']}笔金额{max_day['total_amount']:,.0f}: +15分")
-        
-        # 规则5: 洗钱检测结果评分
-        if account.get('detected_suspicious', False):
-            role = account.get('detected_suspicious_role', '')
-            suspicious_type = account.get('detected_suspicious_type', '')
-            
-            if role == '洗钱者':
-                total_score += 100
-                score_details.append(f"检测为洗钱者({suspicious_type}): +100分")
-            elif role == '协助者':
-                total_score += 50
-                score_details.append(f"检测为协助者({suspicious_type}): +50分")
-        
-        # 保存评分结果
-        risk_scores.append({
-            'account_id': account_id,
-            'owner_name': account['owner_name'],
-            'country': account_country,
-            'total_score': total_score,
-            'score_details': '; '.join(score_details) if score_details else '无风险因子',
-            'detected_suspicious': account.get('detected_suspicious', False),
-            'detected_suspicious_type': account.get('detected_suspicious_type', ''),
-            'detected_suspicious_role': account.get('detected_suspicious_role', ''),
-            'registration_date': account['registration_date']
-        })
-    
-    return pd.DataFrame(risk_scores)
-
-def get_account_counterparties(account_id, transactions_df, accounts_df):
-    """获取账户的交易对手方信息"""
-    counterparties = []
-    
-    # 获取该账户的所有交易
-    account_transactions = transactions_df[
-        (transactions_df['src_account'] == account_id) | 
-        (transactions_df['dst_account'] == account_id)
-    ]
+    src_codes = transactions_df['src_code'].to_numpy()
+    dst_codes = transactions_df['dst_code'].to_numpy()
+    alerted = np.unique(np.asarray(account_codes))
+    outbound = np.flatnonzero(np.isin(src_codes, alerted))
+    inbound = np.flatnonzero(np.isin(dst_codes, alerted) & (src_codes != dst_codes))
     
-    for _, trans in account_transactions.iterrows():
-        if trans['src_account'] == account_id:
-            # 当前账户是发送方
-            counterparty_id = trans['dst_account']
-            direction = "转出至"
-        else:
-            # 当前账户是接收方
-            counterparty_id = trans['src_account']
-            direction = "接收自"
-        
-        # 获取对手方信息
-        counterparty_info = accounts_df[accounts_df['account_id'] == counterparty_id]
-        if not counterparty_info.empty:
-            counterparty = counterparty_info.iloc[0]
-            counterparties.append({
-                'direction': direction,
-                'account_id': counterparty_id,
-                'owner_name': counterparty['owner_name'],
-                'country': counterparty['country'],
-                'amount': trans['amount'],
-                'currency': trans['currency'],
-                'date': trans['value_date'],
-                'is_suspicious': trans.get('detected_suspicious', False),
-                'suspicious_type': trans.get('detected_suspicious_type', '')
-            })
-    
-    return counterparties
+    # 当前账户是发送方时对手方为接收方，反之为发送方
+    rows = np.concatenate([outbound, inbound])
+    if 'detected_suspicious' in transactions_df.columns:
+        is_suspicious = transactions_df['detected_suspicious'].to_numpy()[rows]
+    else:
+        is_suspicious = np.full(len(rows), False)
+    sides = pd.DataFrame({
+        'row': rows,
+        'account_code': np.concatenate([src_codes[outbound], dst_codes[inbound]]),
+        'counterparty_code': np.concatenate([dst_codes[outbound], src_codes[inbound]]),
+        'direction': np.repeat(["转出至", "接收自"], [len(outbound), len(inbound)]),
+        'amount': transactions_df['amount'].to_numpy()[rows],
+        'currency': transactions_df['currency'].to_numpy()[rows],
+        'date': transactions_df['value_date'].to_numpy()[rows],
+        'is_suspicious': is_suspicious
+    })
+    sides = sides[sides['counterparty_code'].isin(accounts_by_code.index)]
+    counts = sides.groupby('account_code').size()
+    
+    top = sides.sort_values(['account_code', 'amount', 'row'], ascending=[True, False, True]) \
+        .groupby('account_code', sort=False) \
+        .head(top_k)
+    counterparties = accounts_by_code.reindex(top['counterparty_code'])
+    top = top.assign(
+        account_id=counterparties['account_id'].to_numpy(),
+        owner_name=counterparties['owner_name'].to_numpy(),
+        country=counterparties['country'].to_numpy()
+    )
+    return top.drop(columns=['row', 'counterparty_code']).reset_index(drop=True), counts
 
 def generate_high_risk_csv(risk_scores_df):
     """生成高风险账户CSV文件"""
@@ -204,14 +223,16 @@ def generate_high_risk_csv(risk_scores_df):
     # 筛选评分超过80的账户
     high_risk_accounts = risk_scores_df[risk_scores_df['total_score'] > 80].copy()
     
-    # 按分数从大到小排序
-    high_risk_accounts = high_risk_accounts.sort_values('total_score', ascending=False)
+    # 按分数从大到小排序，分数相同保持检测结果中的顺序（与Spark实现一致）
+    high_risk_accounts = high_risk_accounts.sort_values('total_score', ascending=False, kind='stable')
     
     # 确保result目录存在
     os.makedirs('result', exist_ok=True)
     
-    # 保存CSV文件
-    high_risk_accounts.to_csv('result/high_risk_accounts.csv', index=False, encoding='utf-8-sig')
+    # 保存CSV文件，账户编码只在内部使用
+    high_risk_accounts.drop(columns=['account_code']).to_csv(
+        'result/high_risk_accounts.csv', index=False, encoding='utf-8-sig'
+    )
     
     print(f"高风险账户CSV文件已保存: {len(high_risk_accounts)} 个账户")
     return high_risk_accounts
@@ -268,6 +289,19 @@ def generate_alert_report(high_risk_accounts, transactions_df, accounts_df):
     report.append("## 详细预警信息")
     report.append("")
     
+    # 所有预警账户的主要交易对手方一次算出，按账户编码分组为报告中的表格行
+    top_counterparties, counterparty_counts = build_counterparty_index(
+        high_risk_accounts['account_code'], transactions_df, accounts_df
+    )
+    counterparty_lines = pd.Series([
+        f"| {direction} | {owner_name} ({account_id}) | {country} | {amount:,.0f} {currency} | {date[:10]} | {'🚨' if is_suspicious else ''} |"
+        for direction, owner_name, account_id, country, amount, currency, date, is_suspicious in zip(
+            top_counterparties['direction'], top_counterparties['owner_name'], top_counterparties['account_id'],
+            top_counterparties['country'], top_counterparties['amount'], top_counterparties['currency'],
+            top_counterparties['date'], top_counterparties['is_suspicious']
+        )
+    ], dtype=object).groupby(top_counterparties['account_code'].to_numpy(), sort=False).agg(list)
+    
     for idx, (_, account) in enumerate(high_risk_accounts.iterrows(), 1):
         account_id = account['account_id']
         
@@ -301,25 +335,18 @@ def generate_alert_report(high_risk_accounts, transactions_df, accounts_df):
         
         report.append("")
         
-        # 获取交易对手方信息
-        counterparties = get_account_counterparties(account_id, transactions_df, accounts_df)
+        # 交易对手方信息，按金额显示前10个
+        counterparty_count = counterparty_counts.get(account['account_code'], 0)
         
-        if counterparties:
+        if counterparty_count:
             report.append("**主要交易对手方**:")
             report.append("")
-            
-            # 按金额排序，显示前10个
-            counterparties_sorted = sorted(counterparties, key=lambda x: x['amount'], reverse=True)[:10]
-            
             report.append("| 方向 | 对手方 | 国家 | 金额 | 日期 | 可疑标记 |")
             report.append("|------|--------|------|------|------|----------|")
+            report.extend(counterparty_lines[account['account_code']])
             
-            for cp in counterparties_sorted:
-                suspicious_mark = "🚨" if cp['is_suspicious'] else ""
-                report.append(f"| {cp['direction']} | {cp['owner_name']} ({cp['account_id']}) | {cp['country']} | {cp['amount']:,.0f} {cp['currency']} | {cp['date'][:10]} | {suspicious_mark} |")
-            
-            if len(counterparties) > 10:
-                report.append(f"*（显示前10个，共{len(counterparties)}个交易对手方）*")
+            if counterparty_count > REPORT_TOP_COUNTERPARTIES:
+                report.append(f"*（显示前{REPORT_TOP_COUNTERPARTIES}个，共{counterparty_count}个交易对手方）*")
         
         report.append("")
         report.append("---")
@@ -332,43 +359,275 @@ def generate_alert_report(high_risk_accounts, transactions_df, accounts_df):
     
     print("预警报告已保存到 result/risk_alert_report.md")
 
-def main():
+SCORE_STATE_DIR = "result/score_state"
+
+# 评分状态表及其键: 状态按账户id保存，新批次的聚合结果按键相加即可合并
+SCORE_STATE_TABLES = {
+    'high_risk_counts': ['account_id'],
+    'country_amounts': ['account_id', 'counterparty_country'],
+    'daily_stats': ['account_id', 'date']
+}
+
+# 每个账户的特征缓存，只对受影响的账户重新计算
+STATE_FEATURE_COLUMNS = ['account_id', 'country', *FEATURE_COLUMNS]
+
+# 状态表和特征缓存按账户id哈希分成固定数量的Parquet分区，每个批次只读写涉及账户所在的分区
+STATE_PARTITIONS = 64
+
+def score_state_params():
+    """决定状态内容和分区布局的参数，变化时重建状态"""
+    return {'high_risk_countries': HIGH_RISK_COUNTRIES, 'partitions': STATE_PARTITIONS}
+
+def feature_params():
+    """只影响特征的参数，变化时由状态重新计算所有账户的特征，不需要重建状态"""
+    return {
+        'country_amount_features': COUNTRY_AMOUNT_FEATURES,
+        'busy_day_thresholds': [list(thresholds) for thresholds in BUSY_DAY_THRESHOLDS]
+    }
+
+def file_digest(path):
+    """批次文件内容的SHA-256，用于识别已应用过的批次"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+def read_state_manifest(state_dir=SCORE_STATE_DIR):
+    """读取评分状态的manifest，不存在时返回None"""
+    path = os.path.join(state_dir, 'manifest.json')
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_state_manifest(manifest, state_dir=SCORE_STATE_DIR):
+    """状态表全部写出后再记录manifest"""
+    with open(os.path.join(state_dir, 'manifest.json'), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+
+def state_partitions(account_ids):
+    """账户id所在的状态分区编号（与进程无关的稳定哈希）"""
+    hashes = pd.util.hash_pandas_object(pd.Series(account_ids, dtype=object).astype(str), index=False)
+    return (hashes.to_numpy() % STATE_PARTITIONS).astype(np.int64)
+
+def state_partition_path(state_dir, name, partition):
+    """状态表分区文件路径"""
+    return os.path.join(state_dir, name, f'part-{partition:03d}.parquet')
+
+def read_state_table(name, partitions=None, state_dir=SCORE_STATE_DIR):
+    """读取状态表的指定分区 (默认全部分区)，没有任何分区文件时返回None"""
+    if partitions is None:
+        partitions = range(STATE_PARTITIONS)
+    paths = [state_partition_path(state_dir, name, partition) for partition in partitions]
+    frames = [pd.read_parquet(path) for path in paths if os.path.exists(path)]
+    return pd.concat(frames, ignore_index=True) if frames else None
+
+def write_state_tables(tables, partitions, state_dir=SCORE_STATE_DIR):
+    """只写出评分状态表和特征缓存的指定分区 (Parquet，需要pyarrow)，其余分区文件保持不变
+
+    tables中每张表须包含这些分区的全部行。
+    """
+    for name, table in tables.items():
+        os.makedirs(os.path.join(state_dir, name), exist_ok=True)
+        table_partitions = state_partitions(table['account_id'])
+        for partition in partitions:
+            table[table_partitions == partition].to_parquet(
+                state_partition_path(state_dir, name, partition), index=False
+            )
+
+def aggregate_batch(transactions_df, dictionary, account_countries):
+    """聚合一个批次的交易，返回按账户id保存的 aggregate_sides 三张表"""
+    transactions_df = transactions_df.assign(
+        src_code=encode_accounts(dictionary, transactions_df['src_account']),
+        dst_code=encode_accounts(dictionary, transactions_df['dst_account'])
+    )
+    aggregates = aggregate_sides(transaction_sides(transactions_df, account_countries))
+    return {
+        name: table.assign(account_code=decode_accounts(dictionary, table['account_code']))
+        .rename(columns={'account_code': 'account_id'})
+        for name, table in aggregates.items()
+    }
+
+def merge_state_table(state_table, batch_table, keys):
+    """把批次聚合结果累加到状态表，只对批次涉及的账户重新分组求和"""
+    if state_table is None:
+        return batch_table
+    touched = state_table['account_id'].isin(batch_table['account_id'])
+    updated = pd.concat([state_table[touched], batch_table]) \
+        .groupby(keys, dropna=False, sort=False).sum() \
+        .reset_index()
+    return pd.concat([state_table[~touched], updated], ignore_index=True)
+
+def update_state_features(tables, accounts_df, dictionary, touched_ids):
+    """重新计算touched_ids中账户的特征，其余账户沿用特征缓存"""
+    accounts = accounts_df.drop_duplicates('account_code')
+    accounts = accounts[accounts['account_id'].isin(touched_ids)]
+    aggregates = {}
+    for name in SCORE_STATE_TABLES:
+        table = tables[name][tables[name]['account_id'].isin(touched_ids)]
+        aggregates[name] = table.assign(account_code=encode_accounts(dictionary, table['account_id'])) \
+            .drop(columns='account_id')
+    features = features_from_aggregates(accounts, aggregates)[STATE_FEATURE_COLUMNS]
+    
+    if tables['features'] is None:
+        return features
+    kept = tables['features'][~tables['features']['account_id'].isin(touched_ids)]
+    return pd.concat([kept, features], ignore_index=True)
+
+def changed_country_accounts(accounts_df, cached_features):
+    """国家与特征缓存中不同的账户（多国交易特征排除本国，国家变化后需要重新计算）"""
+    if cached_features is None:
+        return pd.Index(accounts_df['account_id'].unique())
+    accounts = accounts_df.drop_duplicates('account_id').set_index('account_id')['country']
+    cached = cached_features.set_index('account_id')['country'].reindex(accounts.index)
+    changed = (accounts != cached) & ~(accounts.isna() & cached.isna())
+    return accounts.index[changed.to_numpy()]
+
+def run_incremental_scoring(batch_paths=(), rebuild=False, state_dir=SCORE_STATE_DIR):
+    """增量评分: 把新批次的交易累加到评分状态，只重新计算受影响账户的特征，再对特征表按规则评分
+
+    评分状态不存在、状态参数有变化或指定rebuild时，先由 result/detected_transaction.csv 重建状态。
+    批次文件与交易CSV格式相同，按内容识别，同一批次只会应用一次。
+    状态表只读取和重写受影响账户所在的分区；特征缓存每个账户一行，评分时全部读入，同样只重写受影响的分区。
+    """
+    print("增量计算账户风险评分...")
+    
+    accounts_df = read_csv_with_ids('result/detected_account.csv')
+    dictionary = build_account_dictionary(accounts_df['account_id'])
+    accounts_df = accounts_df.assign(account_code=encode_accounts(dictionary, accounts_df['account_id']))
+    account_countries = account_attribute(accounts_df, dictionary, 'country')
+    
+    manifest = read_state_manifest(state_dir)
+    rebuilding = rebuild or manifest is None or manifest.get('params') != score_state_params()
+    if rebuilding:
+        if manifest is not None:
+            print("评分状态参数有变化或要求重建，由 result/detected_transaction.csv 重建评分状态")
+        shutil.rmtree(state_dir, ignore_errors=True)
+        manifest = {'params': score_state_params(), 'feature_params': None, 'batches': []}
+        batch_paths = ['result/detected_transaction.csv', *batch_paths]
+    
+    batches = []
+    touched_ids = pd.Index([], dtype=object)
+    for path in batch_paths:
+        digest = file_digest(path)
+        if digest in manifest['batches']:
+            print(f"批次 {path} 已应用过，跳过")
+            continue
+        
+        batch = aggregate_batch(read_csv_with_ids(path), dictionary, account_countries)
+        batch_ids = pd.Index(batch['daily_stats']['account_id'].unique())
+        touched_ids = touched_ids.union(batch_ids)
+        batches.append(batch)
+        manifest['batches'].append(digest)
+        print(f"应用批次 {path}: 涉及 {len(batch_ids)} 个账户")
+    
+    # 特征参数变化时所有账户都重新计算，否则只计算批次涉及的账户和国家有变化的账户
+    cached_features = read_state_table('features', state_dir=state_dir)
+    if manifest['feature_params'] != feature_params():
+        touched_ids = pd.Index(accounts_df['account_id'].unique())
+        manifest['feature_params'] = feature_params()
+    else:
+        touched_ids = touched_ids.union(changed_country_accounts(accounts_df, cached_features))
+    print(f"重新计算特征: {len(touched_ids)} 个账户")
+    
+    # 只读入受影响账户所在的分区，合并批次后整区重写；重建时写出全部分区，没有受影响的账户时不重写
+    partitions = range(STATE_PARTITIONS) if rebuilding else np.unique(state_partitions(touched_ids))
+    tables = {'features': cached_features}
+    if len(partitions):
+        tables.update({name: read_state_table(name, partitions, state_dir) for name in SCORE_STATE_TABLES})
+        for batch in batches:
+            for name, keys in SCORE_STATE_TABLES.items():
+                tables[name] = merge_state_table(tables[name], batch[name], keys)
+        tables['features'] = update_state_features(tables, accounts_df, dictionary, touched_ids)
+        write_state_tables(tables, partitions, state_dir)
+    write_state_manifest(manifest, state_dir)
+    print(f"重写评分状态分区: {len(partitions)}/{STATE_PARTITIONS} 个")
+    
+    # 所有账户按缓存的特征评分，没有交易的账户特征为0
+    features = accounts_df.reset_index(drop=True).merge(
+        tables['features'].drop(columns='country'), on='account_id', how='left'
+    )
+    features = features.fillna({
+        'high_risk_trans_count': 0, **{feature: 0 for feature in COUNTRY_AMOUNT_FEATURES},
+        'max_day_count': 0, 'max_day_amount': 0.0
+    }).astype({
+        'high_risk_trans_count': np.int64, **{feature: np.int64 for feature in COUNTRY_AMOUNT_FEATURES},
+        'max_day_count': np.int64
+    })
+    _, total_score, score_details = evaluate_rules(features)
+    return risk_score_frame(features, total_score, score_details)
+
+def print_score_statistics(risk_scores_df, high_risk_accounts):
+    """输出评分统计"""
+    print(f"\n=== 评分统计 ===")
+    print(f"总账户数: {len(risk_scores_df)}")
+    print(f"高风险账户数 (>80分): {len(high_risk_accounts)}")
+    print(f"最高分: {risk_scores_df['total_score'].max()}")
+    print(f"平均分: {risk_scores_df['total_score'].mean():.2f}")
+    
+    # 按分数段统计
+    score_ranges = [(0, 20), (20, 40), (40, 60), (60, 80), (80, 100), (100, float('inf'))]
+    for min_score, max_score in score_ranges:
+        if max_score == float('inf'):
+            count = len(risk_scores_df[risk_scores_df['total_score'] >= min_score])
+            print(f"{min_score}分以上: {count} 个账户")
+        else:
+            count = len(risk_scores_df[
+                (risk_scores_df['total_score'] >= min_score) & 
+                (risk_scores_df['total_score'] < max_score)
+            ])
+            print(f"{min_score}-{max_score}分: {count} 个账户")
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="AML风险评分")
+    parser.add_argument("--engine", choices=["pandas", "spark"], default="pandas",
+                        help="评分引擎: pandas(单机) 或 spark(分布式，另外输出 result/risk_score_breakdown.csv)")
+    parser.add_argument("--incremental", action="store_true",
+                        help=f"增量评分: 把新批次交易累加到 {SCORE_STATE_DIR} 中的评分状态，只重新计算受影响账户的特征 (需要pyarrow)")
+    parser.add_argument("--batch", nargs="*", default=[],
+                        help="增量评分时应用的新交易CSV文件，格式与交易CSV相同，同一文件只应用一次")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="增量评分前由 result/detected_transaction.csv 重建评分状态")
+    return parser.parse_args(argv)
+
+def main(argv=None):
     """主函数"""
+    args = parse_args(argv)
+    
+    # Spark引擎不在driver上加载完整的检测结果
+    if args.engine == "spark":
+        if args.incremental:
+            print("Spark评分引擎不支持增量评分")
+            return
+        import spark_aml_scorecard
+        spark_aml_scorecard.main()
+        return
+    
     print("=== AML风险评分系统开始 ===")
     
     try:
-        # 加载数据
-        accounts_df, transactions_df = load_data()
-        
-        # 计算风险评分
-        risk_scores_df = calculate_risk_score(accounts_df, transactions_df)
-        
-        # 生成高风险账户CSV
-        high_risk_accounts = generate_high_risk_csv(risk_scores_df)
-        
-        # 生成预警报告
-        generate_alert_report(high_risk_accounts, transactions_df, accounts_df)
+        if args.incremental:
+            # 增量评分只读取新批次的交易，不生成需要完整交易明细的预警报告
+            risk_scores_df = run_incremental_scoring(args.batch, args.rebuild)
+            high_risk_accounts = generate_high_risk_csv(risk_scores_df)
+        else:
+            # 加载数据
+            accounts_df, transactions_df, dictionary = load_data()
+            
+            # 计算风险评分
+            risk_scores_df = calculate_risk_score(accounts_df, transactions_df, dictionary)
+            
+            # 生成高风险账户CSV
+            high_risk_accounts = generate_high_risk_csv(risk_scores_df)
+            
+            # 生成预警报告
+            generate_alert_report(high_risk_accounts, transactions_df, accounts_df)
         
         # 输出统计信息
-        print(f"\n=== 评分统计 ===")
-        print(f"总账户数: {len(risk_scores_df)}")
-        print(f"高风险账户数 (>80分): {len(high_risk_accounts)}")
-        print(f"最高分: {risk_scores_df['total_score'].max()}")
-        print(f"平均分: {risk_scores_df['total_score'].mean():.2f}")
-        
-        # 按分数段统计
-        score_ranges = [(0, 20), (20, 40), (40, 60), (60, 80), (80, 100), (100, float('inf'))]
-        for min_score, max_score in score_ranges:
-            if max_score == float('inf'):
-                count = len(risk_scores_df[risk_scores_df['total_score'] >= min_score])
-                print(f"{min_score}分以上: {count} 个账户")
-            else:
-                count = len(risk_scores_df[
-                    (risk_scores_df['total_score'] >= min_score) & 
-                    (risk_scores_df['total_score'] < max_score)
-                ])
-                print(f"{min_score}-{max_score}分: {count} 个账户")
-        
+        print_score_statistics(risk_scores_df, high_risk_accounts)
+    
     except Exception as e:
         print(f"评分过程中出现错误: {str(e)}")
         import traceback
@@ -376,5 +635,28 @@ def main():
     
     print("=== AML风险评分系统完成 ===")
 
+def run_cached(argv=None):
+    """按检测结果、参数和代码的指纹运行评分，未变化时跳过 (见 aml_stage_cache)"""
+    args = parse_args(argv)
+    # 增量评分的结果取决于评分状态，不按指纹缓存
+    if args.incremental:
+        main(argv)
+        return
+    
+    outputs = ["result/high_risk_accounts.csv", "result/risk_alert_report.md"]
+    code_files = [source_file("generate_aml_scorecard"), source_file("aml_id_codec"), source_file("aml_score_rules")]
+    if args.engine == "spark":
+        outputs.append("result/risk_score_breakdown.csv")
+        code_files += [source_file("spark_aml_scorecard"), source_file("analyse_aml_patterns")]
+    
+    run_stage(
+        "generate_aml_scorecard",
+        lambda: main(argv),
+        inputs=["result/detected_account.csv", "result/detected_transaction.csv"],
+        outputs=outputs,
+        params=vars(args),
+        code_files=code_files
+    )
+
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    run_cached()
\ No newline at end of file
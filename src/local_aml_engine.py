@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML单机检测引擎 - 基于NumPy和CSR邻接结构，不启动JVM
+输入：mock_data/account.csv, mock_data/transaction.csv
+输出：result/detected_account.csv, result/detected_transaction.csv
+
+与 analyse_aml_patterns.py 的Spark实现使用相同的循环闭环、星型拆分和跨境多层规则，
+适用于几百万条边以内的单机数据集。
+"""
+
+import pandas as pd
+import numpy as np
+import csv
+import os
+from aml_id_codec import build_account_dictionary, encode_accounts, account_attribute, arrow_strings
+
+HIGH_RISK_COUNTRIES = ["高危国1", "高危国2", "高危国3"]
+
+# 检测器优先级: 同一账户/交易被多个检测器命中时保留靠前的检测器
+PATTERN_PRIORITY = ["循环闭环交易", "星型拆分入账", "跨境多层转账"]
+
+def read_csv_as_strings(path):
+    """所有列按字符串读取CSV，空值读为空字符串
+
+    安装了pyarrow时用Arrow的多线程CSV解析，得到pyarrow存储的字符串列，
+    编码和数值转换都可以直接在Arrow上完成；否则用pandas读取。
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pa_csv
+    except ImportError:
+        return pd.read_csv(path, dtype=str, keep_default_na=False)
+    
+    with open(path, "r", encoding="utf-8-sig", newline="") as f:
+        columns = next(csv.reader(f))
+    table = pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={column: pa.string() for column in columns},
+        strings_can_be_null=False,
+        quoted_strings_can_be_null=False
+    ))
+    return table.to_pandas()
+
+def load_data(data_dir="mock_data", start_date=None, end_date=None):
+    """加载账户和交易数据，所有列按字符串读取以便原样写回"""
+    print("加载账户和交易数据...")
+    
+    accounts_df = read_csv_as_strings(os.path.join(data_dir, "account.csv"))
+    transactions_df = read_csv_as_strings(os.path.join(data_dir, "transaction.csv"))
+    
+    # 按交易日期过滤 (value_date 格式为 yyyy-MM-dd HH:mm:ss)
+    transaction_dates = transactions_df["value_date"].str[:10]
+    in_range = pd.Series(True, index=transactions_df.index)
+    if start_date:
+        in_range &= transaction_dates >= start_date
+    if end_date:
+        in_range &= transaction_dates <= end_date
+    transactions_df = transactions_df[in_range].reset_index(drop=True)
+    
+    print(f"账户数据: {len(accounts_df)} 条")
+    print(f"交易数据: {len(transactions_df)} 条")
+    
+    return accounts_df, transactions_df
+
+def build_edge_arrays(accounts_df, transactions_df):
+    """将账户编码为按账户id排序的稠密整数，并构造边数组
+
+    返回 (account_ids, edges)，edges 为字典: src, dst, row(原交易行号), amount, cents, ts, day。
+    两端账户不在账户表中的交易被丢弃。
+    """
+    account_ids = build_account_dictionary(accounts_df["account_id"])
+    
+    src = encode_accounts(account_ids, transactions_df["src_account"])
+    dst = encode_accounts(account_ids, transactions_df["dst_account"])
+    valid = (src >= 0) & (dst >= 0)
+    
+    # pyarrow存储的字符串列直接由Arrow转换类型，不经过Python字符串
+    if arrow_strings(transactions_df["amount"]) and arrow_strings(transactions_df["value_date"]):
+        amount = transactions_df["amount"].astype("float64[pyarrow]").to_numpy(dtype=np.float64)
+        value_date = transactions_df["value_date"].astype("timestamp[s][pyarrow]").to_numpy(dtype="datetime64[s]")
+    else:
+        amount = pd.to_numeric(transactions_df["amount"]).to_numpy(dtype=np.float64)
+        value_date = pd.to_datetime(transactions_df["value_date"], format="%Y-%m-%d %H:%M:%S").to_numpy(dtype="datetime64[s]")
+    ts = value_date.astype(np.int64)
+    
+    rows = np.nonzero(valid)[0]
+    edges = {
+        "src": src[rows].astype(np.int64),
+        "dst": dst[rows].astype(np.int64),
+        "row": rows,
+        "amount": amount[rows],
+        "cents": np.round(amount[rows] * 100).astype(np.int64),
+        "ts": ts[rows],
+        "day": ts[rows] // 86400
+    }
+    return account_ids, edges
+
+def build_csr(keys):
+    """按key排序构造CSR: 返回 (排好序的key, 对应的原始下标)"""
+    order = np.argsort(keys)
+    return keys[order], order
+
+def csr_neighbors(sorted_keys, order, query_keys):
+    """批量查找每个query key的全部邻边
+
+    返回 (query下标, 边下标)，每个query key命中的每条边各占一行。
+    """
+    starts = np.searchsorted(sorted_keys, query_keys, side="left")
+    ends = np.searchsorted(sorted_keys, query_keys, side="right")
+    counts = ends - starts
+    total = counts.sum()
+    query_rows = np.repeat(np.arange(len(query_keys)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    return query_rows, order[np.repeat(starts, counts) + offsets]
+
+def detect_star_patterns(edges, n_accounts, min_spokes=5, max_amount=10000):
+    """星型拆分入账: 同一天至少min_spokes个不同账户向同一账户转入小额资金
+
+    返回 (账户命中列表, 交易行号命中列表)，账户命中为 (账户编码, 角色)。
+    """
+    print(f"检测星型拆分入账模式 (最少 {min_spokes} 个源账户)...")
+    
+    small = np.nonzero((edges["amount"] < max_amount) & (edges["src"] != edges["dst"]))[0]
+    group, group_keys = pd.factorize(edges["day"][small] * n_accounts + edges["dst"][small])
+    
+    # 每个 (中心账户, 日期) 的不同源账户数
+    spoke_pairs = pd.unique(group * n_accounts + edges["src"][small])
+    spoke_counts = np.bincount(spoke_pairs // n_accounts, minlength=len(group_keys))
+    star_groups = np.nonzero(spoke_counts >= min_spokes)[0]
+    print(f"找到 {len(star_groups)} 个星型拆分模式")
+    
+    hit = small[spoke_counts[group] >= min_spokes]
+    accounts = [(center, "洗钱者") for center in np.unique(group_keys[star_groups] % n_accounts)]
+    accounts += [(spoke, "协助者") for spoke in np.unique(edges["src"][hit])]
+    return accounts, edges["row"][hit]
+
+def prune_cycle_edges(edges, n_accounts, min_length=3):
+    """剪除不可能成环的边
+
+    同日同金额的边少于min_length条的分组直接丢弃；其余边迭代剪除源账户在同组内没有入边、
+    或目标账户在同组内没有出边的边。
+    """
+    candidate = np.nonzero(edges["src"] != edges["dst"])[0]
+    day = edges["day"][candidate]
+    day_offset = day - day.min() if len(day) else day
+    group, _ = pd.factorize(edges["cents"][candidate] * (day_offset.max() + 1 if len(day) else 1) + day_offset)
+    large = np.bincount(group)[group] >= min_length
+    candidate = candidate[large]
+    group = group[large]
+    
+    while len(candidate) > 0:
+        src_keys = group * n_accounts + edges["src"][candidate]
+        dst_keys = group * n_accounts + edges["dst"][candidate]
+        keep = np.isin(src_keys, dst_keys) & np.isin(dst_keys, src_keys)
+        if keep.all():
+            break
+        candidate = candidate[keep]
+        group = group[keep]
+    
+    return candidate, group
+
+def detect_circular_patterns(edges, n_accounts, max_length=4):
+    """循环闭环交易: 同日等额、长度为3..max_length的闭环
+
+    以环上编码最小的账户为起点逐跳扩展，每个环只枚举一次；
+    洗钱者为最早发起交易的账户（时间相同时取环上靠前的账户）。
+    """
+    print(f"检测循环闭环交易模式 (长度3-{max_length})...")
+    
+    candidate, group = prune_cycle_edges(edges, n_accounts)
+    src = edges["src"][candidate]
+    dst = edges["dst"][candidate]
+    sorted_keys, order = build_csr(group * n_accounts + src)
+    
+    # 初始路径: 起点编码小于下一个账户的边
+    seeds = np.nonzero(src < dst)[0]
+    path_accounts = np.stack([src[seeds], dst[seeds]], axis=1)
+    path_edges = seeds.reshape(-1, 1)
+    path_group = group[seeds]
+    
+    accounts = []
+    transactions = []
+    for length in range(2, max_length + 1):
+        if len(path_edges) == 0:
+            break
+        
+        current = path_accounts[:, -1]
+        path_rows, next_edges = csr_neighbors(sorted_keys, order, path_group * n_accounts + current)
+        start = path_accounts[path_rows, 0]
+        next_dst = dst[next_edges]
+        
+        # 闭合的环
+        if length >= 3:
+            closed = next_dst == start
+            closed_accounts = path_accounts[path_rows[closed]]
+            closed_edges = np.concatenate(
+                [path_edges[path_rows[closed]], next_edges[closed].reshape(-1, 1)], axis=1
+            )
+            print(f"找到 {len(closed_edges)} 个长度为{length}的循环")
+            
+            if len(closed_edges) > 0:
+                edge_ts = edges["ts"][candidate[closed_edges]]
+                launderer_position = np.argmin(edge_ts, axis=1)
+                launderers = closed_accounts[np.arange(len(closed_accounts)), launderer_position]
+                for ring, launderer in zip(closed_accounts, launderers):
+                    for account in ring:
+                        accounts.append((account, "洗钱者" if account == launderer else "协助者"))
+                transactions.append(edges["row"][candidate[closed_edges.reshape(-1)]])
+        
+        if length == max_length:
+            break
+        
+        # 继续扩展: 下一个账户编码大于起点且不在路径上
+        extend = next_dst > start
+        for column in range(path_accounts.shape[1]):
+            extend &= next_dst != path_accounts[path_rows, column]
+        path_accounts = np.concatenate(
+            [path_accounts[path_rows[extend]], next_dst[extend].reshape(-1, 1)], axis=1
+        )
+        path_edges = np.concatenate(
+            [path_edges[path_rows[extend]], next_edges[extend].reshape(-1, 1)], axis=1
+        )
+        path_group = path_group[path_rows[extend]]
+    
+    rows = np.concatenate(transactions) if transactions else np.array([], dtype=np.int64)
+    return accounts, rows
+
+def detect_cross_border_patterns(edges, n_accounts, account_countries,
+                                 min_layers=3, max_layers=4, min_paths=2):
+    """跨境多层转账: 同日经min_layers..max_layers层转账到达高危国家账户
+
+    从高危国家账户出发沿同日入边做有界反向搜索，按 (源账户, 目标账户, 日期) 分组，
+    至少min_paths条路径才标记。目标账户为洗钱者，路径上其余账户为协助者。
+    """
+    print(f"检测跨境多层转账模式 (反向搜索{min_layers}-{max_layers}层)...")
+    
+    high_risk = np.isin(account_countries, HIGH_RISK_COUNTRIES)
+    candidate = np.nonzero(edges["src"] != edges["dst"])[0]
+    src = edges["src"][candidate]
+    dst = edges["dst"][candidate]
+    day = edges["day"][candidate]
+    sorted_keys, order = build_csr(day * n_accounts + dst)
+    
+    # 第1层: 转入高危国家账户的边
+    seeds = np.nonzero(high_risk[dst])[0]
+    path_accounts = np.stack([src[seeds], dst[seeds]], axis=1)
+    path_edges = seeds.reshape(-1, 1)
+    
+    layered_paths = []
+    for layers in range(2, max_layers + 1):
+        head = path_accounts[:, 0]
+        path_rows, previous_edges = csr_neighbors(sorted_keys, order, day[path_edges[:, 0]] * n_accounts + head)
+        previous_src = src[previous_edges]
+        
+        extend = np.ones(len(path_rows), dtype=bool)
+        for column in range(path_accounts.shape[1]):
+            extend &= previous_src != path_accounts[path_rows, column]
+        path_accounts = np.concatenate(
+            [previous_src[extend].reshape(-1, 1), path_accounts[path_rows[extend]]], axis=1
+        )
+        path_edges = np.concatenate(
+            [previous_edges[extend].reshape(-1, 1), path_edges[path_rows[extend]]], axis=1
+        )
+        
+        if layers >= min_layers:
+            layered_paths.append((path_accounts, path_edges))
+        if len(path_edges) == 0:
+            break
+    
+    # 按 (源账户, 目标账户, 日期) 分组，查找同一天有多条路径的情况
+    groups = {}
+    for path_accounts, path_edges in layered_paths:
+        path_days = day[path_edges[:, 0]]
+        for accounts_row, edges_row, path_day in zip(path_accounts, path_edges, path_days):
+            groups.setdefault((accounts_row[0], accounts_row[-1], path_day), []).append((accounts_row, edges_row))
+    
+    accounts = []
+    transactions = []
+    group_count = 0
+    for (_, target, _), paths in groups.items():
+        if len(paths) < min_paths:
+            continue
+        group_count += 1
+        path_account_set = set()
+        for accounts_row, edges_row in paths:
+            path_account_set.update(accounts_row.tolist())
+            transactions.append(edges["row"][candidate[edges_row]])
+        for account in path_account_set:
+            accounts.append((account, "洗钱者" if account == target else "协助者"))
+    print(f"找到 {group_count} 组跨境多层转账模式 (每组至少 {min_paths} 条路径)")
+    
+    rows = np.concatenate(transactions) if transactions else np.array([], dtype=np.int64)
+    return accounts, rows
+
+def combine_detections(detections, account_ids):
+    """合并去重: 账户保留优先级最高的检测器（同一检测器内洗钱者优先），交易保留优先级最高的类型"""
+    account_hits = {}
+    transaction_hits = {}
+    for pattern_type, (accounts, rows) in detections:
+        priority = PATTERN_PRIORITY.index(pattern_type)
+        for account, role in accounts:
+            rank = (priority, 0 if role == "洗钱者" else 1)
+            account_id = account_ids[account]
+            if account_id not in account_hits or rank < account_hits[account_id][0]:
+                account_hits[account_id] = (rank, pattern_type, role)
+        for row in np.unique(rows):
+            if row not in transaction_hits:
+                transaction_hits[row] = pattern_type
+    return account_hits, transaction_hits
+
+def save_results(accounts_df, transactions_df, account_hits, transaction_hits):
+    """保存分析结果，格式与Spark实现写出的CSV一致"""
+    print("保存分析结果...")
+    
+    # 确保result目录存在
+    os.makedirs('result', exist_ok=True)
+    
+    account_results = accounts_df.copy()
+    detected_types = account_results["account_id"].map(
+        {account_id: hit[1] for account_id, hit in account_hits.items()}
+    )
+    detected_roles = account_results["account_id"].map(
+        {account_id: hit[2] for account_id, hit in account_hits.items()}
+    )
+    account_results["detected_suspicious"] = np.where(detected_types.notna(), "True", "False")
+    account_results["detected_suspicious_type"] = detected_types.fillna("")
+    account_results["detected_suspicious_role"] = detected_roles.fillna("")
+    account_results = account_results.sort_values("account_id", kind="stable")
+    account_results.to_csv("result/detected_account.csv", index=False, encoding='utf-8-sig')
+    
+    transaction_results = transactions_df.copy()
+    hit_rows = np.fromiter(transaction_hits.keys(), dtype=np.int64, count=len(transaction_hits))
+    hit_types = np.array(list(transaction_hits.values()), dtype=object)
+    detected_types = np.full(len(transaction_results), "", dtype=object)
+    detected_types[hit_rows] = hit_types
+    transaction_results["detected_suspicious"] = np.where(detected_types != "", "True", "False")
+    transaction_results["detected_suspicious_type"] = detected_types
+    transaction_results = transaction_results.sort_values(["value_date", "transaction_id"], kind="stable")
+    transaction_results.to_csv("result/detected_transaction.csv", index=False, encoding='utf-8-sig')
+    
+    # 输出统计信息
+    print(f"检测完成！")
+    print(f"检测到可疑账户: {len(account_hits)} 个")
+    print(f"检测到可疑交易: {len(transaction_hits)} 笔")
+    print(f"结果已保存到 result/ 目录")
+    
+    # 按模式统计
+    pattern_stats = {}
+    for _, pattern, _ in account_hits.values():
+        pattern_stats[pattern] = pattern_stats.get(pattern, 0) + 1
+    
+    print(f"\n按模式统计:")
+    for pattern in sorted(pattern_stats):
+        print(f"  {pattern}: {pattern_stats[pattern]} 个账户")
+
+def run_detection(accounts_df, transactions_df):
+    """运行三类检测并返回合并后的命中结果"""
+    account_ids, edges = build_edge_arrays(accounts_df, transactions_df)
+    n_accounts = len(account_ids)
+    accounts_df = accounts_df.assign(account_code=encode_accounts(account_ids, accounts_df["account_id"]))
+    account_countries = account_attribute(accounts_df, account_ids, "country")
+    
+    detections = [
+        ("循环闭环交易", detect_circular_patterns(edges, n_accounts)),
+        ("星型拆分入账", detect_star_patterns(edges, n_accounts)),
+        ("跨境多层转账", detect_cross_border_patterns(edges, n_accounts, account_countries))
+    ]
+    return combine_detections(detections, account_ids)
+
+def main(data_dir="mock_data", start_date=None, end_date=None):
+    """主函数"""
+    print("=== AML模式分析开始 (单机NumPy引擎) ===")
+    
+    try:
+        accounts_df, transactions_df = load_data(data_dir, start_date, end_date)
+        account_hits, transaction_hits = run_detection(accounts_df, transactions_df)
+        save_results(accounts_df, transactions_df, account_hits, transaction_hits)
+    
+    except Exception as e:
+        print(f"分析过程中出现错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    
+    print("=== AML模式分析完成 ===")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML风险评分 - Spark分布式实现
+输入：result/detected_account.csv, result/detected_transaction.csv
+输出：result/high_risk_accounts.csv, result/risk_score_breakdown.csv, result/risk_alert_report.md
+
+与 generate_aml_scorecard.py 使用相同的评分规则 (aml_score_rules)，特征全部由分布式聚合得到，
+只有预警报告用到的高风险账户及其交易会收集到driver。
+单独运行 (generate_aml_scorecard.py --engine spark) 时创建自己的SparkSession，
+在检测后运行 (analyse_aml_patterns.py --score) 时复用检测的SparkSession。
+"""
+
+from pyspark.sql.functions import *
+from pyspark.sql.types import *
+from pyspark.sql.window import Window
+from analyse_aml_patterns import (
+    ACCOUNT_SCHEMA, TRANSACTION_SCHEMA, create_spark_session, read_csv_with_schema,
+    format_boolean_columns, write_csv_parts, merge_csv_parts
+)
+from aml_id_codec import encode_frames, encode_accounts
+from aml_score_rules import (
+    HIGH_RISK_COUNTRIES, COUNTRY_AMOUNT_FEATURES, BUSY_DAY_THRESHOLDS, FEATURE_COLUMNS,
+    score_columns, spark_rule_columns
+)
+from generate_aml_scorecard import generate_alert_report
+import os
+
+# 检测结果CSV的显式schema: 原始数据列 + 检测结果列
+RESULT_ACCOUNT_SCHEMA = StructType(ACCOUNT_SCHEMA.fields + [
+    StructField("detected_suspicious", BooleanType(), True),
+    StructField("detected_suspicious_type", StringType(), True),
+    StructField("detected_suspicious_role", StringType(), True)
+])
+
+RESULT_TRANSACTION_SCHEMA = StructType(TRANSACTION_SCHEMA.fields + [
+    StructField("detected_suspicious", BooleanType(), True),
+    StructField("detected_suspicious_type", StringType(), True)
+])
+
+# high_risk_accounts.csv 的列，与pandas实现一致
+HIGH_RISK_COLUMNS = [
+    "account_id", "owner_name", "country", "total_score", "score_details",
+    "detected_suspicious", "detected_suspicious_type", "detected_suspicious_role", "registration_date"
+]
+
+# risk_score_breakdown.csv 的列: 评分特征和各规则组得分
+BREAKDOWN_COLUMNS = ["account_id", "country", *FEATURE_COLUMNS, *score_columns(), "total_score"]
+
+def load_results(spark, result_dir="result"):
+    """按显式schema读取检测结果，row_id 记录文件中的行序"""
+    print("加载检测结果数据...")
+    
+    accounts_df = read_csv_with_schema(spark, os.path.join(result_dir, "detected_account.csv"), RESULT_ACCOUNT_SCHEMA) \
+        .withColumn("row_id", monotonically_increasing_id()) \
+        .persist()
+    transactions_df = read_csv_with_schema(
+        spark, os.path.join(result_dir, "detected_transaction.csv"), RESULT_TRANSACTION_SCHEMA
+    ).withColumn("row_id", monotonically_increasing_id()).persist()
+    
+    return accounts_df, transactions_df
+
+def transaction_sides(accounts_df, transactions_df):
+    """把每笔交易拆成转出方和转入方两行，并关联对手方国家
+
+    列: account_id, counterparty_known, counterparty_country, amount, transaction_date, transaction_id。
+    自转账只保留转出方一行；对手方不在账户表中时 counterparty_known 为False，
+    重复账户取文件中第一次出现的国家。
+    """
+    outbound = transactions_df.select(
+        col("src_account").alias("account_id"),
+        col("dst_account").alias("counterparty_id"),
+        "amount", "value_date", "transaction_id"
+    )
+    inbound = transactions_df \
+        .filter(~col("src_account").eqNullSafe(col("dst_account"))) \
+        .select(
+            col("dst_account").alias("account_id"),
+            col("src_account").alias("counterparty_id"),
+            "amount", "value_date", "transaction_id"
+        )
+    
+    # 按 (row_id, country) 结构体取最小值即第一次出现的国家 (min_by 在Spark 3.3之前没有Python接口)
+    counterparty_countries = accounts_df.groupBy("account_id") \
+        .agg(min(struct("row_id", "country"))["country"].alias("counterparty_country")) \
+        .select(
+            col("account_id").alias("counterparty_id"),
+            "counterparty_country",
+            lit(True).alias("counterparty_known")
+        )
+    
+    return outbound.unionByName(inbound) \
+        .join(counterparty_countries, "counterparty_id", "left") \
+        .select(
+            "account_id",
+            coalesce(col("counterparty_known"), lit(False)).alias("counterparty_known"),
+            "counterparty_country",
+            "amount",
+            to_date(col("value_date")).alias("transaction_date"),
+            "transaction_id"
+        )
+
+def compute_account_features(accounts_df, transactions_df):
+    """计算评分特征表: 账户表每行一行，附加 aml_score_rules.FEATURE_COLUMNS 中的特征列"""
+    sides = transaction_sides(accounts_df, transactions_df).persist()
+    
+    # 涉及高危国家对手方的交易笔数
+    high_risk_counts = sides.groupBy("account_id").agg(
+        sum(when(col("counterparty_country").isin(HIGH_RISK_COUNTRIES), 1).otherwise(0)).alias("high_risk_trans_count")
+    )
+    
+    # 按 (账户, 对手方国家) 汇总金额，去掉与本账户国家相同的国家后按阈值统计国家数
+    country_amounts = sides.filter(col("counterparty_known")) \
+        .groupBy("account_id", "counterparty_country") \
+        .agg(sum("amount").alias("country_amount"))
+    country_counts = accounts_df.select("row_id", "account_id", "country") \
+        .join(country_amounts, "account_id") \
+        .filter(
+            col("counterparty_country").isNull() | col("country").isNull() |
+            (col("counterparty_country") != col("country"))
+        ) \
+        .groupBy("row_id") \
+        .agg(*[
+            count(when(col("country_amount") > threshold, True)).alias(feature)
+            for feature, threshold in COUNTRY_AMOUNT_FEATURES.items()
+        ])
+    
+    # 高频交易日中金额最大的一天（金额相同取较早的一天）
+    busy_day = lit(False)
+    for min_count, min_amount in BUSY_DAY_THRESHOLDS:
+        busy_day = busy_day | ((col("trans_count") > min_count) & (col("total_amount") > min_amount))
+    max_days = sides.filter(col("transaction_date").isNotNull()) \
+        .groupBy("account_id", "transaction_date") \
+        .agg(count("transaction_id").alias("trans_count"), sum("amount").alias("total_amount")) \
+        .filter(busy_day) \
+        .withColumn(
+            "day_rank",
+            row_number().over(
+                Window.partitionBy("account_id").orderBy(desc("total_amount"), asc("transaction_date"))
+            )
+        ) \
+        .filter(col("day_rank") == 1) \
+        .select(
+            "account_id",
+            col("transaction_date").alias("max_day_date"),
+            col("trans_count").alias("max_day_count"),
+            col("total_amount").alias("max_day_amount")
+        )
+    
+    return accounts_df \
+        .join(high_risk_counts, "account_id", "left") \
+        .join(country_counts, "row_id", "left") \
+        .join(max_days, "account_id", "left") \
+        .fillna(0, ["high_risk_trans_count", *COUNTRY_AMOUNT_FEATURES, "max_day_count", "max_day_amount"])
+
+def score_accounts(accounts_df, transactions_df):
+    """计算每个账户行的特征、各规则组得分、总分和评分详情"""
+    print("计算账户风险评分...")
+    
+    scores = compute_account_features(accounts_df, transactions_df)
+    for name, column in spark_rule_columns():
+        scores = scores.withColumn(name, column)
+    return scores
+
+def write_breakdown(scores):
+    """分布式写出每个账户的评分明细 result/risk_score_breakdown.csv"""
+    print("生成评分明细CSV文件...")
+    
+    breakdown = scores \
+        .withColumn("max_day_amount", round(col("max_day_amount"), 2).cast("decimal(20,2)")) \
+        .orderBy("account_id", "row_id") \
+        .select(*BREAKDOWN_COLUMNS)
+    write_csv_parts(breakdown, "result/risk_score_breakdown")
+    merge_csv_parts("result/risk_score_breakdown", "result/risk_score_breakdown.csv", BREAKDOWN_COLUMNS)
+    
+    print("评分明细已保存到 result/risk_score_breakdown.csv")
+
+def generate_high_risk_csv(scores):
+    """生成高风险账户CSV文件，按分数从大到小排序（分数相同保持检测结果中的顺序）"""
+    print("生成高风险账户CSV文件...")
+    
+    high_risk_accounts = scores.filter(col("total_score") > 80) \
+        .orderBy(desc("total_score"), asc("row_id")) \
+        .select(*HIGH_RISK_COLUMNS, "row_id") \
+        .persist()
+    
+    write_csv_parts(format_boolean_columns(high_risk_accounts.drop("row_id")), "result/high_risk_accounts")
+    merge_csv_parts("result/high_risk_accounts", "result/high_risk_accounts.csv", HIGH_RISK_COLUMNS)
+    
+    print(f"高风险账户CSV文件已保存: {high_risk_accounts.count()} 个账户")
+    return high_risk_accounts
+
+def collect_report_frames(high_risk_accounts, accounts_df, transactions_df):
+    """把预警报告用到的数据收集到driver
+
+    只收集高风险账户、涉及高风险账户的交易及这些交易的对手方账户，按检测结果中的行序排列，
+    再在这部分数据上做字典编码，返回与pandas实现相同格式的 (高风险账户, 交易, 账户) 表。
+    """
+    high_risk_ids = high_risk_accounts.select("account_id").distinct()
+    
+    # 交易的两端展开后与高风险账户做广播半连接
+    report_rows = transactions_df \
+        .select("row_id", explode(array("src_account", "dst_account")).alias("account_id")) \
+        .join(broadcast(high_risk_ids), "account_id", "left_semi") \
+        .select("row_id") \
+        .distinct()
+    report_transactions = transactions_df.join(report_rows, "row_id", "left_semi")
+    
+    involved_ids = report_transactions \
+        .select(explode(array("src_account", "dst_account")).alias("account_id")) \
+        .unionByName(high_risk_ids) \
+        .distinct()
+    report_accounts = accounts_df.join(involved_ids, "account_id", "left_semi")
+    
+    transactions_pdf = report_transactions.orderBy("row_id") \
+        .withColumn("value_date", date_format(col("value_date"), "yyyy-MM-dd HH:mm:ss")) \
+        .drop("row_id") \
+        .toPandas()
+    accounts_pdf = report_accounts.orderBy("row_id") \
+        .withColumn("registration_date", date_format(col("registration_date"), "yyyy-MM-dd")) \
+        .drop("row_id") \
+        .toPandas()
+    accounts_pdf, transactions_pdf, dictionary = encode_frames(accounts_pdf, transactions_pdf)
+    
+    high_risk_pdf = high_risk_accounts.orderBy(desc("total_score"), asc("row_id")) \
+        .withColumn("registration_date", date_format(col("registration_date"), "yyyy-MM-dd")) \
+        .drop("row_id") \
+        .toPandas()
+    high_risk_pdf["account_code"] = encode_accounts(dictionary, high_risk_pdf["account_id"])
+    
+    return high_risk_pdf, transactions_pdf, accounts_pdf
+
+def print_score_statistics(scores):
+    """输出评分统计，一次聚合得到所有分数段的账户数"""
+    score_ranges = [(0, 20), (20, 40), (40, 60), (60, 80), (80, 100), (100, None)]
+    range_counts = [
+        count(when(
+            (col("total_score") >= min_score) &
+            (lit(True) if max_score is None else col("total_score") < max_score),
+            True
+        )).alias(f"range_{index}")
+        for index, (min_score, max_score) in enumerate(score_ranges)
+    ]
+    stats = scores.agg(
+        count(lit(1)).alias("total"),
+        count(when(col("total_score") > 80, True)).alias("high_risk"),
+        max("total_score").alias("max_score"),
+        avg("total_score").alias("avg_score"),
+        *range_counts
+    ).collect()[0]
+    
+    print(f"\n=== 评分统计 ===")
+    print(f"总账户数: {stats['total']}")
+    print(f"高风险账户数 (>80分): {stats['high_risk']}")
+    print(f"最高分: {stats['max_score']}")
+    print(f"平均分: {stats['avg_score']:.2f}")
+    
+    for index, (min_score, max_score) in enumerate(score_ranges):
+        if max_score is None:
+            print(f"{min_score}分以上: {stats[f'range_{index}']} 个账户")
+        else:
+            print(f"{min_score}-{max_score}分: {stats[f'range_{index}']} 个账户")
+
+def main(spark=None):
+    """主函数，传入spark时复用该会话，否则创建并在结束时关闭"""
+    print("=== AML风险评分系统开始 (Spark分布式) ===")
+    
+    own_session = spark is None
+    if own_session:
+        spark = create_spark_session()
+    
+    try:
+        # 加载数据
+        accounts_df, transactions_df = load_results(spark)
+        
+        # 计算风险评分
+        scores = score_accounts(accounts_df, transactions_df).persist()
+        
+        # 生成评分明细和高风险账户CSV
+        write_breakdown(scores)
+        high_risk_accounts = generate_high_risk_csv(scores)
+        
+        # 生成预警报告
+        generate_alert_report(*collect_report_frames(high_risk_accounts, accounts_df, transactions_df))
+        
+        # 输出统计信息
+        print_score_statistics(scores)
+    
+    except Exception as e:
+        print(f"评分过程中出现错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    
+    finally:
+        if own_session:
+            spark.stop()
+        else:
+            # 复用的会话还会继续使用，释放本次评分缓存的数据
+            spark.catalog.clearCache()
+    
+    print("=== AML风险评分系统完成 ===")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AML流式模式分析脚本 - 使用Structured Streaming持续检测洗钱模式
+输入：mock_data/account.csv, 落地目录中持续到达的交易CSV文件（默认 stream/landing）
+输出：result/stream_alerts/ 预警交易（Parquet追加写出），stream/state/ 按交易日期保存的交易状态
+
+本地测试：
+python src/stream_aml_patterns.py --replay              # 将mock_data/transaction.csv按日期回放到落地目录
+"""
+
+from pyspark.sql.functions import *
+from analyse_aml_patterns import (
+    TRANSACTION_SCHEMA,
+    ACCOUNT_SCHEMA,
+    create_spark_session,
+    read_csv_with_schema,
+    create_graph,
+    detect_circular_patterns_with_graphframe,
+    detect_star_patterns_with_graphframe,
+    detect_cross_border_patterns_with_graphframe,
+    combine_detections
+)
+from datetime import datetime, timedelta
+import argparse
+import csv
+import os
+import shutil
+import threading
+import time
+
+def replay_transactions(landing_dir, source_path="mock_data/transaction.csv", interval=2.0):
+    """将历史交易按交易日期拆分，逐日写入落地目录，模拟全天持续到达的交易文件
+
+    每个文件先写入临时文件再原子重命名，保证文件流源不会读到写了一半的文件。
+    """
+    os.makedirs(landing_dir, exist_ok=True)
+    
+    with open(source_path, "r", encoding="utf-8-sig", newline="") as source:
+        reader = csv.reader(source)
+        header = next(reader)
+        date_index = header.index("value_date")
+        rows_by_date = {}
+        for row in reader:
+            rows_by_date.setdefault(row[date_index][:10], []).append(row)
+    
+    for transaction_date in sorted(rows_by_date):
+        file_name = f"transaction_{transaction_date}.csv"
+        temp_path = os.path.join(landing_dir, f".{file_name}.tmp")
+        with open(temp_path, "w", encoding="utf-8", newline="") as target:
+            writer = csv.writer(target)
+            writer.writerow(header)
+            writer.writerows(rows_by_date[transaction_date])
+        os.replace(temp_path, os.path.join(landing_dir, file_name))
+        print(f"回放 {transaction_date}: {len(rows_by_date[transaction_date])} 笔交易")
+        time.sleep(interval)
+
+def evict_expired_days(state_dir, latest_date, watermark_days):
+    """删除早于水位线的交易日期状态分区"""
+    if not os.path.isdir(state_dir):
+        return
+    
+    watermark_date = latest_date - timedelta(days=watermark_days)
+    for partition in sorted(os.listdir(state_dir)):
+        if not partition.startswith("transaction_date="):
+            continue
+        partition_date = datetime.strptime(partition.split("=", 1)[1], "%Y-%m-%d").date()
+        if partition_date < watermark_date:
+            shutil.rmtree(os.path.join(state_dir, partition))
+            print(f"状态分区已过水位线，移除: {partition}")
+
+def make_batch_processor(spark, account_path, state_dir, alerts_dir, watermark_days):
+    """创建foreachBatch处理函数
+
+    每个微批: 追加新交易到按日期分区的状态 -> 只对本批涉及的日期重新运行
+    循环闭环、星型拆分、跨境多层三类检测 -> 输出此前未预警过的可疑交易 -> 清理过期日期。
+    """
+    progress = {"latest_date": None}
+    
+    def process_batch(batch_df, batch_id):
+        batch_df = batch_df.withColumn("transaction_date", to_date(col("value_date"))).persist()
+        touched_dates = [
+            row["transaction_date"]
+            for row in batch_df.select("transaction_date").distinct().collect()
+            if row["transaction_date"] is not None
+        ]
+        if not touched_dates:
+            batch_df.unpersist()
+            return
+        
+        print(f"\n--- 微批 {batch_id}: 涉及日期 {', '.join(str(d) for d in sorted(touched_dates))} ---")
+        
+        # 追加到按日期分区的交易状态
+        batch_df.write.mode("append").partitionBy("transaction_date").parquet(state_dir)
+        
+        # 只对本批涉及的日期运行检测
+        accounts_df = read_csv_with_schema(spark, account_path, ACCOUNT_SCHEMA)
+        day_transactions = spark.read.parquet(state_dir) \
+            .filter(col("transaction_date").isin(touched_dates)) \
+            .select(*TRANSACTION_SCHEMA.fieldNames())
+        
+        graph, id_dictionary = create_graph(spark, accounts_df, day_transactions)
+        detections = [
+            detect_circular_patterns_with_graphframe(spark, graph),
+            detect_star_patterns_with_graphframe(spark, graph),
+            detect_cross_border_patterns_with_graphframe(spark, graph)
+        ]
+        _, detected_transactions = combine_detections(detections)
+        
+        alerts = detected_transactions \
+            .join(id_dictionary["transactions"], "edge_id") \
+            .join(day_transactions, "transaction_id") \
+            .select(
+                "transaction_id",
+                "src_account",
+                "dst_account",
+                "amount",
+                "currency",
+                "value_date",
+                "detected_suspicious_type"
+            )
+        
+        # 只输出此前未预警过的交易
+        if os.path.isdir(alerts_dir):
+            emitted = spark.read.parquet(alerts_dir).select("transaction_id")
+            alerts = alerts.join(emitted, "transaction_id", "left_anti")
+        
+        alerts = alerts.withColumn("alert_time", current_timestamp()).persist()
+        alert_count = alerts.count()
+        if alert_count > 0:
+            alerts.write.mode("append").parquet(alerts_dir)
+            print(f"新增预警交易: {alert_count} 笔")
+            alerts.orderBy("detected_suspicious_type", "value_date").show(alert_count, truncate=False)
+        else:
+            print("本批无新增预警")
+        
+        # 按水位线清理过期日期的状态
+        latest_date = sorted(touched_dates)[-1]
+        if progress["latest_date"] is None or latest_date > progress["latest_date"]:
+            progress["latest_date"] = latest_date
+        evict_expired_days(state_dir, progress["latest_date"], watermark_days)
+        
+        spark.catalog.clearCache()
+    
+    return process_batch
+
+def start_stream(spark, landing_dir, account_path, state_dir, alerts_dir, checkpoint_dir,
+                 watermark_days=1, trigger_seconds=5, max_files_per_trigger=1, once=False):
+    """启动Structured Streaming查询"""
+    transactions_stream = spark.readStream \
+        .schema(TRANSACTION_SCHEMA) \
+        .option("header", "true") \
+        .option("timestampFormat", "yyyy-MM-dd HH:mm:ss") \
+        .option("maxFilesPerTrigger", max_files_per_trigger) \
+        .csv(landing_dir)
+    
+    # 水位线之前的迟到交易被丢弃，水位线内按交易id去重
+    transactions_stream = transactions_stream \
+        .withWatermark("value_date", f"{watermark_days} days") \
+        .dropDuplicates(["transaction_id", "value_date"])
+    
+    writer = transactions_stream.writeStream \
+        .foreachBatch(make_batch_processor(spark, account_path, state_dir, alerts_dir, watermark_days)) \
+        .option("checkpointLocation", checkpoint_dir)
+    if once:
+        writer = writer.trigger(once=True)
+    else:
+        writer = writer.trigger(processingTime=f"{trigger_seconds} seconds")
+    
+    return writer.start()
+
+def parse_args(argv=None):
+    """解析命令行参数"""
+    parser = argparse.ArgumentParser(description="AML流式模式分析")
+    parser.add_argument("--landing-dir", default="stream/landing", help="交易文件落地目录")
+    parser.add_argument("--account-path", default="mock_data/account.csv", help="账户数据CSV")
+    parser.add_argument("--state-dir", default="stream/state", help="按日期分区的交易状态目录")
+    parser.add_argument("--alerts-dir", default="result/stream_alerts", help="预警交易输出目录")
+    parser.add_argument("--checkpoint-dir", default="stream/checkpoint", help="流查询checkpoint目录")
+    parser.add_argument("--watermark-days", type=int, default=1, help="按value_date计算的水位线天数")
+    parser.add_argument("--trigger-seconds", type=int, default=5, help="微批触发间隔(秒)")
+    parser.add_argument("--once", action="store_true", help="处理落地目录中已有文件后退出")
+    parser.add_argument("--timeout", type=int, default=None, help="运行指定秒数后停止")
+    parser.add_argument("--replay", action="store_true",
+                        help="后台将mock_data/transaction.csv按日期回放到落地目录")
+    parser.add_argument("--replay-source", default="mock_data/transaction.csv", help="回放使用的交易CSV")
+    parser.add_argument("--replay-interval", type=float, default=2.0, help="回放文件间隔(秒)")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    """主函数"""
+    args = parse_args(argv)
+    print("=== AML流式模式分析开始 ===")
+    
+    os.makedirs(args.landing_dir, exist_ok=True)
+    
+    # 创建Spark会话
+    spark = create_spark_session()
+    
+    try:
+        query = start_stream(
+            spark,
+            landing_dir=args.landing_dir,
+            account_path=args.account_path,
+            state_dir=args.state_dir,
+            alerts_dir=args.alerts_dir,
+            checkpoint_dir=args.checkpoint_dir,
+            watermark_days=args.watermark_days,
+            trigger_seconds=args.trigger_seconds,
+            once=args.once
+        )
+        
+        if args.replay:
+            replay_thread = threading.Thread(
+                target=replay_transactions,
+                args=(args.landing_dir, args.replay_source, args.replay_interval),
+                daemon=True
+            )
+            replay_thread.start()
+        
+        print(f"监听落地目录: {args.landing_dir}")
+        query.awaitTermination(args.timeout)
+        query.stop()
+    
+    except Exception as e:
+        print(f"流式分析过程中出现错误: {str(e)}")
+        import traceback
+        traceback.print_exc()
+    
+    finally:
+        # 关闭Spark会话
+        spark.stop()
+    
+    print("=== AML流式模式分析完成 ===")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
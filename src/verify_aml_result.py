@@ -10,16 +10,15 @@ import pandas as pd
 import numpy as np
 from collections import defaultdict
 import os
+from aml_id_codec import load_encoded_results
+from aml_stage_cache import run_stage, source_file
 
 def load_detection_results():
     """加载检测结果数据"""
     print("加载检测结果数据...")
     
-    # 加载账户检测结果
-    accounts_df = pd.read_csv('result/detected_account.csv')
-    
-    # 加载交易检测结果
-    transactions_df = pd.read_csv('result/detected_transaction.csv')
+    # 加载账户和交易检测结果，id在读入时编码为整数
+    accounts_df, transactions_df, _ = load_encoded_results()
     
     print(f"账户数据: {len(accounts_df)} 条")
     print(f"交易数据: {len(transactions_df)} 条")
@@ -390,4 +389,10 @@ def main():
     print("=== AML检测结果验证完成 ===")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    run_stage(
+        "verify_aml_result",
+        main,
+        inputs=["result/detected_account.csv", "result/detected_transaction.csv"],
+        outputs=["result/verification_report.md"],
+        code_files=[source_file("verify_aml_result"), source_file("aml_id_codec")]
+    ) 
\ No newline at end of file
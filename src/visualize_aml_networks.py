@@ -12,13 +12,15 @@ import json
 import os
 from collections import defaultdict
 import math
+from aml_id_codec import load_encoded_results, read_csv_with_ids
+from aml_stage_cache import run_stage, source_file
 
 def load_detection_data():
     """加载检测结果数据"""
     print("加载检测结果数据...")
     
-    accounts_df = pd.read_csv('result/detected_account.csv')
-    transactions_df = pd.read_csv('result/detected_transaction.csv')
+    # 账户和交易id在读入时编码为整数，筛选和关联都基于编码
+    accounts_df, transactions_df, _ = load_encoded_results()
     
     print(f"账户数据: {len(accounts_df)} 条")
     print(f"交易数据: {len(transactions_df)} 条")
@@ -30,7 +32,7 @@ def get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
     # 找到该模式的所有账户
     pattern_accounts = accounts_df[
         accounts_df['detected_suspicious_type'] == pattern_type
-    ]['account_id'].tolist()
+    ]['account_code'].tolist()
     
     if not pattern_accounts:
         print(f"  {pattern_type}模式没有相关账户")
@@ -40,8 +42,8 @@ def get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
     if pattern_type == '循环闭环交易':
         # 获取所有涉及该模式账户的交易（包括可疑和非可疑交易）
         all_related_transactions = transactions_df[
-            (transactions_df['src_account'].isin(pattern_accounts)) |
-            (transactions_df['dst_account'].isin(pattern_accounts))
+            (transactions_df['src_code'].isin(pattern_accounts)) |
+            (transactions_df['dst_code'].isin(pattern_accounts))
         ].copy()
         
         # 优先显示可疑交易，但也包含相关的普通交易以显示完整网络
@@ -50,7 +52,7 @@ def get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
         ].copy()
         
         # 合并可疑交易和相关交易，去重
-        combined_transactions = pd.concat([suspicious_transactions, all_related_transactions]).drop_duplicates(subset=['transaction_id'])
+        combined_transactions = pd.concat([suspicious_transactions, all_related_transactions]).drop_duplicates(subset=['transaction_code'])
         
         print(f"  {pattern_type}模式: 可疑交易 {len(suspicious_transactions)} 笔，相关交易 {len(combined_transactions)} 笔")
         return combined_transactions
@@ -60,13 +62,13 @@ def get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
         money_launderers = accounts_df[
             (accounts_df['detected_suspicious_type'] == pattern_type) & 
             (accounts_df['detected_suspicious_role'] == '洗钱者')
-        ]['account_id'].tolist()
+        ]['account_code'].tolist()
         
         if money_launderers:
             # 获取洗钱者相关的所有交易（作为源账户或目标账户）
             launderer_transactions = transactions_df[
-                (transactions_df['src_account'].isin(money_launderers)) |
-                (transactions_df['dst_account'].isin(money_launderers))
+                (transactions_df['src_code'].isin(money_launderers)) |
+                (transactions_df['dst_code'].isin(money_launderers))
             ].copy()
         else:
             # 如果没有洗钱者（如跨境多层转账），获取该模式的所有可疑交易
@@ -78,8 +80,8 @@ def get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
             # 如果还是没有交易，获取涉及该模式账户的所有交易
             if len(launderer_transactions) == 0:
                 launderer_transactions = transactions_df[
-                    (transactions_df['src_account'].isin(pattern_accounts)) |
-                    (transactions_df['dst_account'].isin(pattern_accounts))
+                    (transactions_df['src_code'].isin(pattern_accounts)) |
+                    (transactions_df['dst_code'].isin(pattern_accounts))
                 ].copy()
         
         return launderer_transactions
@@ -100,13 +102,13 @@ def create_network_data(accounts_df, transactions_df, pattern_type):
     # 获取洗钱者相关的所有交易
     all_transactions = get_money_launderer_transactions(accounts_df, transactions_df, pattern_type)
     
-    # 获取涉及的所有账户ID
-    involved_accounts = set(pattern_accounts['account_id'].tolist())
-    involved_accounts.update(all_transactions['src_account'].tolist())
-    involved_accounts.update(all_transactions['dst_account'].tolist())
+    # 获取涉及的所有账户编码
+    involved_accounts = set(pattern_accounts['account_code'].tolist())
+    involved_accounts.update(all_transactions['src_code'].tolist())
+    involved_accounts.update(all_transactions['dst_code'].tolist())
     
     # 获取所有涉及账户的信息
-    network_accounts = accounts_df[accounts_df['account_id'].isin(involved_accounts)].copy()
+    network_accounts = accounts_df[accounts_df['account_code'].isin(involved_accounts)].copy()
     
     # 创建节点数据
     nodes = []
@@ -752,8 +754,8 @@ def generate_index_page(created_files):
     
     # 读取统计数据
     try:
-        accounts_df = pd.read_csv('result/detected_account.csv')
-        transactions_df = pd.read_csv('result/detected_transaction.csv')
+        accounts_df = read_csv_with_ids('result/detected_account.csv')
+        transactions_df = read_csv_with_ids('result/detected_transaction.csv')
         
         total_accounts = len(accounts_df)
         total_transactions = len(transactions_df)
@@ -829,4 +831,10 @@ def main():
     print("=== AML洗钱网络可视化完成 ===")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    run_stage(
+        "visualize_aml_networks",
+        main,
+        inputs=["result/detected_account.csv", "result/detected_transaction.csv"],
+        outputs=["result/visualization"],
+        code_files=[source_file("visualize_aml_networks"), source_file("aml_id_codec")]
+    ) 
\ No newline at end of file
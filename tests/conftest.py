@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试公共配置: 把 src/ 加入模块搜索路径，提供本地SparkSession和测试工作目录
+"""
+
+import importlib.util
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "src"))
+
+# 与 analyse_aml_patterns.create_spark_session 使用相同的graphframes包
+GRAPHFRAMES_PACKAGE = "graphframes:graphframes:0.8.2-spark3.2-s_2.12"
+
+@pytest.fixture(scope="session")
+def workspace(tmp_path_factory):
+    """测试工作目录: 脚本按相对路径读写 mock_data/、result/
+
+    Spark按JVM启动时的工作目录解析相对路径，SparkSession在这个目录中启动，Python和Spark看到的相对路径一致。
+    """
+    path = tmp_path_factory.mktemp("workspace")
+    cwd = os.getcwd()
+    os.chdir(path)
+    yield path
+    os.chdir(cwd)
+
+@pytest.fixture(scope="session")
+def spark(workspace):
+    """在测试工作目录中启动的本地两线程SparkSession，安装了graphframes时同时加载其jar包；没有pyspark或Java时跳过"""
+    pytest.importorskip("pyspark")
+    from pyspark.sql import SparkSession
+    
+    builder = SparkSession.builder \
+        .master("local[2]") \
+        .appName("AML tests") \
+        .config("spark.sql.shuffle.partitions", "4") \
+        .config("spark.ui.enabled", "false")
+    if importlib.util.find_spec("graphframes") is not None:
+        builder = builder.config("spark.jars.packages", GRAPHFRAMES_PACKAGE)
+    try:
+        session = builder.getOrCreate()
+    except Exception as e:
+        pytest.skip(f"无法启动Spark: {e}")
+    session.sparkContext.setLogLevel("ERROR")
+    yield session
+    session.stop()
+
+@pytest.fixture
+def workdir(spark, workspace):
+    """清空后的测试工作目录"""
+    for name in os.listdir(workspace):
+        shutil.rmtree(workspace / name)
+    os.chdir(workspace)
+    return workspace
\ No newline at end of file
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+增量评分状态测试: 新批次只重写涉及账户所在的状态分区，结果与重建状态后评分相同
+需要pyarrow，不可用时跳过
+"""
+
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 重建后把分区文件的修改时间设为这个时间点，重写过的文件会变成当前时间
+OLD_MTIME = 1_000_000_000
+
+@pytest.fixture
+def result_dir(tmp_path, monkeypatch):
+    """在临时目录中准备仓库自带的检测结果"""
+    pytest.importorskip("pyarrow")
+    os.makedirs(tmp_path / "result")
+    for name in ["detected_account.csv", "detected_transaction.csv"]:
+        shutil.copy(os.path.join(REPO_DIR, "result", name), tmp_path / "result" / name)
+    monkeypatch.chdir(tmp_path)
+    return tmp_path / "result"
+
+def partition_mtimes(state_dir):
+    """状态目录中每个分区文件的修改时间"""
+    return {
+        os.path.relpath(os.path.join(root, name), state_dir): os.stat(os.path.join(root, name)).st_mtime_ns
+        for root, _, files in os.walk(state_dir) for name in files if name.endswith(".parquet")
+    }
+
+def test_batch_rewrites_only_touched_partitions(result_dir):
+    import generate_aml_scorecard as scorecard
+    
+    state_dir = str(result_dir / "score_state")
+    scorecard.run_incremental_scoring(state_dir=state_dir)
+    for path in partition_mtimes(state_dir):
+        os.utime(os.path.join(state_dir, path), ns=(OLD_MTIME * 10**9, OLD_MTIME * 10**9))
+    
+    # 一笔新交易只涉及两个账户
+    batch = pd.read_csv(result_dir / "detected_transaction.csv", encoding="utf-8-sig", dtype=str, nrows=1)
+    batch["transaction_id"] = "TXN_BATCH_1"
+    batch_path = str(result_dir / "batch_1.csv")
+    batch.to_csv(batch_path, index=False)
+    
+    scores = scorecard.run_incremental_scoring([batch_path], state_dir=state_dir)
+    
+    touched = {f"part-{partition:03d}.parquet"
+               for partition in scorecard.state_partitions([batch["src_account"][0], batch["dst_account"][0]])}
+    mtimes = partition_mtimes(state_dir)
+    rewritten = {path for path, mtime in mtimes.items() if mtime != OLD_MTIME * 10**9}
+    assert rewritten
+    assert {os.path.basename(path) for path in rewritten} == touched
+    assert len(mtimes) == (len(scorecard.SCORE_STATE_TABLES) + 1) * scorecard.STATE_PARTITIONS
+    
+    # 已应用过的批次不再重写任何分区
+    pd.testing.assert_frame_equal(scorecard.run_incremental_scoring([batch_path], state_dir=state_dir), scores)
+    assert partition_mtimes(state_dir) == mtimes
+    
+    rebuilt = scorecard.run_incremental_scoring([batch_path], rebuild=True, state_dir=str(result_dir / "rebuilt_state"))
+    pd.testing.assert_frame_equal(scores, rebuilt)
\ No newline at end of file
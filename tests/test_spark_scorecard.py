@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Spark评分引擎测试: 在仓库自带的检测结果上运行Spark评分，与pandas评分的输出逐字节比较
+需要pyspark和Java，不可用时跳过
+"""
+
+import os
+import shutil
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def result_dir(workdir, monkeypatch):
+    """在测试工作目录中准备仓库自带的检测结果"""
+    os.makedirs(workdir / "result")
+    for name in ["detected_account.csv", "detected_transaction.csv"]:
+        shutil.copy(os.path.join(REPO_DIR, "result", name), workdir / "result" / name)
+    monkeypatch.setenv("AML_NO_CACHE", "1")
+    return workdir / "result"
+
+def read_outputs(result_dir):
+    """读出并删除高风险账户CSV和预警报告（去掉报告中的生成时间）"""
+    with open(result_dir / "high_risk_accounts.csv", encoding="utf-8-sig") as f:
+        high_risk_csv = f.read()
+    with open(result_dir / "risk_alert_report.md", encoding="utf-8") as f:
+        report = [line for line in f.read().splitlines() if "生成时间" not in line]
+    os.remove(result_dir / "high_risk_accounts.csv")
+    os.remove(result_dir / "risk_alert_report.md")
+    return high_risk_csv, report
+
+def test_spark_engine_matches_pandas(spark, result_dir):
+    import generate_aml_scorecard
+    import spark_aml_scorecard
+    
+    generate_aml_scorecard.main([])
+    pandas_csv, pandas_report = read_outputs(result_dir)
+    
+    spark_aml_scorecard.main(spark)
+    spark_csv, spark_report = read_outputs(result_dir)
+    
+    assert len(pandas_csv.splitlines()) > 1
+    assert spark_csv == pandas_csv
+    assert spark_report == pandas_report
+    assert os.path.exists(result_dir / "risk_score_breakdown.csv")
+
+def test_counterparty_country_uses_first_duplicate_row(spark):
+    import spark_aml_scorecard
+    
+    accounts_df = spark.createDataFrame(
+        [("A", "中国", 0), ("B", "英国", 1), ("B", "朝鲜", 2)],
+        "account_id string, country string, row_id long"
+    )
+    transactions_df = spark.createDataFrame(
+        [("T1", "A", "B", 100.0, "2023-01-01 00:00:00"), ("T2", "A", "C", 50.0, "2023-01-02 00:00:00")],
+        "transaction_id string, src_account string, dst_account string, amount double, value_date string"
+    )
+    
+    sides = spark_aml_scorecard.transaction_sides(accounts_df, transactions_df)
+    rows = {
+        (row["account_id"], row["transaction_id"]): (row["counterparty_known"], row["counterparty_country"])
+        for row in sides.collect()
+    }
+    
+    assert rows[("A", "T1")] == (True, "英国")
+    assert rows[("B", "T1")] == (True, "中国")
+    assert rows[("A", "T2")] == (False, None)
\ No newline at end of file